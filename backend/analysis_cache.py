@@ -0,0 +1,32 @@
+"""Content-addressed keys for cached LLM analyses.
+
+Entries are keyed by a hash of the model name and the exact prompt sent, so a
+hit is only possible when every input to the prompt is unchanged. Prices and
+RSI move on every tick, so the prompt carries them bucketed (see ``bucket``
+and ``bucket_relative``): a cached answer keeps serving while the market only
+drifts within a bucket. The entries themselves live in a
+``shared_cache.SharedCache``.
+"""
+import hashlib
+import json
+import math
+
+
+def analysis_key(model: str, *messages: str) -> str:
+    payload = json.dumps([model, *messages], ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def bucket(value, step: float):
+    """`value` rounded to a multiple of `step`; non-numbers pass through"""
+    if not isinstance(value, (int, float)) or step <= 0 or value != value:
+        return value
+    return round(round(value / step) * step, 2)
+
+
+def bucket_relative(value, step: float):
+    """Positive `value` snapped to a geometric grid with ratio 1 + `step` (0.01 = 1% buckets)"""
+    if not isinstance(value, (int, float)) or step <= 0 or not value > 0 or math.isinf(value):
+        return value
+    ratio = math.log1p(step)
+    return round(math.exp(round(math.log(value) / ratio) * ratio), 2)
@@ -0,0 +1,86 @@
+"""Backtest of the potential score against forward returns.
+
+Every bar of every symbol is scored with ``technicals.potential_score_series``
+and paired with the return over each horizon that followed it. Observations
+are grouped by score bucket; a worker only returns per-bucket sums (count,
+sum, sum of squares, wins), so batches of symbols can run on a process pool
+and be merged by addition.
+"""
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+import technicals
+
+STATS = ('count', 'sum', 'sum_sq', 'wins')
+
+
+def forward_returns(closes: np.ndarray, horizon: int) -> np.ndarray:
+    """Return from each bar's close to the close `horizon` bars later (NaN past the end)"""
+    result = np.full_like(closes, np.nan)
+    if horizon < closes.shape[-1]:
+        result[..., :-horizon] = closes[..., horizon:] / closes[..., :-horizon] - 1
+    return result
+
+
+def evaluate_batch(bars: Sequence[Tuple[Sequence[float], ...]], fundamentals: Sequence[float],
+                   horizons: Sequence[int], edges: Sequence[float]) -> Dict[str, np.ndarray]:
+    """Per-bucket stats, each shaped (horizons, buckets), for a batch of symbols.
+
+    `bars` holds one (opens, highs, lows, closes) tuple per symbol and
+    `fundamentals` its constant fundamental points. A score falls in bucket
+    `i` when edges[i] <= score < edges[i + 1].
+    """
+    o, h, l, c = technicals.stack_bars(bars)
+    scores = technicals.potential_score_series(o, h, l, c, fundamentals)
+    buckets = len(edges) - 1
+    bucket = np.digitize(scores, edges) - 1
+    in_range = ~np.isnan(scores) & (bucket >= 0) & (bucket < buckets)
+
+    stats = {name: np.zeros((len(horizons), buckets)) for name in STATS}
+    for row, horizon in enumerate(horizons):
+        returns = forward_returns(c, horizon)
+        valid = in_range & ~np.isnan(returns)
+        index, values = bucket[valid], returns[valid]
+        stats['count'][row] = np.bincount(index, minlength=buckets)
+        stats['sum'][row] = np.bincount(index, weights=values, minlength=buckets)
+        stats['sum_sq'][row] = np.bincount(index, weights=values * values, minlength=buckets)
+        stats['wins'][row] = np.bincount(index, weights=values > 0, minlength=buckets)
+    return stats
+
+
+def merge(total: Dict[str, np.ndarray], stats: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    if not total:
+        return {name: values.copy() for name, values in stats.items()}
+    for name in STATS:
+        total[name] += stats[name]
+    return total
+
+
+def _summary(count: float, total: float, total_sq: float, wins: float) -> Dict:
+    if not count:
+        return {'observations': 0, 'mean_return': None, 'std_return': None, 'hit_rate': None}
+    mean = total / count
+    variance = max(total_sq / count - mean * mean, 0.0)
+    return {
+        'observations': int(count),
+        'mean_return': round(mean * 100, 3),
+        'std_return': round(variance ** 0.5 * 100, 3),
+        'hit_rate': round(wins / count * 100, 2),
+    }
+
+
+def report(stats: Dict[str, np.ndarray], horizons: Sequence[int], edges: Sequence[float]) -> List[Dict]:
+    """One row per horizon: every bucket and all bars together (returns in %)"""
+    rows = []
+    for row, horizon in enumerate(horizons):
+        count, total, total_sq, wins = (stats[name][row] for name in STATS)
+        rows.append({
+            'horizon': horizon,
+            'all': _summary(count.sum(), total.sum(), total_sq.sum(), wins.sum()),
+            'buckets': [
+                {'min_score': edges[i], 'max_score': edges[i + 1], **_summary(count[i], total[i], total_sq[i], wins[i])}
+                for i in range(len(edges) - 1)
+            ],
+        })
+    return rows
@@ -0,0 +1,228 @@
+"""Columnar OHLCV history files, read through memory maps.
+
+One file per (timespan, symbol) holds a fixed-size header and one contiguous
+array per column (int64 timestamps in ms, float64 prices and volume), each
+``capacity`` rows long; the header says how many rows are valid. Reads return
+NumPy views straight into the mapped file, so indicator code works on the
+page cache without per-bar objects or copies, and every worker process shares
+the same pages.
+
+Rows up to the published row count never change in place, so views handed
+out earlier stay valid and consistent. New bars are appended past that count,
+which is then published with a single aligned 8-byte write. Changing a stored
+bar (today's partial one included), history that goes back further than the
+file, or outgrowing its capacity writes a new file swapped in with
+``os.replace``; readers keep the old map. Writers take an exclusive ``flock``
+so several processes can share the directory.
+
+Each map holds a file descriptor, so at most ``max_open`` files stay mapped
+(least recently read first out); an evicted map is released as soon as the
+last view into it is gone.
+"""
+import fcntl
+import mmap
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import quote
+
+import numpy as np
+
+MAGIC = b'OHLCV001'
+HEADER = np.dtype([('magic', 'S8'), ('capacity', '<i8'), ('length', '<i8'), ('reserved', '<i8', 5)])
+COLUMNS = (
+    ('timestamp', np.dtype('<i8')),
+    ('open', np.dtype('<f8')),
+    ('high', np.dtype('<f8')),
+    ('low', np.dtype('<f8')),
+    ('close', np.dtype('<f8')),
+    ('volume', np.dtype('<f8')),
+)
+MIN_CAPACITY = 512
+_SAFE_SYMBOL = re.compile(r'^[A-Z0-9.\-^]+$')
+
+
+class BarColumns:
+    """Bars as parallel column arrays, oldest first"""
+
+    __slots__ = tuple(name for name, _ in COLUMNS)
+
+    def __init__(self, timestamp: np.ndarray, open: np.ndarray, high: np.ndarray, low: np.ndarray,
+                 close: np.ndarray, volume: np.ndarray):
+        self.timestamp = timestamp
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    @classmethod
+    def empty(cls) -> "BarColumns":
+        return cls(*(np.empty(0, dtype) for _, dtype in COLUMNS))
+
+    @classmethod
+    def from_aggs(cls, aggs) -> "BarColumns":
+        """Columns from polygon Agg objects (missing volume becomes NaN)"""
+        return cls(*(
+            np.array([getattr(bar, name) if getattr(bar, name) is not None else np.nan for bar in aggs], dtype)
+            for name, dtype in COLUMNS
+        ))
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    def __getitem__(self, index: slice) -> "BarColumns":
+        return BarColumns(*(getattr(self, name)[index] for name, _ in COLUMNS))
+
+    def since(self, timestamp_ms: int) -> "BarColumns":
+        return self[int(np.searchsorted(self.timestamp, timestamp_ms, side='left')):]
+
+
+def _offsets(capacity: int) -> Dict[str, int]:
+    offsets, position = {}, HEADER.itemsize
+    for name, dtype in COLUMNS:
+        offsets[name] = position
+        position += capacity * dtype.itemsize
+    return offsets
+
+
+def _file_size(capacity: int) -> int:
+    return HEADER.itemsize + capacity * sum(dtype.itemsize for _, dtype in COLUMNS)
+
+
+class _Mapping:
+    """A read-only map of one file; stays valid after the file is replaced"""
+
+    def __init__(self, path: Path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.inode = stat.st_ino
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = np.frombuffer(self.map, HEADER, count=1)
+        if header['magic'][0] != MAGIC:
+            raise ValueError(f"Not a bar file: {path}")
+        capacity = int(header['capacity'][0])
+        self._length = np.frombuffer(self.map, '<i8', count=1, offset=HEADER.fields['length'][1])
+        self.columns = {
+            name: np.frombuffer(self.map, dtype, count=capacity, offset=offset)
+            for (name, dtype), offset in zip(COLUMNS, _offsets(capacity).values())
+        }
+
+    def view(self) -> BarColumns:
+        length = int(self._length[0])
+        return BarColumns(*(self.columns[name][:length] for name, _ in COLUMNS))
+
+
+class BarFiles:
+    def __init__(self, directory, max_open: int = 256):
+        self.directory = Path(directory)
+        self.max_open = max_open
+        self._maps: "OrderedDict[Path, _Mapping]" = OrderedDict()
+        # Reads run on the event loop, writes on worker threads
+        self._lock = threading.Lock()
+
+    def path(self, symbol: str, timespan: str) -> Path:
+        name = symbol if _SAFE_SYMBOL.match(symbol) else quote(symbol, safe='')
+        return self.directory / timespan / f'{name}.bars'
+
+    def exists(self, symbol: str, timespan: str) -> bool:
+        return self.path(symbol, timespan).exists()
+
+    def read(self, symbol: str, timespan: str = 'day', since_ms: Optional[int] = None) -> BarColumns:
+        """Zero-copy, read-only views of the stored bars (empty if none)"""
+        mapping = self._mapping(self.path(symbol, timespan))
+        if mapping is None:
+            return BarColumns.empty()
+        bars = mapping.view()
+        return bars if since_ms is None else bars.since(since_ms)
+
+    def _mapping(self, path: Path) -> Optional[_Mapping]:
+        """The current map of `path`, None if there is no file"""
+        try:
+            inode = os.stat(path).st_ino
+        except FileNotFoundError:
+            with self._lock:
+                self._maps.pop(path, None)
+            return None
+        with self._lock:
+            mapping = self._maps.get(path)
+            if mapping is not None and mapping.inode == inode:
+                self._maps.move_to_end(path)
+                return mapping
+        mapping = _Mapping(path)
+        with self._lock:
+            self._maps[path] = mapping
+            self._maps.move_to_end(path)
+            while len(self._maps) > self.max_open:
+                # Dropping our reference unmaps (and closes the fd) once no caller holds a view
+                self._maps.popitem(last=False)
+        return mapping
+
+    def write(self, symbol: str, timespan: str, bars: BarColumns):
+        """Merge `bars` into the file; stored bars at or after their first timestamp are replaced"""
+        path = self.path(symbol, timespan)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path.with_suffix('.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            mapping = self._mapping(path)
+            current = mapping.view() if mapping is not None else BarColumns.empty()
+            if not len(bars):
+                if not path.exists():
+                    self._rewrite(path, current)
+                return
+            # Stored bars newer than the fetched window stay
+            newer = current.since(int(bars.timestamp[-1]) + 1)
+            if len(newer):
+                bars = _concat(bars, newer)
+            if len(current) and bars.timestamp[0] >= current.timestamp[0]:
+                keep = int(np.searchsorted(current.timestamp, bars.timestamp[0], side='left'))
+                # Stored rows the fetch repeats unchanged need no write; changed ones need a new file
+                repeated = len(current) - keep
+                if repeated <= len(bars) and _equal(current[keep:], bars[:repeated]):
+                    appended = bars[repeated:]
+                    capacity = len(mapping.columns['timestamp'])
+                    if not len(appended):
+                        return
+                    if len(current) + len(appended) <= capacity:
+                        self._write_tail(path, capacity, len(current), appended)
+                        return
+                bars = _concat(current[:keep], bars)
+            self._rewrite(path, bars)
+
+    def _write_tail(self, path: Path, capacity: int, start: int, bars: BarColumns):
+        """Append `bars` at row `start` (the published length), then publish the new length"""
+        offsets = _offsets(capacity)
+        length_at = HEADER.fields['length'][1]
+        fd = os.open(path, os.O_RDWR)
+        try:
+            for name, dtype in COLUMNS:
+                values = np.ascontiguousarray(getattr(bars, name), dtype)
+                os.pwrite(fd, values.tobytes(), offsets[name] + start * dtype.itemsize)
+            os.pwrite(fd, np.int64(start + len(bars)).tobytes(), length_at)
+        finally:
+            os.close(fd)
+
+    def _rewrite(self, path: Path, bars: BarColumns):
+        # Room to append for as long again before the next rewrite
+        capacity = max(MIN_CAPACITY, 2 * len(bars))
+        header = np.zeros(1, HEADER)
+        header['magic'], header['capacity'], header['length'] = MAGIC, capacity, len(bars)
+        temporary = path.with_suffix(f'.tmp{os.getpid()}')
+        with open(temporary, 'wb') as f:
+            f.truncate(_file_size(capacity))
+            f.write(header.tobytes())
+            for (name, dtype), offset in zip(COLUMNS, _offsets(capacity).values()):
+                f.seek(offset)
+                f.write(np.ascontiguousarray(getattr(bars, name), dtype).tobytes())
+        os.replace(temporary, path)
+
+
+def _equal(first: BarColumns, second: BarColumns) -> bool:
+    return all(np.array_equal(getattr(first, name), getattr(second, name), equal_nan=True) for name, _ in COLUMNS)
+
+
+def _concat(first: BarColumns, second: BarColumns) -> BarColumns:
+    return BarColumns(*(np.concatenate([getattr(first, name), getattr(second, name)]) for name, _ in COLUMNS))
@@ -0,0 +1,167 @@
+"""Persistent OHLCV bar store.
+
+Bars live in memory-mapped columnar files (see ``bar_files``), one per
+(symbol, timespan). A small sync document per (symbol, timespan) in MongoDB
+remembers which window has already been pulled from Polygon and when, so a
+request only asks upstream for the missing head of the window and for the
+trailing bars since the last sync: every `refresh_seconds` while the market
+is open, then once more after the close until the next session. With
+`leases`, one worker fills a given (symbol, timespan) while the others wait
+for its sync document instead of pulling the same bars.
+
+Polygon bars are split- and dividend-adjusted, so stored history changes
+retroactively. Every trailing pull starts one closed bar early; when that
+bar no longer matches the stored one the whole window is fetched again.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, List, Optional
+
+import numpy as np
+from polygon.rest.models import Agg
+
+from bar_files import BarColumns, BarFiles
+from market_hours import market_ttl
+from metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# fetch(symbol, timespan, from_date, to_date) -> list of polygon Agg
+FetchBars = Callable[[str, str, datetime, datetime], Awaitable[List[Agg]]]
+_PRICES = ('open', 'high', 'low', 'close')
+
+
+def _day(dt: datetime) -> datetime:
+    """Naive UTC midnight, the key bars are stored under"""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _day_from_ms(timestamp_ms: int) -> datetime:
+    return _day(datetime.fromtimestamp(timestamp_ms / 1000, timezone.utc))
+
+
+def _ms(day: datetime) -> int:
+    return int(day.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+class BarStore:
+    def __init__(self, files: BarFiles, syncs, fetch: FetchBars, refresh_seconds: float = 60,
+                 leases=None, lease_seconds: float = 60):
+        self.files = files
+        self.syncs = syncs
+        self.fetch = fetch
+        self.refresh = timedelta(seconds=refresh_seconds)
+        # One worker gap-fills a (symbol, timespan) at a time; the others wait for its sync
+        self.leases = leases
+        self.lease_seconds = lease_seconds
+
+    async def get_bars(self, symbol: str, days: int, timespan: str = 'day') -> BarColumns:
+        """Bars for the last `days` calendar days, gap-filled from Polygon.
+
+        The columns are read-only views of the mapped file.
+        """
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        start, end = _day(now - timedelta(days=days)), _day(now)
+        sync, _ = await self._read_sync(symbol, timespan)
+        if sync is None:
+            CACHE_LOOKUPS.inc(cache='bars', result='miss')
+        elif self._needs_pull(sync, start, now):
+            CACHE_LOOKUPS.inc(cache='bars', result='partial')
+        else:
+            CACHE_LOOKUPS.inc(cache='bars', result='hit')
+            return self.files.read(symbol, timespan, since_ms=_ms(start))
+
+        try:
+            if self.leases is None:
+                await self._fill(symbol, timespan, start, end, now)
+            else:
+                async def filled():
+                    current, _ = await self._read_sync(symbol, timespan)
+                    return current if current is not None and not self._needs_pull(current, start, now) else None
+
+                await self.leases.load_once(
+                    f'bars:{symbol}:{timespan}', self.lease_seconds, filled,
+                    lambda: self._fill(symbol, timespan, start, end, now),
+                )
+        except Exception as e:
+            if sync is None:
+                raise
+            logger.warning(f"Bar gap-fill failed for {symbol}, serving stored bars: {e}")
+
+        return self.files.read(symbol, timespan, since_ms=_ms(start))
+
+    async def _read_sync(self, symbol: str, timespan: str):
+        """(sync document, lost): a sync whose bar file is gone counts as missing"""
+        sync = await self.syncs.find_one({'_id': f'{symbol}:{timespan}'})
+        if sync is not None and not self.files.exists(symbol, timespan):
+            # Bars kept elsewhere before (or the data directory was wiped)
+            return None, True
+        return sync, False
+
+    def _needs_pull(self, sync: dict, start: datetime, now: datetime) -> bool:
+        return start < sync['start'] or self.is_stale(sync['synced_at'], now)
+
+    async def _fill(self, symbol: str, timespan: str, start: datetime, end: datetime, now: datetime):
+        """Pull whatever the stored window lacks, as of the current sync document"""
+        sync, lost = await self._read_sync(symbol, timespan)
+        if sync is None:
+            # The old sync window describes bars that are gone: replace it, don't widen it
+            await self._pull(symbol, timespan, start, end, now, reset=lost)
+            return
+        if start < sync['start']:
+            await self._pull(symbol, timespan, start, sync['start'] - timedelta(days=1), now)
+        if self.is_stale(sync['synced_at'], now):
+            await self._pull_tail(symbol, timespan, sync, end, now)
+
+    def is_stale(self, synced_at: datetime, now: datetime) -> bool:
+        """Due for a tail pull: `refresh` apart in session, else not before the next open.
+
+        A sync in session or right after the close leaves a partial bar, so the
+        first request after the close re-pulls once more; from then on nothing
+        changes until the market opens again.
+        """
+        ttl = market_ttl(self.refresh.total_seconds(), synced_at.replace(tzinfo=timezone.utc))
+        return now - synced_at >= timedelta(seconds=ttl)
+
+    async def _pull_tail(self, symbol: str, timespan: str, sync: dict, end: datetime, now: datetime):
+        """Bars since the last sync, re-pulling the whole window if history was re-adjusted"""
+        # Re-read the last stored bar too (today's bar is partial until close), plus the
+        # closed bar before it to check the stored adjustments against
+        last = sync.get('last') or sync['start']
+        stored = self.files.read(symbol, timespan)
+        closed = int(np.searchsorted(stored.timestamp, _ms(last), side='left'))
+        if not closed:
+            await self._pull(symbol, timespan, last, end, now)
+            return
+        check_ms = int(stored.timestamp[closed - 1])
+        # Copied out: the pull may replace the file under the view
+        expected = np.array([getattr(stored, name)[closed - 1] for name in _PRICES])
+
+        fetched = await self._pull(symbol, timespan, _day_from_ms(check_ms), end, now)
+        at = int(np.searchsorted(fetched.timestamp, check_ms, side='left'))
+        if at == len(fetched) or fetched.timestamp[at] != check_ms:
+            return
+        actual = np.array([getattr(fetched, name)[at] for name in _PRICES])
+        if not np.allclose(actual, expected, rtol=1e-9, equal_nan=True):
+            logger.info(f"Adjusted bars changed for {symbol} ({timespan}), re-pulling the stored window")
+            await self._pull(symbol, timespan, sync['start'], end, now)
+
+    async def _pull(self, symbol: str, timespan: str, start: datetime, end: datetime,
+                    now: datetime, reset: bool = False) -> BarColumns:
+        """Fetch and store [start, end]; `reset` makes it the whole synced window"""
+        fetched = BarColumns.from_aggs(await self.fetch(symbol, timespan, start, end))
+        # Written even when empty, so a symbol without bars is not refetched every time
+        await asyncio.to_thread(self.files.write, symbol, timespan, fetched)
+
+        last: Optional[datetime] = _day_from_ms(int(fetched.timestamp[-1])) if len(fetched) else None
+        if reset:
+            update = {'$set': {'synced_at': now, 'start': start, 'last': last}}
+        else:
+            update = {'$set': {'synced_at': now}, '$min': {'start': start}}
+            if last is not None:
+                update['$max'] = {'last': last}
+        await self.syncs.update_one({'_id': f'{symbol}:{timespan}'}, update, upsert=True)
+        return fetched
@@ -0,0 +1,104 @@
+"""Vectorized candlestick pattern scanner.
+
+``scan`` takes OHLC arrays for one symbol (1-D) or many symbols (2-D,
+``(symbols, bars)``) and returns one boolean mask per pattern, True on the bar
+where the pattern completes. Every bar of the history is evaluated at once.
+"""
+from typing import Dict
+
+import numpy as np
+
+# Pattern names in reporting order. Bullish/bearish names contain
+# "Alcista"/"Bajista", which the potential score relies on.
+STRONG_BULLISH = "Vela Alcista Fuerte"
+BULLISH_MARUBOZU = "Marubozu Alcista"
+STRONG_BEARISH = "Vela Bajista Fuerte"
+BEARISH_MARUBOZU = "Marubozu Bajista"
+DOJI = "Doji - Indecisión"
+HAMMER = "Martillo Alcista"
+BULLISH_ENGULFING = "Envolvente Alcista"
+BEARISH_ENGULFING = "Envolvente Bajista"
+BULLISH_HARAMI = "Harami Alcista"
+BEARISH_HARAMI = "Harami Bajista"
+MORNING_STAR = "Estrella de la Mañana Alcista"
+EVENING_STAR = "Estrella del Atardecer Bajista"
+THREE_WHITE_SOLDIERS = "Tres Soldados Blancos Alcistas"
+THREE_BLACK_CROWS = "Tres Cuervos Negros Bajistas"
+
+PATTERNS = (
+    STRONG_BULLISH, BULLISH_MARUBOZU, STRONG_BEARISH, BEARISH_MARUBOZU, DOJI, HAMMER,
+    BULLISH_ENGULFING, BEARISH_ENGULFING, BULLISH_HARAMI, BEARISH_HARAMI,
+    MORNING_STAR, EVENING_STAR, THREE_WHITE_SOLDIERS, THREE_BLACK_CROWS,
+)
+
+
+def _shift(a: np.ndarray, bars: int) -> np.ndarray:
+    """Value `bars` bars earlier, aligned to the current bar (NaN/False before the start)"""
+    out = np.full_like(a, False if a.dtype == bool else np.nan)
+    out[..., bars:] = a[..., :-bars]
+    return out
+
+
+def _ratio(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    """num / den, 0 where the candle has no range"""
+    return np.divide(num, den, out=np.zeros_like(num), where=den > 0)
+
+
+def scan(open_, high, low, close) -> Dict[str, np.ndarray]:
+    """Boolean mask per pattern, same shape as the inputs"""
+    o = np.asarray(open_, dtype=np.float64)
+    h = np.asarray(high, dtype=np.float64)
+    l = np.asarray(low, dtype=np.float64)
+    c = np.asarray(close, dtype=np.float64)
+
+    body = np.abs(c - o)
+    range_size = h - l
+    body_ratio = _ratio(body, range_size)
+    bullish = c > o
+    bearish = o > c
+    body_top = np.maximum(o, c)
+    body_bottom = np.minimum(o, c)
+
+    o1, c1, o2, c2 = _shift(o, 1), _shift(c, 1), _shift(o, 2), _shift(c, 2)
+    body1 = _shift(body, 1)
+    bullish1, bearish1 = _shift(bullish, 1), _shift(bearish, 1)
+    bullish2, bearish2 = _shift(bullish, 2), _shift(bearish, 2)
+    ratio1, ratio2 = _shift(body_ratio, 1), _shift(body_ratio, 2)
+    top1, bottom1 = _shift(body_top, 1), _shift(body_bottom, 1)
+
+    strong = body_ratio > 0.7
+    long_body = body_ratio > 0.5
+    valid = ~np.isnan(c)  # left padding of stacked symbols never matches
+    masks = {
+        STRONG_BULLISH: bullish & strong,
+        BULLISH_MARUBOZU: bullish & ~strong & (_ratio(h - c, range_size) < 0.1),
+        STRONG_BEARISH: bearish & strong,
+        BEARISH_MARUBOZU: bearish & ~strong & (_ratio(c - l, range_size) < 0.1),
+        DOJI: body_ratio < 0.1,
+        HAMMER: bullish & ((c - l) > 2 * body) & ((h - c) < body),
+        BULLISH_ENGULFING: bearish1 & bullish & (o <= c1) & (c >= o1) & (body > body1),
+        BEARISH_ENGULFING: bullish1 & bearish & (o >= c1) & (c <= o1) & (body > body1),
+        BULLISH_HARAMI: bearish1 & bullish & (body_top < o1) & (body_bottom > c1),
+        BEARISH_HARAMI: bullish1 & bearish & (body_top < c1) & (body_bottom > o1),
+        MORNING_STAR: (
+            bearish2 & (ratio2 > 0.5) & (ratio1 < 0.3) & (top1 <= c2)
+            & bullish & (c > (o2 + c2) / 2)
+        ),
+        EVENING_STAR: (
+            bullish2 & (ratio2 > 0.5) & (ratio1 < 0.3) & (bottom1 >= c2)
+            & bearish & (c < (o2 + c2) / 2)
+        ),
+        THREE_WHITE_SOLDIERS: (
+            bullish2 & bullish1 & bullish
+            & _shift(long_body, 2) & _shift(long_body, 1) & long_body
+            & (c1 > c2) & (c > c1)
+            & (o1 >= o2) & (o1 <= c2) & (o >= o1) & (o <= c1)
+        ),
+        THREE_BLACK_CROWS: (
+            bearish2 & bearish1 & bearish
+            & _shift(long_body, 2) & _shift(long_body, 1) & long_body
+            & (c1 < c2) & (c < c1)
+            & (o1 <= o2) & (o1 >= c2) & (o <= o1) & (o >= c1)
+        ),
+    }
+    return {name: mask & valid for name, mask in masks.items()}
@@ -0,0 +1,227 @@
+"""FINVIZ fundamentals: targeted snapshot parser and per-symbol TTL cache.
+
+Only the ``snapshot-table2`` block of the quote page is decoded and scanned,
+with tag patterns that skip over quoted attribute values (FINVIZ tooltips put
+markup such as ``<b>`` in them); the rest of the (large) page is never
+tokenised. BeautifulSoup is kept as a fallback for when the table is present
+but some of the labels we read cannot be found in that block.
+"""
+import asyncio
+import html as html_lib
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional, Union
+
+from bs4 import BeautifulSoup
+
+from metrics import CACHE_LOOKUPS, track_upstream
+
+logger = logging.getLogger(__name__)
+
+FINVIZ_URL = os.getenv("FINVIZ_URL", "https://finviz.com/quote.ashx?t={symbol}")
+
+# Response field -> FINVIZ label, parsed as numbers
+NUMERIC_FIELDS = {
+    'pe_ratio': 'P/E',
+    'forward_pe': 'Forward P/E',
+    'peg_ratio': 'PEG',
+    'ps_ratio': 'P/S',
+    'pb_ratio': 'P/B',
+    'beta': 'Beta',
+    'dividend_yield': 'Dividend %',
+    'rsi': 'RSI (14)',
+    'sma20': 'SMA20',
+    'sma50': 'SMA50',
+    'sma200': 'SMA200',
+    'target_price': 'Target Price',
+    'recommendation': 'Recom',
+    'roe': 'ROE',
+    'roa': 'ROA',
+    'profit_margin': 'Profit Margin',
+    'debt_equity': 'Debt/Eq',
+    'eps_ttm': 'EPS (ttm)',
+    'perf_week': 'Perf Week',
+    'perf_month': 'Perf Month',
+    'perf_quarter': 'Perf Quarter',
+    'perf_year': 'Perf Year',
+}
+# Response field -> FINVIZ label, kept as text
+TEXT_FIELDS = {
+    'volatility': 'Volatility',
+    'market_cap': 'Market Cap',
+}
+
+# Labels whose absence from the fast parse sends the page to BeautifulSoup
+EXPECTED_LABELS = frozenset(NUMERIC_FIELDS.values()) | frozenset(TEXT_FIELDS.values())
+
+_TABLE_MARKER = b'snapshot-table2'
+# Inside a tag, '>' only ends it outside quotes
+_ATTRIBUTES = r'''(?:[^>"']|"[^"]*"|'[^']*')*'''
+_CELL_RE = re.compile(rf'<td\b{_ATTRIBUTES}>(.*?)</td\s*>', re.S | re.I)
+_TAG_RE = re.compile(rf'<{_ATTRIBUTES}>')
+_NON_NUMERIC_RE = re.compile(r'[^0-9.\-]')
+
+
+def parse_number(s: str) -> Optional[float]:
+    try:
+        s = s.replace(',', '').replace('%', '').replace('B', '').replace('M', '')
+        s = _NON_NUMERIC_RE.sub('', s.split()[0])
+        return float(s) if s and s not in ['-', ''] else None
+    except (IndexError, ValueError):
+        return None
+
+
+def _pair_cells(cells) -> Dict[str, str]:
+    return {cells[i]: cells[i + 1] for i in range(0, len(cells) - 1, 2)}
+
+
+def _cell_text(cell: str) -> str:
+    # Text pieces stripped and joined, like get_text(strip=True)
+    return ''.join(html_lib.unescape(piece).strip() for piece in _TAG_RE.split(cell))
+
+
+def parse_snapshot(html: Union[bytes, str]) -> Dict[str, str]:
+    """Label -> text of the snapshot table, scanning only that table"""
+    if isinstance(html, str):
+        html = html.encode('utf-8')
+    marker = html.find(_TABLE_MARKER)
+    if marker < 0:
+        return {}
+    start = html.rfind(b'<table', 0, marker)
+    end = html.find(b'</table>', marker)
+    if start < 0 or end < 0:
+        return parse_snapshot_soup(html)
+
+    block = html[start:end].decode('utf-8', errors='replace')
+    data = {}
+    for row in re.split(r'</tr\s*>', block, flags=re.I):
+        data.update(_pair_cells([_cell_text(cell) for cell in _CELL_RE.findall(row)]))
+    if EXPECTED_LABELS <= data.keys():
+        return data
+    return parse_snapshot_soup(html) or data
+
+
+def parse_snapshot_soup(html: Union[bytes, str]) -> Dict[str, str]:
+    """Reference parser building the full document tree (slow)"""
+    soup = BeautifulSoup(html, 'html.parser')
+    table = soup.find('table', class_='snapshot-table2')
+    if not table:
+        return {}
+    data = {}
+    for row in table.find_all('tr'):
+        data.update(_pair_cells([cell.get_text(strip=True) for cell in row.find_all('td')]))
+    return data
+
+
+def extract_fundamentals(data: Dict[str, str]) -> Dict:
+    if not data:
+        return {}
+    parsed = {field: parse_number(data.get(label, '')) for field, label in NUMERIC_FIELDS.items()}
+    parsed.update({field: data.get(label, '') for field, label in TEXT_FIELDS.items()})
+    return parsed
+
+
+def parse_fundamentals(html: Union[bytes, str]) -> Dict:
+    return extract_fundamentals(parse_snapshot(html))
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class FundamentalsStore:
+    """Per-symbol fundamentals cached in memory and MongoDB for `ttl` seconds.
+
+    Expired documents are kept so a failed refresh can still serve the last
+    known values. With `leases`, a miss is downloaded by one worker while the
+    others wait for its document.
+    """
+
+    def __init__(self, collection, http_client, ttl: float = 6 * 3600, concurrency: int = 8, upstream=None,
+                 leases=None, lease_seconds: float = 30):
+        self.collection = collection
+        self.http_client = http_client
+        self.upstream = upstream
+        self.leases = leases
+        self.lease_seconds = lease_seconds
+        self.ttl = timedelta(seconds=ttl)
+        self.concurrency = concurrency
+        self._memory: Dict[str, tuple] = {}
+
+    async def get(self, symbol: str) -> Dict:
+        now = _utcnow()
+        entry = self._memory.get(symbol)
+        if entry is not None and now - entry[0] < self.ttl:
+            CACHE_LOOKUPS.inc(cache='fundamentals', result='memory')
+            return entry[1]
+
+        doc = await self.collection.find_one({'_id': symbol})
+        if doc is not None and now - doc['fetched_at'] < self.ttl:
+            self._memory[symbol] = (doc['fetched_at'], doc['data'])
+            CACHE_LOOKUPS.inc(cache='fundamentals', result='mongo')
+            return doc['data']
+
+        CACHE_LOOKUPS.inc(cache='fundamentals', result='miss')
+        try:
+            if self.leases is None:
+                return await self._refresh(symbol)
+            return await self.leases.load_once(
+                f'fundamentals:{symbol}', self.lease_seconds,
+                lambda: self._stored(symbol), lambda: self._refresh(symbol),
+            )
+        except Exception as e:
+            logger.error(f"FINVIZ scraping error for {symbol}: {e}")
+            return doc['data'] if doc is not None else {}
+
+    async def refresh(self, symbols: Iterable[str]) -> Dict[str, Dict]:
+        """Re-download fundamentals for many symbols, a few at a time"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def refresh_one(symbol: str):
+            async with semaphore:
+                try:
+                    return symbol, await self._refresh(symbol)
+                except Exception as e:
+                    logger.error(f"FINVIZ refresh error for {symbol}: {e}")
+                    return symbol, {}
+
+        return dict(await asyncio.gather(*(refresh_one(s) for s in set(symbols))))
+
+    async def fetch(self, symbol: str) -> Dict:
+        url = FINVIZ_URL.format(symbol=symbol)
+
+        async def download(timeout=None) -> bytes:
+            response = await self.http_client.get(url, **({'timeout': timeout} if timeout else {}))
+            response.raise_for_status()
+            return response.content
+
+        if self.upstream is not None:
+            # Retries, adaptive concurrency and circuit breaking (see upstream.Upstream)
+            content = await self.upstream.call(download, 'quote')
+        else:
+            with track_upstream('finviz', 'quote'):
+                content = await download()
+        # Parsing is CPU bound; keep it off the event loop
+        return await asyncio.to_thread(parse_fundamentals, content)
+
+    async def _stored(self, symbol: str) -> Optional[Dict]:
+        """Fresh data another worker stored meanwhile, if any"""
+        doc = await self.collection.find_one({'_id': symbol})
+        if doc is None or _utcnow() - doc['fetched_at'] >= self.ttl:
+            return None
+        self._memory[symbol] = (doc['fetched_at'], doc['data'])
+        return doc['data']
+
+    async def _refresh(self, symbol: str) -> Dict:
+        data = await self.fetch(symbol)
+        if not data:
+            # Unknown symbol or blocked page: do not overwrite good data
+            return {}
+        fetched_at = _utcnow()
+        self._memory[symbol] = (fetched_at, data)
+        await self.collection.replace_one(
+            {'_id': symbol}, {'data': data, 'fetched_at': fetched_at}, upsert=True
+        )
+        return data
@@ -0,0 +1,41 @@
+"""Conditional GET for polled JSON endpoints.
+
+A route computes an ETag from the versions of the data behind its response
+and answers ``304 Not Modified`` when the client already holds it, skipping
+the body altogether. Full responses are encoded with orjson, which also
+serializes NumPy arrays and scalars directly.
+"""
+import hashlib
+from typing import Any, Optional
+
+import orjson
+from fastapi.responses import ORJSONResponse, Response
+
+_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def make_etag(*versions: Any) -> str:
+    """Strong ETag of JSON-serializable version values (order-sensitive)"""
+    payload = orjson.dumps(versions, default=str, option=_OPTIONS)
+    return '"' + hashlib.blake2b(payload, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison: W/ prefixes are ignored"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in (tag[2:] if tag.startswith('W/') else tag for tag in tags)
+
+
+def cache_headers(etag: str) -> dict:
+    # Cached copies must be revalidated, which is what makes the 304 path work in browsers
+    return {'ETag': etag, 'Cache-Control': 'no-cache'}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
+
+
+def json_response(content: Any, etag: Optional[str] = None) -> ORJSONResponse:
+    return ORJSONResponse(content, headers=cache_headers(etag) if etag is not None else None)
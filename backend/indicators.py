@@ -0,0 +1,164 @@
+"""Vectorized technical indicators.
+
+Every function accepts a 1-D array (one symbol) or a 2-D array of shape
+``(symbols, bars)`` and works along the last axis, returning arrays of the
+same shape. Warm-up positions are NaN. Rows of different length can be
+stacked by left-padding them with NaN.
+
+Recursive indicators (EMA, RSI, ATR) iterate over bars once with the work for
+all symbols done in a single NumPy operation per step, so screening many
+symbols costs roughly the same as one.
+"""
+from typing import Dict, Tuple
+
+import numpy as np
+
+
+def _as_2d(values) -> Tuple[np.ndarray, bool]:
+    arr = np.asarray(values, dtype=np.float64)
+    if arr.ndim == 1:
+        return arr[np.newaxis, :], True
+    return arr, False
+
+
+def _restore(arr: np.ndarray, squeeze: bool) -> np.ndarray:
+    return arr[0] if squeeze else arr
+
+
+def _smooth(x: np.ndarray, alpha: float, period: int) -> np.ndarray:
+    """Exponential smoothing seeded with the mean of the first `period` values.
+
+    Each row starts at its first non-NaN value, so left-padded rows are fine.
+    """
+    rows, bars = x.shape
+    if bars < period:
+        return np.full_like(x, np.nan)
+
+    start = np.argmax(~np.isnan(x), axis=1)
+    seed_at = start + period - 1
+    rows_idx = np.arange(rows)
+    csum = np.concatenate([np.zeros((rows, 1)), np.nancumsum(x, axis=1)], axis=1)
+    seed = (csum[rows_idx, np.minimum(seed_at + 1, bars)] - csum[rows_idx, start]) / period
+
+    if rows == 1:
+        # A single series is faster as a plain float loop than as per-bar NumPy calls
+        series = x[0].tolist()
+        result = [np.nan] * bars
+        first, prev = int(seed_at[0]), float(seed[0])
+        if first < bars:
+            result[first] = prev
+            for t in range(first + 1, bars):
+                prev += alpha * (series[t] - prev)
+                result[t] = prev
+        return np.array([result])
+
+    # Walk bars-major so each step reads and writes contiguous memory
+    columns = np.ascontiguousarray(x.T)
+    result = np.full_like(columns, np.nan)
+    prev = np.full(rows, np.nan)
+    for t in range(int(seed_at.min()), bars):
+        prev += alpha * (columns[t] - prev)
+        seeding = seed_at == t
+        if seeding.any():
+            prev[seeding] = seed[seeding]
+        result[t] = prev
+    return result.T.copy()
+
+
+def _window_sum(values: np.ndarray, period: int) -> np.ndarray:
+    csum = np.cumsum(values, axis=1)
+    csum[:, period:] = csum[:, period:] - csum[:, :-period]
+    return csum[:, period - 1:]
+
+
+def _rolling_moments(x: np.ndarray, period: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Rolling mean and population variance in O(bars) via running sums.
+
+    Windows touching a NaN come out NaN.
+    """
+    mean = np.full_like(x, np.nan)
+    var = np.full_like(x, np.nan)
+    if x.shape[1] < period:
+        return mean, var
+    valid = ~np.isnan(x)
+    filled = np.where(valid, x, 0.0)
+    full = _window_sum(valid.astype(np.float64), period) == period
+    window_mean = _window_sum(filled, period) / period
+    window_var = np.maximum(_window_sum(filled * filled, period) / period - window_mean ** 2, 0.0)
+    mean[:, period - 1:] = np.where(full, window_mean, np.nan)
+    var[:, period - 1:] = np.where(full, window_var, np.nan)
+    return mean, var
+
+
+def sma(close, period: int) -> np.ndarray:
+    x, squeeze = _as_2d(close)
+    return _restore(_rolling_moments(x, period)[0], squeeze)
+
+
+def ema(close, period: int) -> np.ndarray:
+    x, squeeze = _as_2d(close)
+    return _restore(_smooth(x, 2 / (period + 1), period), squeeze)
+
+
+def rsi(close, period: int = 14) -> np.ndarray:
+    """Wilder's RSI"""
+    x, squeeze = _as_2d(close)
+    change = np.diff(x, axis=1, prepend=np.nan)
+    gains = _smooth(np.where(change > 0, change, np.where(np.isnan(change), np.nan, 0.0)), 1 / period, period)
+    losses = _smooth(np.where(change < 0, -change, np.where(np.isnan(change), np.nan, 0.0)), 1 / period, period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = 100 - 100 / (1 + gains / losses)
+    out = np.where((losses == 0) & ~np.isnan(gains), 100.0, out)
+    return _restore(out, squeeze)
+
+
+def macd(close, fast: int = 12, slow: int = 26, signal: int = 9) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(MACD line, signal line, histogram)"""
+    x, squeeze = _as_2d(close)
+    line = _smooth(x, 2 / (fast + 1), fast) - _smooth(x, 2 / (slow + 1), slow)
+    signal_line = _smooth(line, 2 / (signal + 1), signal)
+    return tuple(_restore(a, squeeze) for a in (line, signal_line, line - signal_line))
+
+
+def bollinger(close, period: int = 20, width: float = 2.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(middle, upper, lower) bands using the population standard deviation"""
+    x, squeeze = _as_2d(close)
+    middle, var = _rolling_moments(x, period)
+    spread = width * np.sqrt(var)
+    return tuple(_restore(a, squeeze) for a in (middle, middle + spread, middle - spread))
+
+
+def atr(high, low, close, period: int = 14) -> np.ndarray:
+    """Wilder's Average True Range"""
+    h, squeeze = _as_2d(high)
+    l, _ = _as_2d(low)
+    c, _ = _as_2d(close)
+    prev_close = np.concatenate([np.full((c.shape[0], 1), np.nan), c[:, :-1]], axis=1)
+    true_range = np.fmax(h - l, np.fmax(np.abs(h - prev_close), np.abs(l - prev_close)))
+    return _restore(_smooth(true_range, 1 / period, period), squeeze)
+
+
+def compute_indicators(close, high=None, low=None, volume=None) -> Dict[str, np.ndarray]:
+    """All indicators for the given bars in one batched pass"""
+    close = np.asarray(close, dtype=np.float64)
+    macd_line, macd_signal, macd_hist = macd(close)
+    bb_middle, bb_upper, bb_lower = bollinger(close)
+    result = {
+        'ema_20': ema(close, 20),
+        'ema_50': ema(close, 50),
+        'sma_20': sma(close, 20),
+        'sma_50': sma(close, 50),
+        'sma_200': sma(close, 200),
+        'rsi': rsi(close),
+        'macd': macd_line,
+        'macd_signal': macd_signal,
+        'macd_hist': macd_hist,
+        'bollinger_middle': bb_middle,
+        'bollinger_upper': bb_upper,
+        'bollinger_lower': bb_lower,
+    }
+    if high is not None and low is not None:
+        result['atr'] = atr(high, low, close)
+    if volume is not None:
+        result['volume_sma_20'] = sma(volume, 20)
+    return result
@@ -0,0 +1,52 @@
+"""US equity regular trading session helpers (NYSE hours, weekends closed).
+
+Exchange holidays are not modelled; on a holiday the market is reported open
+during the usual session, which only makes caches expire sooner than needed.
+"""
+from datetime import datetime, time, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+MARKET_TZ = ZoneInfo("America/New_York")
+MARKET_OPEN = time(9, 30)
+MARKET_CLOSE = time(16, 0)
+
+
+def _market_now(now: Optional[datetime]) -> datetime:
+    return (now or datetime.now(timezone.utc)).astimezone(MARKET_TZ)
+
+
+def is_market_open(now: Optional[datetime] = None) -> bool:
+    local = _market_now(now)
+    return local.weekday() < 5 and MARKET_OPEN <= local.time() < MARKET_CLOSE
+
+
+def next_market_open(now: Optional[datetime] = None) -> datetime:
+    """Start of the next regular session strictly after `now`"""
+    local = _market_now(now)
+    day = local.date()
+    if local.time() >= MARKET_OPEN:
+        day += timedelta(days=1)
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return datetime.combine(day, MARKET_OPEN, tzinfo=MARKET_TZ)
+
+
+def seconds_until_open(now: Optional[datetime] = None) -> float:
+    now = now or datetime.now(timezone.utc)
+    return (next_market_open(now) - now).total_seconds()
+
+
+def market_ttl(open_ttl: float, now: Optional[datetime] = None) -> float:
+    """TTL for market-derived data: `open_ttl` in session, otherwise until the next open"""
+    if is_market_open(now):
+        return open_ttl
+    return max(open_ttl, seconds_until_open(now))
+
+
+def market_interval(open_interval: float, closed_interval: float, now: Optional[datetime] = None) -> float:
+    """Delay until the next refresh: `open_interval` in session, otherwise
+    `closed_interval` but waking up for the open"""
+    if is_market_open(now):
+        return open_interval
+    return max(min(closed_interval, seconds_until_open(now)), 1.0)
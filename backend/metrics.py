@@ -0,0 +1,228 @@
+"""In-process metrics exposed in the Prometheus text format.
+
+Counters, gauges and histograms are labelled families registered on the
+module-level REGISTRY. Upstream calls are wrapped in ``track_upstream``, which
+feeds the latency histogram, error counter and in-flight gauge and also adds
+the call to the current request's stage timings (sent as ``Server-Timing``).
+"""
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+INF_BOUND = 'le="+Inf"'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        # Mongo command events arrive on driver threads
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value) -> List[str]:
+        return [f'{self.name}{_format_labels(self.labels, key)} {float(value)}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self, key, value) -> List[str]:
+        counts, total, count = value
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labels, key, f'le="{bound}"')
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, INF_BOUND)} {count}')
+        lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {total}')
+        lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self._metrics for line in metric.render()) + '\n'
+
+
+REGISTRY = Registry()
+
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    'upstream_request_seconds', 'Latency of calls to external services', ('upstream', 'operation'))
+UPSTREAM_ERRORS = REGISTRY.counter(
+    'upstream_errors_total', 'Failed calls to external services', ('upstream', 'operation', 'error'))
+UPSTREAM_IN_FLIGHT = REGISTRY.gauge(
+    'upstream_in_flight', 'Calls to external services currently running', ('upstream',))
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'http_request_seconds', 'Time to response headers per route', ('method', 'route', 'status'))
+RATE_LIMIT_WAIT = REGISTRY.histogram(
+    'rate_limit_wait_seconds', 'Time spent waiting for an upstream call budget token', ('upstream', 'priority'))
+CACHE_LOOKUPS = REGISTRY.counter(
+    'cache_lookups_total', 'Cache lookups by cache and outcome', ('cache', 'result'))
+EVENT_LOOP_LAG = REGISTRY.histogram(
+    'event_loop_lag_seconds', 'Delay of event loop wake-ups past their deadline',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+EVENT_LOOP_LAG_LAST = REGISTRY.gauge('event_loop_lag_last_seconds', 'Most recent event loop lag sample')
+
+# Stage name -> accumulated seconds for the request being served
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar('request_timings', default=None)
+
+
+def start_request_timings() -> Dict[str, float]:
+    """Collect stage timings for the current request (and the tasks it spawns)"""
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def record_stage(name: str, seconds: float):
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """Server-Timing header value; concurrent stages overlap, so they may add up past `total`"""
+    return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings.items())
+
+
+@contextmanager
+def track_upstream(upstream: str, operation: str):
+    UPSTREAM_IN_FLIGHT.inc(upstream=upstream)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        UPSTREAM_ERRORS.inc(upstream=upstream, operation=operation, error=type(e).__name__)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        UPSTREAM_IN_FLIGHT.dec(upstream=upstream)
+        UPSTREAM_SECONDS.observe(elapsed, upstream=upstream, operation=operation)
+        record_stage(upstream, elapsed)
+
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """Sample how late the loop wakes up from a timed sleep; run as a background task"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        EVENT_LOOP_LAG.observe(lag)
+        EVENT_LOOP_LAG_LAST.set(lag)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Per-command MongoDB latency, errors and in-flight count"""
+
+    def started(self, event):
+        UPSTREAM_IN_FLIGHT.inc(upstream='mongo')
+
+    def succeeded(self, event):
+        UPSTREAM_IN_FLIGHT.dec(upstream='mongo')
+        UPSTREAM_SECONDS.observe(event.duration_micros / 1e6, upstream='mongo', operation=event.command_name)
+
+    def failed(self, event):
+        UPSTREAM_IN_FLIGHT.dec(upstream='mongo')
+        UPSTREAM_SECONDS.observe(event.duration_micros / 1e6, upstream='mongo', operation=event.command_name)
+        error = (event.failure or {}).get('codeName') or 'CommandError'
+        UPSTREAM_ERRORS.inc(upstream='mongo', operation=event.command_name, error=error)
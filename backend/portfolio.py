@@ -0,0 +1,170 @@
+"""Portfolio lots in MongoDB.
+
+Dates are stored as native BSON dates and reads go through cursors, paged by
+``seq`` so no page needs an offset scan and nothing loads the whole collection
+at once. ``seq`` comes from an atomic counter, so unlike ObjectIds (whose
+order across processes is only per second) it strictly increases with every
+insert, whichever worker makes it.
+
+A second collection keeps one position per symbol (shares, cost basis, lot
+count), adjusted with ``$inc`` whenever a lot is added or removed.
+"""
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, ReplaceOne, ReturnDocument, UpdateOne
+
+DATE_FIELDS = ('purchase_date', 'timestamp')
+
+
+def _utc(doc: Dict) -> Dict:
+    """BSON dates come back naive; they are UTC"""
+    for field in DATE_FIELDS:
+        value = doc.get(field)
+        if isinstance(value, datetime) and value.tzinfo is None:
+            doc[field] = value.replace(tzinfo=timezone.utc)
+    return doc
+
+
+def _public(doc: Dict) -> Dict:
+    doc.pop('_id', None)
+    doc.pop('seq', None)
+    return _utc(doc)
+
+
+def parse_cursor(cursor: Optional[str]) -> Optional[int]:
+    if not cursor:
+        return None
+    try:
+        return int(cursor)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+class PortfolioStore:
+    def __init__(self, collection, positions, counters, batch_size: int = 1000):
+        self.collection = collection
+        self.positions = positions
+        self.counters = counters
+        self.batch_size = batch_size
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([('id', ASCENDING)], unique=True)
+        await self.collection.create_index([('symbol', ASCENDING)])
+        await self.collection.create_index([('seq', ASCENDING)])
+
+    async def _take_seq(self, count: int = 1) -> int:
+        """Reserve `count` sequence numbers; returns the first"""
+        counter = await self.counters.find_one_and_update(
+            {'_id': 'portfolio_lots'}, {'$inc': {'seq': count}},
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        return counter['seq'] - count + 1
+
+    async def migrate_seq(self) -> int:
+        """Number lots stored before `seq` existed, in their `_id` order"""
+        numbered = 0
+        while True:
+            docs = await self.collection.find({'seq': {'$exists': False}}, {'_id': 1}) \
+                .sort('_id', ASCENDING).limit(self.batch_size).to_list(self.batch_size)
+            if not docs:
+                return numbered
+            first = await self._take_seq(len(docs))
+            # Another worker numbering the same lots wins or loses per lot, never both
+            result = await self.collection.bulk_write([
+                UpdateOne({'_id': doc['_id'], 'seq': {'$exists': False}}, {'$set': {'seq': first + offset}})
+                for offset, doc in enumerate(docs)
+            ], ordered=False)
+            numbered += result.modified_count
+
+    async def migrate_dates(self) -> int:
+        """Convert lots saved with ISO-string dates to BSON dates"""
+        legacy = {'$or': [{field: {'$type': 'string'}} for field in DATE_FIELDS]}
+        converted, updates = 0, []
+        async for doc in self.collection.find(legacy, {field: 1 for field in DATE_FIELDS}):
+            fields = {
+                field: datetime.fromisoformat(doc[field])
+                for field in DATE_FIELDS if isinstance(doc.get(field), str)
+            }
+            updates.append(UpdateOne({'_id': doc['_id']}, {'$set': fields}))
+            if len(updates) >= self.batch_size:
+                converted += (await self.collection.bulk_write(updates, ordered=False)).modified_count
+                updates = []
+        if updates:
+            converted += (await self.collection.bulk_write(updates, ordered=False)).modified_count
+        return converted
+
+    async def insert(self, lot: Dict) -> Dict:
+        """Store a lot; returns its symbol's updated position"""
+        await self.collection.insert_one(dict(lot, seq=await self._take_seq()))
+        return await self._adjust_position(lot, 1)
+
+    async def delete(self, lot_id: str) -> Optional[Dict]:
+        """Remove a lot; returns its symbol's updated position (lots == 0 once closed), None if unknown"""
+        lot = await self.collection.find_one_and_delete({'id': lot_id})
+        if lot is None:
+            return None
+        position = await self._adjust_position(lot, -1)
+        if position['lots'] <= 0:
+            await self.positions.delete_one({'_id': lot['symbol'], 'lots': {'$lte': 0}})
+        return position
+
+    async def _adjust_position(self, lot: Dict, sign: int) -> Dict:
+        shares = lot['shares']
+        return await self.positions.find_one_and_update(
+            {'_id': lot['symbol']},
+            {'$inc': {'shares': sign * shares, 'cost': sign * shares * lot['purchase_price'], 'lots': sign}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def version(self) -> str:
+        """Changes whenever a lot is added or removed.
+
+        Lots are never edited and every insert takes a larger `seq`, so the
+        lot count and the newest `seq` together never repeat for other contents.
+        """
+        count = await self.collection.estimated_document_count()
+        newest = await self.collection.find_one({}, {'seq': 1}, sort=[('seq', -1)])
+        return f"{count}:{newest['seq'] if newest is not None else ''}"
+
+    async def load_positions(self) -> Dict[str, Tuple[float, float]]:
+        """symbol -> (shares, cost basis) for every open position"""
+        return {
+            doc['_id']: (doc['shares'], doc['cost'])
+            async for doc in self.positions.find({'lots': {'$gt': 0}})
+        }
+
+    async def rebuild_positions(self):
+        """Recompute every position from the lots (startup / repair).
+
+        Positions are replaced one by one, never dropped wholesale, so
+        readers always find every open position.
+        """
+        grouped = self.collection.aggregate([{'$group': {
+            '_id': '$symbol',
+            'shares': {'$sum': '$shares'},
+            'cost': {'$sum': {'$multiply': ['$shares', '$purchase_price']}},
+            'lots': {'$sum': 1},
+        }}])
+        positions = [doc async for doc in grouped]
+        for start in range(0, len(positions), self.batch_size):
+            await self.positions.bulk_write([
+                ReplaceOne({'_id': doc['_id']}, doc, upsert=True)
+                for doc in positions[start:start + self.batch_size]
+            ], ordered=False)
+        await self.positions.delete_many({'_id': {'$nin': [doc['_id'] for doc in positions]}})
+
+    async def page(self, limit: int, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Up to `limit` lots after `cursor`, and the cursor of the next page (None at the end)"""
+        after = parse_cursor(cursor)
+        query = {'seq': {'$gt': after}} if after is not None else {}
+        docs = await self.collection.find(query).sort('seq', ASCENDING).limit(limit + 1).to_list(limit + 1)
+        next_cursor = str(docs[limit - 1]['seq']) if len(docs) > limit else None
+        return [_public(doc) for doc in docs[:limit]], next_cursor
+
+    async def iter_lots(self, projection: Optional[Dict] = None) -> AsyncIterator[Dict]:
+        """Every lot in insertion order, fetched `batch_size` documents at a time"""
+        cursor = self.collection.find({}, projection).sort('seq', ASCENDING).batch_size(self.batch_size)
+        async for doc in cursor:
+            yield _public(doc)
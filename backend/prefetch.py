@@ -0,0 +1,61 @@
+"""Background warming of per-symbol data.
+
+The scheduler periodically runs ``warm(symbol)`` for every symbol returned by
+``symbols()``, a few at a time and at background priority (see
+``rate_limit``). It runs every ``open_interval`` seconds while the market is
+open and every ``closed_interval`` otherwise, waking up for the open. With a
+``claim`` callback, a period is skipped unless ``claim(period)`` returns True,
+so several worker processes do not warm the same symbols.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Iterable, Optional
+
+from market_hours import market_interval
+from rate_limit import background_priority
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchScheduler:
+    def __init__(self, symbols: Callable[[], Awaitable[Iterable[str]]], warm: Callable[[str], Awaitable],
+                 concurrency: int = 4, open_interval: float = 300, closed_interval: float = 3600,
+                 claim: Optional[Callable[[float], Awaitable[bool]]] = None):
+        self.symbols = symbols
+        self.warm = warm
+        self.concurrency = concurrency
+        self.open_interval = open_interval
+        self.closed_interval = closed_interval
+        self.claim = claim
+
+    async def run_once(self) -> int:
+        """Warm every symbol once; returns how many succeeded"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def warm_one(symbol: str) -> bool:
+            async with semaphore:
+                try:
+                    await self.warm(symbol)
+                    return True
+                except Exception as e:
+                    logger.warning(f"Prefetch failed for {symbol}: {e}")
+                    return False
+
+        with background_priority():
+            symbols = sorted(set(await self.symbols()))
+            results = await asyncio.gather(*(warm_one(symbol) for symbol in symbols))
+        return sum(results)
+
+    def next_delay(self) -> float:
+        # Sleep through the closed market but be warm for the open
+        return market_interval(self.open_interval, self.closed_interval)
+
+    async def run(self):
+        while True:
+            try:
+                if self.claim is None or await self.claim(self.next_delay()):
+                    warmed = await self.run_once()
+                    logger.info(f"Prefetch warmed {warmed} symbols")
+            except Exception as e:
+                logger.error(f"Prefetch error: {e}")
+            await asyncio.sleep(self.next_delay())
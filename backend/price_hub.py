@@ -0,0 +1,222 @@
+"""Shared real-time price feed.
+
+One upstream subscription per symbol is shared by every connected client: the
+hub reference-counts client subscriptions, keeps an in-memory last-price
+table and fans updates out to subscribers. Slow clients never block the feed;
+each subscriber only keeps the newest pending update per symbol.
+
+Only clients open upstream subscriptions, and the feed connection is closed
+once no client has been subscribed for `idle_timeout` seconds, so a worker
+without connected clients holds no upstream connection. Watchers (the
+portfolio valuation) see every published update without subscribing.
+"""
+import asyncio
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# publish(symbol, price, timestamp_ms)
+Publish = Callable[[str, float, Optional[int]], None]
+
+
+class PolygonPriceFeed:
+    """Polygon stocks WebSocket; `channel` "AM" (minute aggs), "A" (second aggs) or "T" (trades)"""
+
+    def __init__(self, api_key: str, channel: str = "AM"):
+        from polygon import WebSocketClient
+
+        self.channel = channel
+        self.client = WebSocketClient(api_key=api_key, market="stocks", subscriptions=[])
+
+    def subscribe(self, symbol: str):
+        self.client.subscribe(f"{self.channel}.{symbol}")
+
+    def unsubscribe(self, symbol: str):
+        self.client.unsubscribe(f"{self.channel}.{symbol}")
+
+    async def run(self, publish: Publish):
+        async def handle(messages):
+            for message in messages:
+                price = getattr(message, 'close', None) or getattr(message, 'price', None)
+                timestamp = getattr(message, 'end_timestamp', None) or getattr(message, 'timestamp', None)
+                if getattr(message, 'symbol', None) and price is not None:
+                    publish(message.symbol, price, timestamp)
+
+        await self.client.connect(handle)
+
+    async def close(self):
+        if self.client.websocket is not None:
+            await self.client.close()
+
+
+class ReplayPriceFeed:
+    """Local stand-in for the upstream feed replaying recorded ticks.
+
+    Ticks are dicts with `symbol`, `price` and optionally `timestamp`; only
+    subscribed symbols are published.
+    """
+
+    def __init__(self, ticks: Iterable[Dict], interval: float = 0.1, repeat: bool = True):
+        self.ticks = list(ticks)
+        self.interval = interval
+        self.repeat = repeat
+        self.symbols: Set[str] = set()
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "ReplayPriceFeed":
+        """Read ticks from an NDJSON file"""
+        lines = Path(path).read_text().splitlines()
+        return cls((json.loads(line) for line in lines if line.strip()), **kwargs)
+
+    def subscribe(self, symbol: str):
+        self.symbols.add(symbol)
+
+    def unsubscribe(self, symbol: str):
+        self.symbols.discard(symbol)
+
+    async def run(self, publish: Publish):
+        while True:
+            for tick in self.ticks:
+                if tick['symbol'] in self.symbols:
+                    publish(tick['symbol'], tick['price'], tick.get('timestamp'))
+                await asyncio.sleep(self.interval)
+            if not self.repeat or not self.ticks:
+                return
+
+    async def close(self):
+        pass
+
+
+class PriceSubscriber:
+    """One client's view of the hub: subscribed symbols and conflated pending updates"""
+
+    def __init__(self):
+        self.symbols: Set[str] = set()
+        self._pending: Dict[str, Dict] = {}
+        self._ready = asyncio.Event()
+
+    def push(self, update: Dict):
+        self._pending[update['symbol']] = update
+        self._ready.set()
+
+    async def next_updates(self) -> List[Dict]:
+        """Wait for and take every update pending since the last call"""
+        await self._ready.wait()
+        self._ready.clear()
+        updates, self._pending = list(self._pending.values()), {}
+        return updates
+
+
+class PriceHub:
+    def __init__(self, feed=None, max_retry_delay: float = 300, idle_timeout: float = 30):
+        self.feed = feed
+        self.max_retry_delay = max_retry_delay
+        self.idle_timeout = idle_timeout
+        self.prices: Dict[str, Dict] = {}
+        self._received_at: Dict[str, float] = {}
+        self._subscribers: Dict[str, Set[PriceSubscriber]] = {}
+        self._watchers: Set[PriceSubscriber] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._idle_timer: Optional[asyncio.TimerHandle] = None
+
+    def last_price(self, symbol: str, max_age: Optional[float] = None) -> Optional[float]:
+        """Last known price, None if unknown or older than `max_age` seconds"""
+        update = self.prices.get(symbol)
+        if update is None:
+            return None
+        if max_age is not None and time.monotonic() - self._received_at[symbol] > max_age:
+            return None
+        return update['price']
+
+    def subscribe(self, subscriber: PriceSubscriber, symbols: Iterable[str]):
+        for symbol in symbols:
+            if symbol in subscriber.symbols:
+                continue
+            subscriber.symbols.add(symbol)
+            clients = self._subscribers.setdefault(symbol, set())
+            if not clients and self.feed is not None:
+                self.feed.subscribe(symbol)
+                self._ensure_running()
+            clients.add(subscriber)
+            # Send what we already know right away
+            if symbol in self.prices:
+                subscriber.push(self.prices[symbol])
+
+    def unsubscribe(self, subscriber: PriceSubscriber, symbols: Iterable[str]):
+        for symbol in symbols:
+            if symbol not in subscriber.symbols:
+                continue
+            subscriber.symbols.discard(symbol)
+            clients = self._subscribers.get(symbol, set())
+            clients.discard(subscriber)
+            if not clients:
+                self._subscribers.pop(symbol, None)
+                if self.feed is not None:
+                    self.feed.unsubscribe(symbol)
+        if not self._subscribers and self._task is not None and self._idle_timer is None:
+            self._idle_timer = asyncio.get_running_loop().call_later(self.idle_timeout, self._stop_if_idle)
+
+    def drop(self, subscriber: PriceSubscriber):
+        self.unsubscribe(subscriber, list(subscriber.symbols))
+
+    def watch(self, watcher: PriceSubscriber):
+        """Receive every published update; opens no upstream subscription"""
+        self._watchers.add(watcher)
+
+    def unwatch(self, watcher: PriceSubscriber):
+        self._watchers.discard(watcher)
+
+    def publish(self, symbol: str, price: float, timestamp: Optional[int] = None):
+        update = {
+            'symbol': symbol,
+            'price': price,
+            'timestamp': timestamp if timestamp is not None else int(time.time() * 1000),
+        }
+        self.prices[symbol] = update
+        self._received_at[symbol] = time.monotonic()
+        for subscriber in self._subscribers.get(symbol, ()):
+            subscriber.push(update)
+        for watcher in self._watchers:
+            watcher.push(update)
+
+    def _ensure_running(self):
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_feed())
+
+    def _stop_if_idle(self):
+        self._idle_timer = None
+        if not self._subscribers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run_feed(self):
+        delay = 1.0
+        try:
+            while self._subscribers:
+                try:
+                    await self.feed.run(self.publish)
+                    delay = 1.0
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Price feed error, retrying in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+        finally:
+            # Subscriptions stay registered with the feed and are sent again on reconnect
+            await self.feed.close()
+
+    async def close(self):
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+        if self._task is not None:
+            self._task.cancel()
+        if self.feed is not None:
+            await self.feed.close()
@@ -0,0 +1,62 @@
+"""Shared call budget for a rate-limited upstream.
+
+A token bucket refilled at ``rate`` calls per second holds at most ``capacity``
+tokens. Background work (prefetching) runs with lower priority: it never takes
+a token while a foreground request is waiting, and leaves ``reserve`` tokens
+in the bucket so a user request arriving after a background burst does not
+queue behind it.
+"""
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_background: ContextVar[bool] = ContextVar('background_priority', default=False)
+
+
+@contextmanager
+def background_priority():
+    """Mark upstream calls made in this context (and tasks it spawns) as background work"""
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
+
+
+def is_background() -> bool:
+    return _background.get()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, reserve: float = 0.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.reserve = min(reserve, max(capacity - 1, 0))
+        self.tokens = capacity
+        self._updated = time.monotonic()
+        self._foreground_waiting = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, background: bool = False) -> float:
+        """Take one token, waiting as long as needed; returns the seconds waited"""
+        start = time.monotonic()
+        floor = self.reserve if background else 0.0
+        if not background:
+            self._foreground_waiting += 1
+        try:
+            while True:
+                self._refill()
+                blocked = background and self._foreground_waiting > 0
+                if not blocked and self.tokens - floor >= 1:
+                    self.tokens -= 1
+                    return time.monotonic() - start
+                deficit = max(1 + floor - self.tokens, 0)
+                await asyncio.sleep(max(deficit / self.rate, 0.005))
+        finally:
+            if not background:
+                self._foreground_waiting -= 1
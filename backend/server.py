@@ -1,4 +1,5 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Query, Request
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -6,49 +7,294 @@ import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Set
 import uuid
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
 from polygon import RESTClient
 import os
 from typing import List
 from pydantic import BaseModel
 from fastapi import HTTPException
-from openai import OpenAI
+from openai import AsyncOpenAI
+import httpx
+import json
+import multiprocessing
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from fastapi.responses import ORJSONResponse, StreamingResponse, Response
+import orjson
+import time
+import metrics
+from metrics import track_upstream
+from upstream import Upstream, UpstreamUnavailable, deadline_scope, fresh_context
+from http_cache import cache_headers, etag_matches, json_response, make_etag, not_modified
+
+# Antes de leer cualquier variable: los valores de .env cuentan para toda la configuración
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
 
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-client = OpenAI()  # lee OPENAI_API_KEY del entorno
+
+# Timeouts por llamada a cada upstream (segundos)
+FINVIZ_TIMEOUT = float(os.getenv("FINVIZ_TIMEOUT", "10"))
+POLYGON_TIMEOUT = float(os.getenv("POLYGON_TIMEOUT", "10"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "32"))
+# Descargas simultáneas de FINVIZ (punto de partida del límite adaptativo)
+FINVIZ_CONCURRENCY = int(os.getenv("FINVIZ_CONCURRENCY", "4"))
+# Tiempo total por petición HTTP: ningún reintento a un upstream lo sobrepasa
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "30"))
+# Reintentos ante fallos transitorios y circuit breaker (fallos seguidos / segundos abierto)
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_FAILURE_THRESHOLD = int(os.getenv("UPSTREAM_FAILURE_THRESHOLD", "5"))
+UPSTREAM_RESET_TIMEOUT = float(os.getenv("UPSTREAM_RESET_TIMEOUT", "30"))
+PRICE_FETCH_CONCURRENCY = int(os.getenv("PRICE_FETCH_CONCURRENCY", "16"))
+# Screener: símbolos descargados a la vez y procesos para indicadores
+SCREENER_CONCURRENCY = int(os.getenv("SCREENER_CONCURRENCY", "16"))
+SCREENER_WORKERS = int(os.getenv("SCREENER_WORKERS", str(os.cpu_count() or 2)))
+SCREENER_BATCH_SIZE = int(os.getenv("SCREENER_BATCH_SIZE", "64"))
+# Backtests terminados que se conservan en memoria para consultarlos
+BACKTEST_MAX_JOBS = int(os.getenv("BACKTEST_MAX_JOBS", "20"))
+# Días naturales de historia para indicadores (~200 sesiones para la SMA200)
+ANALYSIS_HISTORY_DAYS = int(os.getenv("ANALYSIS_HISTORY_DAYS", "300"))
+# Cierres en historical_prices del análisis (por defecto) y días máximos de /history
+ANALYSIS_HISTORY_POINTS = int(os.getenv("ANALYSIS_HISTORY_POINTS", "30"))
+HISTORY_MAX_DAYS = int(os.getenv("HISTORY_MAX_DAYS", str(5 * 365)))
+# Directorio de los ficheros columnares de barras (uno por símbolo, mapeados en memoria)
+BAR_DATA_DIR = os.getenv("BAR_DATA_DIR", str(ROOT_DIR / "data" / "bars"))
+# Vida de un análisis IA cacheado con el mercado abierto (cerrado: hasta la apertura)
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "900"))
+# Redondeo en el prompt de la IA para que un análisis cacheado siga valiendo mientras el
+# precio no se mueva: tramo relativo de precios y EMAs (0.01 = 1%) y tramo de RSI (puntos)
+AI_PRICE_BUCKET = float(os.getenv("AI_PRICE_BUCKET", "0.01"))
+AI_RSI_BUCKET = float(os.getenv("AI_RSI_BUCKET", "5"))
+# Presupuesto de llamadas a Polygon (0 = sin límite; plan gratuito: 5); ráfaga y tokens reservados
+# para peticiones de usuarios frente al trabajo en segundo plano
+POLYGON_CALLS_PER_MINUTE = float(os.getenv("POLYGON_CALLS_PER_MINUTE", "6000"))
+POLYGON_BURST = float(os.getenv("POLYGON_BURST", "100"))
+POLYGON_BACKGROUND_RESERVE = float(os.getenv("POLYGON_BACKGROUND_RESERVE", "10"))
+# Precarga en segundo plano: cartera + watchlist (símbolos separados por comas)
+PREFETCH_WATCHLIST = [s.strip().upper() for s in os.getenv("PREFETCH_WATCHLIST", "").split(",") if s.strip()]
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "4"))
+PREFETCH_OPEN_INTERVAL = float(os.getenv("PREFETCH_OPEN_INTERVAL", "300"))
+PREFETCH_CLOSED_INTERVAL = float(os.getenv("PREFETCH_CLOSED_INTERVAL", "3600"))
+# Índice local de tickers para la búsqueda: refresco del listado de Polygon (segundos),
+# resultados por búsqueda y cuántos de ellos llevan precio
+TICKER_INDEX_REFRESH = float(os.getenv("TICKER_INDEX_REFRESH", str(24 * 3600)))
+SEARCH_RESULTS = int(os.getenv("SEARCH_RESULTS", "10"))
+SEARCH_PRICED_RESULTS = int(os.getenv("SEARCH_PRICED_RESULTS", "5"))
+# Vida de los detalles de ticker (nombre) en la caché compartida entre workers
+TICKER_DETAILS_TTL = float(os.getenv("TICKER_DETAILS_TTL", str(24 * 3600)))
+# Tamaño de página de GET /portfolio
+PORTFOLIO_PAGE_SIZE = int(os.getenv("PORTFOLIO_PAGE_SIZE", "1000"))
+PORTFOLIO_MAX_PAGE_SIZE = int(os.getenv("PORTFOLIO_MAX_PAGE_SIZE", "1000"))
+# Feed de precios en tiempo real: "polygon", "replay" (fichero NDJSON) u "off"
+PRICE_FEED = os.getenv("PRICE_FEED", "polygon")
+PRICE_FEED_CHANNEL = os.getenv("PRICE_FEED_CHANNEL", "AM")
+PRICE_FEED_REPLAY_FILE = os.getenv("PRICE_FEED_REPLAY_FILE", "")
+PRICE_FEED_REPLAY_INTERVAL = float(os.getenv("PRICE_FEED_REPLAY_INTERVAL", "0.1"))
+# Segundos sin clientes suscritos tras los que se cierra la conexión del feed
+PRICE_FEED_IDLE_TIMEOUT = float(os.getenv("PRICE_FEED_IDLE_TIMEOUT", "30"))
+# Edad máxima (segundos) de un precio en vivo para usarlo en lugar del último cierre
+LIVE_PRICE_MAX_AGE = float(os.getenv("LIVE_PRICE_MAX_AGE", "120"))
+# Cada cuánto se comprueba si cambiaron las posiciones de la valoración de la cartera; los
+# cierres se refrescan con PREFETCH_OPEN_INTERVAL / PREFETCH_CLOSED_INTERVAL
+VALUATION_REFRESH_SECONDS = float(os.getenv("VALUATION_REFRESH_SECONDS", "60"))
+
+def make_upstream(name: str, timeout: float, concurrency: int) -> Upstream:
+    return Upstream(
+        name,
+        timeout,
+        retries=UPSTREAM_RETRIES,
+        concurrency=concurrency,
+        max_concurrency=UPSTREAM_POOL_SIZE,
+        failure_threshold=UPSTREAM_FAILURE_THRESHOLD,
+        reset_timeout=UPSTREAM_RESET_TIMEOUT,
+    )
+
+# Retries happen in the upstream layer, not inside the SDKs
+polygon_upstream = make_upstream('polygon', POLYGON_TIMEOUT, UPSTREAM_POOL_SIZE)
+finviz_upstream = make_upstream('finviz', FINVIZ_TIMEOUT, FINVIZ_CONCURRENCY)
+openai_upstream = make_upstream('openai', OPENAI_TIMEOUT, int(os.getenv("OPENAI_CONCURRENCY", "8")))
 
 class UserMessage(BaseModel):
     role: str  # "user" | "system" | "assistant"
     content: str
 
-def llm_chat(messages: List[UserMessage]) -> str:
+async def llm_chat(messages: List[UserMessage]) -> str:
     try:
         # Convertimos a formato OpenAI
         payload = [{"role": m.role, "content": m.content} for m in messages]
-        resp = client.chat.completions.create(model=OPENAI_MODEL, messages=payload)
+        resp = await openai_upstream.call(
+            lambda timeout: openai_client.chat.completions.create(
+                model=OPENAI_MODEL, messages=payload, timeout=timeout,
+            ),
+            'chat',
+        )
         return resp.choices[0].message.content
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"OpenAI no disponible: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OpenAI error: {e}")
-import asyncio
-from bs4 import BeautifulSoup
-import re
 
-ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
+async def llm_chat_stream(messages: List[UserMessage]):
+    """Yield the completion text chunk by chunk as OpenAI produces it"""
+    payload = [{"role": m.role, "content": m.content} for m in messages]
+    # Only opening the stream is retried; once tokens flow they are the client's
+    stream = await openai_upstream.call(
+        lambda timeout: openai_client.chat.completions.create(
+            model=OPENAI_MODEL, messages=payload, stream=True, timeout=timeout,
+        ),
+        'chat_stream_open',
+    )
+    with track_upstream('openai', 'chat_stream'):
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+import asyncio
+from bar_store import BarStore
+from bar_files import BarColumns, BarFiles
+from analysis_cache import analysis_key, bucket, bucket_relative
+from shared_cache import Leases, SharedCache
+from market_hours import market_interval, market_ttl
+from fundamentals import FundamentalsStore
+from portfolio import PortfolioStore
+from valuation import PortfolioValuation
+from rate_limit import TokenBucket, background_priority, is_background
+from prefetch import PrefetchScheduler
+from ticker_index import TickerDirectory
+from single_flight import SingleFlight
+from price_hub import PriceHub, PolygonPriceFeed, ReplayPriceFeed, PriceSubscriber
+import technicals
+import backtest
 
 # MongoDB connection (coincide con docker-compose)
 mongo_uri = os.getenv("MONGO_URI", "mongodb://mongo:27017/emergent")
-client = AsyncIOMotorClient(mongo_uri)
 db_name = os.getenv("DB_NAME", "emergent")
-db = client[db_name]
 
-# Polygon client
-polygon_client = RESTClient(os.environ['POLYGON_API_KEY'])
+POLYGON_API_KEY = os.getenv("POLYGON_API_KEY", "")
+POLYGON_BASE_URL = os.getenv("POLYGON_BASE_URL", "https://api.polygon.io")
+# Every Polygon call spends a token; user requests go before prefetching
+polygon_budget = TokenBucket(
+    POLYGON_CALLS_PER_MINUTE / 60, POLYGON_BURST, reserve=POLYGON_BACKGROUND_RESERVE,
+) if POLYGON_CALLS_PER_MINUTE > 0 else None
+
+# Clients, their connection pools and the stores built on them are created by
+# open_clients() in the app lifespan: importing this module connects to nothing
+mongo_client: Optional[AsyncIOMotorClient] = None
+db = None
+openai_client: Optional[AsyncOpenAI] = None
+polygon_client: Optional[RESTClient] = None
+polygon_executor: Optional[ThreadPoolExecutor] = None
+http_client: Optional[httpx.AsyncClient] = None
+leases: Optional[Leases] = None
+fundamentals_store: Optional[FundamentalsStore] = None
+analysis_cache: Optional[SharedCache] = None
+details_cache: Optional[SharedCache] = None
+portfolio_store: Optional[PortfolioStore] = None
+bar_store: Optional[BarStore] = None
+ticker_directory: Optional[TickerDirectory] = None
+
+def open_clients():
+    global mongo_client, db, openai_client, polygon_client, polygon_executor, http_client, leases
+    global fundamentals_store, analysis_cache, details_cache, portfolio_store, bar_store, ticker_directory
+    if not POLYGON_API_KEY:
+        raise RuntimeError("POLYGON_API_KEY is not set")
+
+    mongo_client = AsyncIOMotorClient(mongo_uri, event_listeners=[metrics.MongoCommandMetrics()])
+    db = mongo_client[db_name]
+    openai_client = AsyncOpenAI(timeout=OPENAI_TIMEOUT, max_retries=0)  # lee OPENAI_API_KEY del entorno
+
+    # The Polygon SDK is blocking, so calls run on a dedicated thread pool
+    # sized like its connection pool and are awaited with a per-call deadline.
+    polygon_client = RESTClient(
+        POLYGON_API_KEY,
+        connect_timeout=POLYGON_TIMEOUT,
+        read_timeout=POLYGON_TIMEOUT,
+        retries=0,
+        base=POLYGON_BASE_URL,
+    )
+    polygon_client.client.connection_pool_kw["maxsize"] = UPSTREAM_POOL_SIZE
+    polygon_executor = ThreadPoolExecutor(max_workers=UPSTREAM_POOL_SIZE, thread_name_prefix="polygon")
 
-# Create the main app without a prefix
-app = FastAPI()
+    # Shared async HTTP client for scraping (keep-alive pool reused across requests)
+    http_client = httpx.AsyncClient(
+        timeout=FINVIZ_TIMEOUT,
+        limits=httpx.Limits(max_connections=UPSTREAM_POOL_SIZE, max_keepalive_connections=UPSTREAM_POOL_SIZE),
+        headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
+        follow_redirects=True,
+    )
+
+    # Caches are shared by every worker process through Mongo; a lease per key
+    # lets one worker call upstream while the others wait for its result
+    leases = Leases(db.leases)
+    # FINVIZ fundamentals change at most daily
+    fundamentals_store = FundamentalsStore(
+        db.fundamentals,
+        http_client,
+        upstream=finviz_upstream,
+        ttl=float(os.getenv("FUNDAMENTALS_TTL", str(6 * 3600))),
+        concurrency=FINVIZ_CONCURRENCY,
+        leases=leases,
+        lease_seconds=FINVIZ_TIMEOUT * (UPSTREAM_RETRIES + 1),
+    )
+    # LLM analyses keyed by model + prompt
+    analysis_cache = SharedCache(
+        db.ai_analysis_cache, leases, 'ai_analysis', lease_seconds=OPENAI_TIMEOUT * (UPSTREAM_RETRIES + 1),
+    )
+    details_cache = SharedCache(db.ticker_details, leases, 'ticker_details', max_entries=4096)
+    portfolio_store = PortfolioStore(db.portfolio, db.portfolio_positions, db.counters)
+    # Local OHLCV store; only missing bars are requested from Polygon
+    bar_store = BarStore(
+        BarFiles(BAR_DATA_DIR),
+        db.bar_syncs,
+        fetch_aggs_range,
+        refresh_seconds=float(os.getenv("BAR_REFRESH_SECONDS", "60")),
+        leases=leases,
+        # Head, tail and a re-adjusted window: up to three pulls per fill
+        lease_seconds=3 * POLYGON_TIMEOUT * (UPSTREAM_RETRIES + 1),
+    )
+    # Ticker and company-name search runs on this local index
+    ticker_directory = TickerDirectory(
+        db.tickers,
+        fetch_ticker_snapshot,
+        refresh_seconds=TICKER_INDEX_REFRESH,
+        # One worker pulls each snapshot; a pull takes minutes at most
+        claim=lambda: leases.acquire('ticker_snapshot', 600),
+    )
+    price_hub.feed = make_price_feed()
+
+async def close_clients():
+    mongo_client.close()
+    await price_hub.close()
+    await http_client.aclose()
+    await openai_client.close()
+    polygon_executor.shutdown(wait=False)
+
+def make_price_feed():
+    if PRICE_FEED == "polygon":
+        return PolygonPriceFeed(POLYGON_API_KEY, channel=PRICE_FEED_CHANNEL)
+    if PRICE_FEED == "replay":
+        return ReplayPriceFeed.from_file(PRICE_FEED_REPLAY_FILE, interval=PRICE_FEED_REPLAY_INTERVAL)
+    return None
+
+# Live prices: one upstream subscription per symbol shared by all WebSocket
+# clients, open only while some client is connected; the feed is attached in
+# open_clients()
+price_hub = PriceHub(idle_timeout=PRICE_FEED_IDLE_TIMEOUT)
+
+# Portfolio totals maintained from per-symbol positions and live prices
+portfolio_valuation = PortfolioValuation()
+valuation_prices = PriceSubscriber()
+valuation_ready = asyncio.Event()
+# portfolio_store.version() the valuation's positions were loaded at
+valuation_version: Optional[str] = None
+
+# Concurrent identical work runs once: upstream calls keyed by (kind, args),
+# full analyses keyed by symbol
+upstream_calls = SingleFlight()
+analysis_calls = SingleFlight()
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -90,6 +336,31 @@ class PortfolioStock(BaseModel):
     purchase_date: datetime
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class SymbolList(BaseModel):
+    symbols: List[str]
+
+class ScreenerCriteria(BaseModel):
+    min_score: Optional[float] = None
+    max_pe: Optional[float] = None
+    min_dividend_yield: Optional[float] = None
+    max_beta: Optional[float] = None
+    min_rsi: Optional[float] = None
+    max_rsi: Optional[float] = None
+    ema_trend: Optional[str] = None  # "up" (EMA20 > EMA50) | "down"
+
+class ScreenerRequest(BaseModel):
+    symbols: List[str]
+    criteria: ScreenerCriteria = Field(default_factory=ScreenerCriteria)
+    include_ai: bool = False
+
+class BacktestRequest(BaseModel):
+    symbols: List[str]
+    years: float = Field(10, gt=0, le=25)
+    horizons: List[int] = Field(default_factory=lambda: [5, 20, 60])  # sesiones
+    bucket_edges: List[float] = Field(default_factory=lambda: [0, 40, 50, 60, 70, 80, 101])
+    # Today's FINVIZ values applied to the whole history (look-ahead bias)
+    include_fundamentals: bool = False
+
 class PortfolioStockCreate(BaseModel):
     symbol: str
     name: str
@@ -98,140 +369,181 @@ class PortfolioStockCreate(BaseModel):
     purchase_date: datetime
 
 # Helper functions
-async def scrape_finviz_data(symbol: str) -> Dict:
-    """Scrape additional stock data from FINVIZ"""
-    import requests
-    
-    try:
-        url = f"https://finviz.com/quote.ashx?t={symbol}"
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        
-        response = requests.get(url, headers=headers, timeout=10)
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Find the table with fundamental data
-        table = soup.find('table', class_='snapshot-table2')
-        if not table:
-            return {}
-        
-        data = {}
-        rows = table.find_all('tr')
-        
-        for row in rows:
-            cells = row.find_all('td')
-            for i in range(0, len(cells), 2):
-                if i + 1 < len(cells):
-                    key = cells[i].get_text(strip=True)
-                    value = cells[i + 1].get_text(strip=True)
-                    data[key] = value
-        
-        # Parse specific values
-        def parse_number(s):
+async def spend_polygon_budget():
+    if polygon_budget is not None:
+        background = is_background()
+        waited = await polygon_budget.acquire(background=background)
+        metrics.RATE_LIMIT_WAIT.observe(
+            waited, upstream='polygon', priority='background' if background else 'foreground',
+        )
+
+async def run_polygon(fn, *args, stale_key=None, **kwargs):
+    """Run a blocking polygon_client call off the event loop through the upstream layer"""
+    loop = asyncio.get_running_loop()
+
+    async def attempt(timeout: float):
+        return await loop.run_in_executor(polygon_executor, partial(fn, *args, **kwargs))
+
+    # Every attempt, retries included, spends a token of the budget; waiting
+    # for it is not upstream time
+    return await polygon_upstream.call(
+        attempt, fn.__name__, stale_key=stale_key, before_attempt=spend_polygon_budget,
+    )
+
+async def fetch_aggs_range(symbol: str, timespan: str, start_date: datetime, end_date: datetime) -> List:
+    """Bars straight from Polygon for [start_date, end_date]"""
+    from_, to = start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+    aggs = await upstream_calls.do(
+        ('aggs', symbol, timespan, from_, to),
+        run_polygon,
+        polygon_client.get_aggs,
+        ticker=symbol,
+        multiplier=1,
+        timespan=timespan,
+        from_=from_,
+        to=to,
+        # Polygon caps the base aggregates behind a response at `limit` (default
+        # 5000, max 50000) and get_aggs does not page: ask for the maximum
+        limit=50000,
+    )
+    return list(aggs)
+
+async def fetch_daily_bars(symbol: str, days: int) -> BarColumns:
+    """Daily bars for the last `days` calendar days, served from the bar store"""
+    return await upstream_calls.do(('bars', symbol, days), bar_store.get_bars, symbol, days, 'day')
+
+async def get_quotes(symbols, change: bool = True) -> Dict[str, Dict]:
+    """Current price and daily change for each symbol, fetched with bounded concurrency.
+
+    The price is the hub's live one when fresh, otherwise the last close; the
+    change is against the previous session's close. With `change` off a
+    fresh live price needs no bars at all (change_percent is then None).
+    """
+    semaphore = asyncio.Semaphore(PRICE_FETCH_CONCURRENCY)
+
+    async def quote(symbol: str):
+        live = price_hub.last_price(symbol, max_age=LIVE_PRICE_MAX_AGE)
+        metrics.CACHE_LOOKUPS.inc(cache='live_prices', result='miss' if live is None else 'hit')
+        if live is not None and not change:
+            return symbol, {'current_price': live, 'change_percent': None}
+        async with semaphore:
             try:
-                s = s.replace(',', '').replace('%', '').replace('B', '').replace('M', '')
-                s = re.sub(r'[^0-9.\-]', '', s.split()[0] if ' ' else s)
-                return float(s) if s and s not in ['-', ''] else None
-            except:
-                return None
-        
-        parsed_data = {
-            'pe_ratio': parse_number(data.get('P/E', '')),
-            'forward_pe': parse_number(data.get('Forward P/E', '')),
-            'peg_ratio': parse_number(data.get('PEG', '')),
-            'ps_ratio': parse_number(data.get('P/S', '')),
-            'pb_ratio': parse_number(data.get('P/B', '')),
-            'beta': parse_number(data.get('Beta', '')),
-            'dividend_yield': parse_number(data.get('Dividend %', '')),
-            'rsi': parse_number(data.get('RSI (14)', '')),
-            'sma20': parse_number(data.get('SMA20', '')),
-            'sma50': parse_number(data.get('SMA50', '')),
-            'sma200': parse_number(data.get('SMA200', '')),
-            'volatility': data.get('Volatility', ''),
-            'target_price': parse_number(data.get('Target Price', '')),
-            'recommendation': parse_number(data.get('Recom', '')),
-            'roe': parse_number(data.get('ROE', '')),
-            'roa': parse_number(data.get('ROA', '')),
-            'profit_margin': parse_number(data.get('Profit Margin', '')),
-            'debt_equity': parse_number(data.get('Debt/Eq', '')),
-            'eps_ttm': parse_number(data.get('EPS (ttm)', '')),
-            'market_cap': data.get('Market Cap', ''),
-            'perf_week': parse_number(data.get('Perf Week', '')),
-            'perf_month': parse_number(data.get('Perf Month', '')),
-            'perf_quarter': parse_number(data.get('Perf Quarter', '')),
-            'perf_year': parse_number(data.get('Perf Year', '')),
-        }
-        
-        return parsed_data
-    except Exception as e:
-        logger.error(f"FINVIZ scraping error for {symbol}: {e}")
-        return {}
+                # A week back always reaches the previous session, across weekends and holidays
+                bars = await fetch_daily_bars(symbol, 7)
+            except Exception as e:
+                logger.error(f"Error getting price for {symbol}: {e}")
+                bars = BarColumns.empty()
+        closes = bars.close[-2:].tolist()
+        current_price = live if live is not None else (closes[-1] if closes else None)
+        change_percent = None
+        if change and current_price is not None and len(closes) >= 2:
+            change_percent = round(((current_price - closes[-2]) / closes[-2]) * 100, 2)
+        return symbol, {'current_price': current_price, 'change_percent': change_percent}
 
-def calculate_ema(prices: List[float], period: int) -> float:
-    """Calculate Exponential Moving Average"""
-    if len(prices) < period:
-        return None
-    
-    multiplier = 2 / (period + 1)
-    ema = sum(prices[:period]) / period
-    
-    for price in prices[period:]:
-        ema = (price - ema) * multiplier + ema
-    
-    return round(ema, 2)
+    return dict(await asyncio.gather(*(quote(symbol) for symbol in set(symbols))))
 
-def analyze_candlestick(candles: List[Dict]) -> str:
-    """Analyze candlestick patterns"""
-    if len(candles) < 3:
-        return "Insufficient data"
-    
-    last = candles[-1]
-    prev = candles[-2]
-    
-    open_price = last['o']
-    close = last['c']
-    high = last['h']
-    low = last['l']
-    
-    body = abs(close - open_price)
-    range_size = high - low
-    
-    patterns = []
-    
-    # Bullish patterns
-    if close > open_price:
-        if body / range_size > 0.7:
-            patterns.append("Vela Alcista Fuerte")
-        elif (high - close) / range_size < 0.1:
-            patterns.append("Marubozu Alcista")
-    
-    # Bearish patterns
-    elif open_price > close:
-        if body / range_size > 0.7:
-            patterns.append("Vela Bajista Fuerte")
-        elif (close - low) / range_size < 0.1:
-            patterns.append("Marubozu Bajista")
-    
-    # Doji
-    if body / range_size < 0.1:
-        patterns.append("Doji - Indecisión")
-    
-    # Hammer
-    if close > open_price and (close - low) > 2 * body and (high - close) < body:
-        patterns.append("Martillo Alcista")
-    
-    return ", ".join(patterns) if patterns else "Patrón Neutral"
+async def fetch_ticker_details(symbol: str) -> Dict:
+    """{'ticker', 'name'} of a symbol, shared by every worker for TICKER_DETAILS_TTL"""
+    async def load():
+        details = await run_polygon(polygon_client.get_ticker_details, symbol, stale_key=symbol)
+        return {'ticker': details.ticker, 'name': details.name}
 
-async def get_ai_analysis(symbol: str, analysis_data: Dict) -> tuple[str, str]:
-    """Get AI-powered analysis using OpenAI - returns (analysis, recommendation)"""
+    return await upstream_calls.do(
+        ('details', symbol), details_cache.get_or_load, symbol, load, TICKER_DETAILS_TTL,
+    )
+
+async def fetch_ticker_details_or_none(symbol: str):
+    """Ticker details, or None so a missing name never fails an analysis"""
     try:
-        system_msg = UserMessage(
-            role="system",
-            content="Eres un analista financiero experto. Proporciona análisis concisos y profesionales."
+        return await fetch_ticker_details(symbol)
+    except Exception as e:
+        logger.error(f"Ticker details error for {symbol}: {e}")
+        return None
+
+async def scrape_finviz_data(symbol: str) -> Dict:
+    """FINVIZ fundamentals, scraped at most once per FUNDAMENTALS_TTL"""
+    return await upstream_calls.do(('finviz', symbol), fundamentals_store.get, symbol)
+
+async def fetch_ticker_snapshot() -> List[Dict]:
+    """Every active stock ticker with its name, one budgeted call per 1000-ticker page.
+
+    Pages are fetched over HTTP rather than through the SDK's paginating
+    iterator so each one is retried on its own.
+    """
+    url = f"{POLYGON_BASE_URL}/v3/reference/tickers"
+    params = {'market': 'stocks', 'active': 'true', 'limit': 1000}
+    tickers = []
+    while url:
+        async def attempt(timeout: float, url=url, params=params):
+            response = await http_client.get(
+                url, params={**params, 'apiKey': POLYGON_API_KEY}, timeout=timeout,
+            )
+            response.raise_for_status()
+            return response.json()
+
+        page = await polygon_upstream.call(attempt, 'list_tickers', before_attempt=spend_polygon_budget)
+        tickers.extend(
+            {'ticker': result['ticker'], 'name': result.get('name', '')} for result in page.get('results', [])
         )
+        # next_url already carries the cursor and the other filters
+        url, params = page.get('next_url'), {}
+    return tickers
+
+def build_analysis_data(finviz_data: Dict, summary: Dict) -> Dict:
+    """Merge FINVIZ fundamentals with locally computed technicals"""
+    latest = summary['technicals']
+    return {
+        'beta': finviz_data.get('beta'),
+        'dividend_yield': finviz_data.get('dividend_yield'),
+        'pe_ratio': finviz_data.get('pe_ratio'),
+        'peg_ratio': finviz_data.get('peg_ratio'),
+        'pb_ratio': finviz_data.get('pb_ratio'),
+        'ps_ratio': finviz_data.get('ps_ratio'),
+        'rsi': latest['rsi'] if latest['rsi'] is not None else finviz_data.get('rsi'),
+        'roe': finviz_data.get('roe'),
+        'roa': finviz_data.get('roa'),
+        'profit_margin': finviz_data.get('profit_margin'),
+        'debt_equity': finviz_data.get('debt_equity'),
+        'target_price': finviz_data.get('target_price'),
+        'market_cap': finviz_data.get('market_cap'),
+        'ema_20': latest['ema_20'],
+        'ema_50': latest['ema_50'],
+        'sma_20': latest['sma_20'],
+        'sma_50': latest['sma_50'],
+        'sma_200': latest['sma_200'],
+        'macd': latest['macd'],
+        'macd_signal': latest['macd_signal'],
+        'bollinger_upper': latest['bollinger_upper'],
+        'bollinger_lower': latest['bollinger_lower'],
+        'atr': latest['atr'],
+        'candlestick_pattern': summary['candlestick_pattern'],
+        'current_price': summary['current_price'],
+        'perf_week': finviz_data.get('perf_week'),
+        'perf_month': finviz_data.get('perf_month'),
+        'perf_quarter': finviz_data.get('perf_quarter'),
+        'perf_year': finviz_data.get('perf_year'),
+    }
+
+def build_ai_messages(symbol: str, analysis_data: Dict) -> List[UserMessage]:
+    """System and user messages asking the LLM for an analysis.
 
-        prompt = f"""
+    Price-derived inputs are bucketed so the prompt, and with it the cache
+    key, stays the same while the quote only drifts.
+    """
+    analysis_data = {
+        **analysis_data,
+        'rsi': bucket(analysis_data.get('rsi'), AI_RSI_BUCKET),
+        **{
+            field: bucket_relative(analysis_data.get(field), AI_PRICE_BUCKET)
+            for field in ('ema_20', 'ema_50', 'current_price')
+        },
+    }
+    system_msg = UserMessage(
+        role="system",
+        content="Eres un analista financiero experto. Proporciona análisis concisos y profesionales."
+    )
+
+    prompt = f"""
 Analiza la siguiente acción: {symbol}
 
 Datos técnicos:
@@ -258,273 +570,682 @@ ANÁLISIS:
 2. Riesgos principales
 3. Justificación de tu recomendación]
 """
-        
-        user_msg = UserMessage(role="user", content=prompt)
-
-        response_text = llm_chat([system_msg, user_msg]).strip()
+    
+    return [system_msg, UserMessage(role="user", content=prompt)]
 
-        # Parsear RECOMENDACIÓN y ANÁLISIS
-        recommendation = "MANTENER"
-        analysis = response_text
+def ai_cache_key(messages: List[UserMessage]) -> str:
+    # Same model and same prompt -> same analysis
+    return analysis_key(OPENAI_MODEL, *(m.content for m in messages))
 
-        for line in response_text.splitlines():
-            if line.upper().startswith("RECOMENDACIÓN:") or line.upper().startswith("RECOMENDACION:"):
-                rec_text = line.split(":", 1)[-1].strip().upper()
-                if "COMPRAR" in rec_text:
-                    recommendation = "COMPRAR"
-                elif "VENDER" in rec_text:
-                    recommendation = "VENDER"
-                else:
-                    recommendation = "MANTENER"
-                break
+async def get_ai_analysis(symbol: str, analysis_data: Dict) -> tuple[str, str]:
+    """Get AI-powered analysis using OpenAI - returns (analysis, recommendation)"""
+    try:
+        messages = build_ai_messages(symbol, analysis_data)
 
-        if "ANÁLISIS:" in response_text or "ANALISIS:" in response_text:
-            splitter = "ANÁLISIS:" if "ANÁLISIS:" in response_text else "ANALISIS:"
-            analysis = response_text.split(splitter, 1)[-1].strip()
+        # Skip the LLM round trip when the prompt was already answered
+        cache_key = ai_cache_key(messages)
+        with metrics.stage('ai_cache'):
+            cached = await analysis_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-        return analysis, recommendation
+        return await upstream_calls.do(
+            ('ai', cache_key), analysis_cache.fill,
+            cache_key, partial(complete_ai_analysis, messages), market_ttl(AI_CACHE_TTL),
+        )
 
     except Exception as e:
         logger.error(f"AI analysis error: {e}")
         return "Análisis IA no disponible temporalmente", "MANTENER"
 
+async def complete_ai_analysis(messages: List[UserMessage]) -> tuple[str, str]:
+    """Ask the LLM and parse the answer"""
+    response_text = (await llm_chat(messages)).strip()
+    if not response_text:
+        # Raising keeps the empty answer out of the cache
+        raise ValueError("empty LLM response")
+    return parse_ai_response(response_text)
+
+def parse_ai_response(response_text: str) -> tuple[str, str]:
+    """Split an LLM answer into (analysis, recommendation)"""
+    # Parsear RECOMENDACIÓN y ANÁLISIS
+    recommendation = "MANTENER"
+    analysis = response_text
+
+    for line in response_text.splitlines():
+        if line.upper().startswith("RECOMENDACIÓN:") or line.upper().startswith("RECOMENDACION:"):
+            rec_text = line.split(":", 1)[-1].strip().upper()
+            if "COMPRAR" in rec_text:
+                recommendation = "COMPRAR"
+            elif "VENDER" in rec_text:
+                recommendation = "VENDER"
+            else:
+                recommendation = "MANTENER"
+            break
+
+    if "ANÁLISIS:" in response_text or "ANALISIS:" in response_text:
+        splitter = "ANÁLISIS:" if "ANÁLISIS:" in response_text else "ANALISIS:"
+        analysis = response_text.split(splitter, 1)[-1].strip()
+
+    return analysis, recommendation
+
 # Routes
 @api_router.get("/")
 async def root():
     return {"message": "Stock Analyzer API"}
 
+@api_router.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @api_router.get("/stocks/search")
-async def search_stocks(query: str):
-    """Search for stocks by symbol or name"""
+async def search_stocks(query: str, limit: int = Query(SEARCH_RESULTS, ge=1, le=50)):
+    """Search for stocks by symbol or name (prefix or approximate), best match first.
+
+    Only the first SEARCH_PRICED_RESULTS hits get a price, fetched together.
+    """
     try:
-        # Search for ticker
-        results = polygon_client.get_ticker_details(query.upper())
-        
-        stocks = []
-        if results:
-            # Get current price
-            try:
-                aggs = list(polygon_client.get_aggs(
-                    ticker=results.ticker,
-                    multiplier=1,
-                    timespan="day",
-                    from_=(datetime.now() - timedelta(days=2)).strftime('%Y-%m-%d'),
-                    to=datetime.now().strftime('%Y-%m-%d')
-                ))
-                
-                current_price = aggs[-1].close if aggs else None
-                change_percent = None
-                if len(aggs) >= 2:
-                    change_percent = round(((aggs[-1].close - aggs[-2].close) / aggs[-2].close) * 100, 2)
-                
-                stocks.append({
-                    "symbol": results.ticker,
-                    "name": results.name,
-                    "current_price": current_price,
-                    "change_percent": change_percent
-                })
-            except Exception as e:
-                logger.error(f"Error getting price for {results.ticker}: {e}")
-                stocks.append({
-                    "symbol": results.ticker,
-                    "name": results.name,
-                    "current_price": None,
-                    "change_percent": None
-                })
-        
-        return stocks
+        if len(ticker_directory.index):
+            hits = ticker_directory.index.search(query, limit)
+        else:
+            # No snapshot yet: exact ticker lookup
+            details = await fetch_ticker_details_or_none(query.strip().upper())
+            hits = [{'symbol': details['ticker'], 'name': details['name']}] if details else []
+
+        quotes = await get_quotes(hit['symbol'] for hit in hits[:SEARCH_PRICED_RESULTS])
+        unpriced = {'current_price': None, 'change_percent': None}
+        return [{**hit, **quotes.get(hit['symbol'], unpriced)} for hit in hits]
     except Exception as e:
         logger.error(f"Search error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def build_market_analysis(symbol: str, history: int) -> tuple[Dict, Dict, BarColumns]:
+    """Everything but the AI commentary: (response fields, LLM inputs, bars).
+
+    `candlestick_events` index the last `history` bars, the closes that
+    analysis_body puts in `historical_prices` along with the response time.
+    """
+    # FINVIZ fundamentals, historical bars (EMAs and candlesticks) and ticker
+    # details are independent: fetch them concurrently, only the LLM waits
+    finviz_data, bars, details = await asyncio.gather(
+        scrape_finviz_data(symbol),
+        fetch_daily_bars(symbol, ANALYSIS_HISTORY_DAYS),
+        fetch_ticker_details_or_none(symbol),
+    )
+    
+    if not bars:
+        raise HTTPException(status_code=404, detail="No data available for this symbol")
+    
+    # Indicators and candlestick patterns, vectorized over the whole history
+    # (the columns are views of the mapped bar file, nothing is copied per bar)
+    with metrics.stage('indicators'):
+        summary = technicals.summarize(bars.open, bars.high, bars.low, bars.close, history)
+    analysis_data = build_analysis_data(finviz_data, summary)
+    
+    market = {
+        'symbol': symbol,
+        'name': details['name'] if details else symbol,
+        **analysis_data,
+        # Calculate potential score (improved algorithm)
+        'potential_score': technicals.potential_score(analysis_data),
+        'candlestick_events': summary['candlestick_events'],
+    }
+    return market, analysis_data, bars
+
+def analysis_body(fields: Dict, bars: BarColumns, points: int) -> Dict:
+    """Analysis fields plus the last `points` closes and the response time"""
+    return {
+        **fields,
+        'historical_prices': bars.close[-points:].tolist() if points else [],
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+    }
+
+def bars_version(bars: BarColumns) -> tuple:
+    """Changes when the window moves, a bar is added or today's bar is updated"""
+    return len(bars), bars.timestamp[:1], bars.timestamp[-1:], bars.close[-1:], bars.volume[-1:]
+
+async def compute_stock_analysis(symbol: str, history: int) -> tuple[Dict, BarColumns]:
+    market, analysis_data, bars = await build_market_analysis(symbol, history)
+    
+    # Get AI analysis with recommendation
+    ai_analysis, recommendation = await get_ai_analysis(symbol, analysis_data)
+    
+    return {
+        **market,
+        'ai_analysis': ai_analysis,
+        'recommendation': recommendation,
+    }, bars
+
 @api_router.get("/stocks/{symbol}/analysis")
-async def analyze_stock(symbol: str):
-    """Get comprehensive analysis for a stock"""
+async def analyze_stock(
+    symbol: str,
+    request: Request,
+    history: int = Query(ANALYSIS_HISTORY_POINTS, ge=0, le=ANALYSIS_HISTORY_DAYS),
+):
+    """Get comprehensive analysis for a stock.
+
+    `history` is how many closes `historical_prices` carries. The ETag covers
+    everything but `timestamp`, so an unchanged poll with If-None-Match gets a 304.
+    """
     try:
         symbol = symbol.upper()
-        
-        # Get data from FINVIZ
-        finviz_data = await scrape_finviz_data(symbol)
-        
-        # Get historical data for EMA calculation and candlestick analysis
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=120)
-        
-        aggs = list(polygon_client.get_aggs(
-            ticker=symbol,
-            multiplier=1,
-            timespan="day",
-            from_=start_date.strftime('%Y-%m-%d'),
-            to=end_date.strftime('%Y-%m-%d')
-        ))
-        
-        if not aggs:
-            raise HTTPException(status_code=404, detail="No data available for this symbol")
-        
-        # Extract closing prices
-        prices = [bar.close for bar in aggs]
-        
-        # Calculate EMAs
-        ema_20 = calculate_ema(prices, 20)
-        ema_50 = calculate_ema(prices, 50)
-        
-        # Analyze candlestick patterns (last 10 candles)
-        candles = [
-            {'o': bar.open, 'h': bar.high, 'l': bar.low, 'c': bar.close}
-            for bar in aggs[-10:]
-        ]
-        candlestick_pattern = analyze_candlestick(candles)
-        
-        # Prepare analysis data with FINVIZ data
-        analysis_data = {
-            'beta': finviz_data.get('beta'),
-            'dividend_yield': finviz_data.get('dividend_yield'),
-            'pe_ratio': finviz_data.get('pe_ratio'),
-            'peg_ratio': finviz_data.get('peg_ratio'),
-            'pb_ratio': finviz_data.get('pb_ratio'),
-            'ps_ratio': finviz_data.get('ps_ratio'),
-            'rsi': finviz_data.get('rsi'),
-            'roe': finviz_data.get('roe'),
-            'roa': finviz_data.get('roa'),
-            'profit_margin': finviz_data.get('profit_margin'),
-            'debt_equity': finviz_data.get('debt_equity'),
-            'target_price': finviz_data.get('target_price'),
-            'market_cap': finviz_data.get('market_cap'),
-            'ema_20': ema_20,
-            'ema_50': ema_50,
-            'candlestick_pattern': candlestick_pattern,
-            'current_price': prices[-1] if prices else None,
-            'perf_week': finviz_data.get('perf_week'),
-            'perf_month': finviz_data.get('perf_month'),
-            'perf_quarter': finviz_data.get('perf_quarter'),
-            'perf_year': finviz_data.get('perf_year'),
-        }
-        
-        # Get AI analysis with recommendation
-        ai_analysis, recommendation = await get_ai_analysis(symbol, analysis_data)
-        
-        # Calculate potential score (improved algorithm)
-        potential_score = 50  # Base score
-        
-        # Beta check (lower is better for stability)
-        if analysis_data['beta']:
-            if analysis_data['beta'] < 1:
-                potential_score += 10
-            elif analysis_data['beta'] > 1.5:
-                potential_score -= 10
-        
-        # Dividend yield (higher is better)
-        if analysis_data['dividend_yield']:
-            if analysis_data['dividend_yield'] > 3:
-                potential_score += 15
-            elif analysis_data['dividend_yield'] > 1:
-                potential_score += 8
-        
-        # EMA trend
-        if ema_20 and ema_50 and ema_20 > ema_50:
-            potential_score += 15
-        elif ema_20 and ema_50 and ema_20 < ema_50:
-            potential_score -= 10
-        
-        # Candlestick pattern
-        if "Alcista" in candlestick_pattern:
-            potential_score += 10
-        elif "Bajista" in candlestick_pattern:
-            potential_score -= 10
-        
-        # P/E ratio (reasonable range)
-        if analysis_data['pe_ratio']:
-            if 15 <= analysis_data['pe_ratio'] <= 25:
-                potential_score += 10
-            elif analysis_data['pe_ratio'] > 40:
-                potential_score -= 10
-        
-        # RSI (overbought/oversold)
-        if analysis_data['rsi']:
-            if 30 <= analysis_data['rsi'] <= 70:
-                potential_score += 5
-            elif analysis_data['rsi'] > 70:
-                potential_score -= 10
-            elif analysis_data['rsi'] < 30:
-                potential_score += 10  # Oversold can be buying opportunity
-        
-        potential_score = max(0, min(100, potential_score))
-        
-        # Get ticker details for name
-        details = polygon_client.get_ticker_details(symbol)
-        
-        return {
-            'symbol': symbol,
-            'name': details.name if details else symbol,
-            **analysis_data,
-            'ai_analysis': ai_analysis,
-            'recommendation': recommendation,
-            'potential_score': potential_score,
-            'historical_prices': prices[-30:],  # Last 30 days
-            'timestamp': datetime.now(timezone.utc).isoformat()
-        }
+        # Simultaneous requests for the same symbol and window share one computation
+        analysis, bars = await analysis_calls.do((symbol, history), compute_stock_analysis, symbol, history)
+    except HTTPException:
+        raise
+    except UpstreamUnavailable as e:
+        logger.warning(f"Analysis unavailable for {symbol}: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Analysis error for {symbol}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    etag = make_etag(analysis, bars_version(bars), history)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return not_modified(etag)
+    return json_response(analysis_body(analysis, bars, history), etag)
+
+@api_router.get("/stocks/{symbol}/history")
+async def get_history(
+    symbol: str,
+    request: Request,
+    days: int = Query(ANALYSIS_HISTORY_DAYS, ge=1, le=HISTORY_MAX_DAYS),
+    since: Optional[int] = Query(None, ge=0),
+):
+    """Daily bars of the last `days` days as columns, oldest first (timestamps in ms).
+
+    With `since` only bars at or after that timestamp are returned: pass the
+    newest timestamp already held and replace that bar, as today's bar keeps
+    changing until the close.
+    """
+    symbol = symbol.upper()
+    try:
+        bars = await fetch_daily_bars(symbol, days)
+    except UpstreamUnavailable as e:
+        logger.warning(f"History unavailable for {symbol}: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"History error for {symbol}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if not bars:
+        raise HTTPException(status_code=404, detail="No data available for this symbol")
+
+    if since is not None:
+        bars = bars.since(since)
+    etag = make_etag(symbol, days, since, bars_version(bars))
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return not_modified(etag)
+    # orjson writes the column arrays straight from the mapped file
+    return json_response({'symbol': symbol, 'bars': {name: getattr(bars, name) for name in BarColumns.__slots__}}, etag)
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY).decode()}\n\n"
+
+class RecommendationParser:
+    """Spots the RECOMENDACIÓN line while the LLM answer is still streaming"""
+
+    def __init__(self):
+        self.buffer = ""
+        self.recommendation: Optional[str] = None
+
+    def feed(self, chunk: str) -> bool:
+        """Add a chunk; True the first time the recommendation is known"""
+        if self.recommendation is not None:
+            return False
+        self.buffer += chunk
+        lines = self.buffer.split("\n")
+        for index, line in enumerate(lines):
+            upper = line.upper()
+            if not (upper.startswith("RECOMENDACIÓN:") or upper.startswith("RECOMENDACION:")):
+                continue
+            rec_text = upper.split(":", 1)[-1]
+            for word in ("COMPRAR", "VENDER", "MANTENER"):
+                if word in rec_text:
+                    self.recommendation = word
+                    return True
+            if index < len(lines) - 1:
+                # The line ended without a known word
+                self.recommendation = "MANTENER"
+                return True
+            return False
+        return False
+
+@api_router.get("/stocks/{symbol}/analysis/stream")
+async def stream_stock_analysis(symbol: str):
+    """Server-sent events: market numbers first, then the AI analysis as it is generated.
+
+    Events: `market` (all computed fields), `token` (LLM text chunks),
+    `recommendation` (as soon as it can be parsed) and `done` (final
+    ai_analysis and recommendation).
+    """
+    symbol = symbol.upper()
+    try:
+        market, analysis_data, bars = await analysis_calls.do(
+            ('market', symbol, ANALYSIS_HISTORY_POINTS), build_market_analysis, symbol, ANALYSIS_HISTORY_POINTS,
+        )
+    except HTTPException:
+        raise
+    except UpstreamUnavailable as e:
+        logger.warning(f"Analysis unavailable for {symbol}: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Analysis error for {symbol}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    async def events():
+        yield sse_event("market", analysis_body(market, bars, ANALYSIS_HISTORY_POINTS))
+
+        messages = build_ai_messages(symbol, analysis_data)
+        cache_key = ai_cache_key(messages)
+        cached = await analysis_cache.get(cache_key)
+        if cached is not None:
+            ai_analysis, recommendation = cached
+            yield sse_event("recommendation", {'recommendation': recommendation})
+            yield sse_event("done", {'ai_analysis': ai_analysis, 'recommendation': recommendation})
+            return
+
+        parser = RecommendationParser()
+        chunks = []
+        try:
+            async for chunk in llm_chat_stream(messages):
+                chunks.append(chunk)
+                yield sse_event("token", {'text': chunk})
+                if parser.feed(chunk):
+                    yield sse_event("recommendation", {'recommendation': parser.recommendation})
+            if not "".join(chunks).strip():
+                raise ValueError("empty LLM response")
+        except Exception as e:
+            # Nothing is cached, the next request asks the LLM again
+            logger.error(f"AI analysis error: {e}")
+            yield sse_event("done", {
+                'ai_analysis': "Análisis IA no disponible temporalmente",
+                'recommendation': "MANTENER",
+            })
+            return
+
+        ai_analysis, recommendation = parse_ai_response("".join(chunks).strip())
+        if parser.recommendation is None:
+            yield sse_event("recommendation", {'recommendation': recommendation})
+        await analysis_cache.set(cache_key, (ai_analysis, recommendation), market_ttl(AI_CACHE_TTL))
+        yield sse_event("done", {'ai_analysis': ai_analysis, 'recommendation': recommendation})
+
+    return StreamingResponse(
+        fresh_context(events()),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@api_router.post("/fundamentals/refresh")
+async def refresh_fundamentals(request: SymbolList):
+    """Re-scrape FINVIZ fundamentals for a batch of symbols"""
+    symbols = [symbol.upper() for symbol in request.symbols]
+    results = await fundamentals_store.refresh(symbols)
+    refreshed = sorted(symbol for symbol, data in results.items() if data)
+    return {
+        'refreshed': refreshed,
+        'failed': sorted(set(results) - set(refreshed)),
+    }
+
+# Screener
+screener_pool: Optional[ProcessPoolExecutor] = None
+
+def get_screener_pool() -> ProcessPoolExecutor:
+    """Process pool for indicator work, started on first use"""
+    global screener_pool
+    if screener_pool is None:
+        # spawn: forking a process that already runs threads is unsafe
+        screener_pool = ProcessPoolExecutor(
+            max_workers=SCREENER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return screener_pool
+
+def matches_criteria(result: Dict, criteria: ScreenerCriteria) -> bool:
+    def below(value, limit):
+        return limit is None or (value is not None and value <= limit)
+
+    def above(value, limit):
+        return limit is None or (value is not None and value >= limit)
+
+    trend = None
+    if result.get('ema_20') and result.get('ema_50'):
+        trend = "up" if result['ema_20'] > result['ema_50'] else "down"
+
+    return (
+        above(result.get('potential_score'), criteria.min_score)
+        and below(result.get('pe_ratio'), criteria.max_pe)
+        and above(result.get('dividend_yield'), criteria.min_dividend_yield)
+        and below(result.get('beta'), criteria.max_beta)
+        and above(result.get('rsi'), criteria.min_rsi)
+        and below(result.get('rsi'), criteria.max_rsi)
+        and (criteria.ema_trend is None or criteria.ema_trend == trend)
+    )
+
+async def fetch_screener_inputs(symbol: str, semaphore: asyncio.Semaphore) -> Dict:
+    """Fundamentals and bars for one symbol, or an error row"""
+    try:
+        # The stream has no overall deadline; each symbol gets a request's worth once it starts
+        async with semaphore:
+            with deadline_scope(REQUEST_DEADLINE):
+                finviz_data, bars = await asyncio.gather(
+                    scrape_finviz_data(symbol),
+                    fetch_daily_bars(symbol, ANALYSIS_HISTORY_DAYS),
+                )
+    except Exception as e:
+        logger.error(f"Screener error for {symbol}: {e}")
+        return {'symbol': symbol, 'error': str(e)}
+    if not bars:
+        return {'symbol': symbol, 'error': "No data available for this symbol"}
+    return {'symbol': symbol, 'finviz_data': finviz_data, 'bars': bars}
+
+async def screen_batch(batch: List[Dict], request: ScreenerRequest) -> List[Dict]:
+    """Score a batch of symbols in one vectorized pass on the process pool"""
+    loop = asyncio.get_running_loop()
+    summaries = await loop.run_in_executor(
+        get_screener_pool(),
+        technicals.summarize_many,
+        [(item['bars'].open, item['bars'].high, item['bars'].low, item['bars'].close) for item in batch],
+    )
+
+    results = []
+    for item, summary in zip(batch, summaries):
+        analysis_data = build_analysis_data(item['finviz_data'], summary)
+        result = {
+            'symbol': item['symbol'],
+            **analysis_data,
+            'potential_score': technicals.potential_score(analysis_data),
+        }
+        if matches_criteria(result, request.criteria):
+            results.append((result, analysis_data))
+
+    if request.include_ai:
+        commentary = await asyncio.gather(*(
+            get_ai_analysis(result['symbol'], analysis_data) for result, analysis_data in results
+        ))
+        for (result, _), (ai_analysis, recommendation) in zip(results, commentary):
+            result['ai_analysis'] = ai_analysis
+            result['recommendation'] = recommendation
+    return [result for result, _ in results]
+
+@api_router.post("/screener")
+async def run_screener(request: ScreenerRequest):
+    """Screen a universe of symbols, streaming one NDJSON line per result as it is ready"""
+    symbols = list(dict.fromkeys(symbol.upper() for symbol in request.symbols))
+
+    async def stream():
+        semaphore = asyncio.Semaphore(SCREENER_CONCURRENCY)
+        fetches = {asyncio.create_task(fetch_screener_inputs(symbol, semaphore)) for symbol in symbols}
+        batches = set()
+        ready = []
+        try:
+            while fetches or batches or ready:
+                # Hand work to an idle worker right away; when all are busy,
+                # let fetched symbols pile up into a bigger vectorized batch
+                if ready and (len(batches) < SCREENER_WORKERS or len(ready) >= SCREENER_BATCH_SIZE or not fetches):
+                    batches.add(asyncio.create_task(screen_batch(ready[:SCREENER_BATCH_SIZE], request)))
+                    ready = ready[SCREENER_BATCH_SIZE:]
+                    continue
+
+                done, _ = await asyncio.wait(fetches | batches, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task in fetches:
+                        fetches.discard(task)
+                        item = task.result()
+                        if 'error' in item:
+                            yield json.dumps(item) + "\n"
+                        else:
+                            ready.append(item)
+                    else:
+                        batches.discard(task)
+                        for result in task.result():
+                            yield json.dumps(result) + "\n"
+        finally:
+            # Client went away or we are done: drop whatever is still pending
+            for task in fetches | batches:
+                task.cancel()
+
+    return StreamingResponse(fresh_context(stream()), media_type="application/x-ndjson")
+
+# Backtests run in the background; results are polled by id
+backtest_jobs: Dict[str, Dict] = {}
+backtest_tasks = set()
+
+async def load_backtest_inputs(symbol: str, days: int, include_fundamentals: bool,
+                               semaphore: asyncio.Semaphore) -> Optional[tuple]:
+    """Bar columns and fundamental points for one symbol, None when it has no bars"""
+    async with semaphore:
+        bars = await fetch_daily_bars(symbol, days)
+        finviz_data = await scrape_finviz_data(symbol) if include_fundamentals else {}
+    if not bars:
+        return None
+    return (bars.open, bars.high, bars.low, bars.close), technicals.fundamental_points(finviz_data)
+
+async def run_backtest(job: Dict, request: BacktestRequest):
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(SCREENER_CONCURRENCY)
+    days = int(request.years * 365.25)
+    horizons, edges = sorted(set(request.horizons)), sorted(set(request.bucket_edges))
+
+    async def run_chunk(chunk: List[str]) -> Dict:
+        loaded = await asyncio.gather(*(
+            load_backtest_inputs(symbol, days, request.include_fundamentals, semaphore) for symbol in chunk
+        ), return_exceptions=True)
+        inputs = []
+        for symbol, item in zip(chunk, loaded):
+            if isinstance(item, Exception) or item is None:
+                job['failed'].append(symbol)
+            else:
+                inputs.append(item)
+        stats = {}
+        if inputs:
+            stats = await loop.run_in_executor(
+                get_screener_pool(),
+                backtest.evaluate_batch,
+                [bars for bars, _ in inputs],
+                [points for _, points in inputs],
+                horizons,
+                edges,
+            )
+        job['processed'] += len(chunk)
+        return stats
+
+    start = time.perf_counter()
+    try:
+        # Bulk history downloads must not starve interactive requests
+        with background_priority():
+            chunks = [job['symbols'][i:i + SCREENER_BATCH_SIZE] for i in range(0, len(job['symbols']), SCREENER_BATCH_SIZE)]
+            total = {}
+            for stats in await asyncio.gather(*(run_chunk(chunk) for chunk in chunks)):
+                if stats:
+                    total = backtest.merge(total, stats)
+        job['results'] = backtest.report(total, horizons, edges) if total else []
+        job['status'] = 'done'
+    except Exception as e:
+        logger.error(f"Backtest {job['id']} error: {e}")
+        job['status'], job['error'] = 'error', str(e)
+    job['elapsed_seconds'] = round(time.perf_counter() - start, 2)
+
+@api_router.post("/backtest", status_code=202)
+async def start_backtest(request: BacktestRequest):
+    """Score every past bar of the symbols and group forward returns by score bucket.
+
+    Returns the job right away; poll GET /backtest/{id} for progress and results.
+    """
+    symbols = list(dict.fromkeys(symbol.upper() for symbol in request.symbols))
+    if not symbols or len(request.bucket_edges) < 2 or not request.horizons or min(request.horizons) < 1:
+        raise HTTPException(status_code=400, detail="symbols, horizons >= 1 and at least two bucket_edges are required")
+    job = {
+        'id': str(uuid.uuid4()),
+        'status': 'running',
+        'symbols': symbols,
+        'processed': 0,
+        'failed': [],
+        'started_at': datetime.now(timezone.utc).isoformat(),
+    }
+    finished = [job_id for job_id, old in backtest_jobs.items() if old['status'] != 'running']
+    for job_id in finished[:max(len(finished) - BACKTEST_MAX_JOBS + 1, 0)]:
+        del backtest_jobs[job_id]
+    backtest_jobs[job['id']] = job
+    # A fresh context: the job outlives this request and its upstream deadline
+    task = asyncio.create_task(run_backtest(job, request), context=contextvars.Context())
+    backtest_tasks.add(task)
+    task.add_done_callback(backtest_tasks.discard)
+    return job
+
+@api_router.get("/backtest/{job_id}")
+async def get_backtest(job_id: str):
+    job = backtest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Backtest not found")
+    return job
+
 # Portfolio management
 @api_router.post("/portfolio", response_model=PortfolioStock)
 async def add_to_portfolio(stock: PortfolioStockCreate):
     """Add stock to portfolio"""
     portfolio_obj = PortfolioStock(**stock.model_dump())
-    doc = portfolio_obj.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
-    doc['purchase_date'] = doc['purchase_date'].isoformat()
-    
-    await db.portfolio.insert_one(doc)
+    # Dates stay datetimes so Mongo stores them as BSON dates
+    position = await portfolio_store.insert(portfolio_obj.model_dump())
+    track_position(position)
+    if portfolio_valuation.price(portfolio_obj.symbol) is None:
+        await price_positions([portfolio_obj.symbol])
     return portfolio_obj
 
 @api_router.get("/portfolio", response_model=List[PortfolioStock])
-async def get_portfolio():
-    """Get all portfolio stocks"""
-    stocks = await db.portfolio.find({}, {"_id": 0}).to_list(1000)
-    
-    for stock in stocks:
-        if isinstance(stock['timestamp'], str):
-            stock['timestamp'] = datetime.fromisoformat(stock['timestamp'])
-        if isinstance(stock['purchase_date'], str):
-            stock['purchase_date'] = datetime.fromisoformat(stock['purchase_date'])
-    
+async def get_portfolio(
+    request: Request,
+    response: Response,
+    limit: int = Query(PORTFOLIO_PAGE_SIZE, ge=1, le=PORTFOLIO_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
+    """Get one page of portfolio stocks; `X-Next-Cursor` points at the next page"""
+    etag = make_etag(await portfolio_store.version(), limit, cursor)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return not_modified(etag)
+    try:
+        stocks, next_cursor = await portfolio_store.page(limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+    response.headers.update(cache_headers(etag))
     return stocks
 
+@api_router.get("/portfolio/stream")
+async def stream_portfolio():
+    """Every portfolio stock as NDJSON, read from the cursor batch by batch"""
+    async def lines():
+        async for stock in portfolio_store.iter_lots():
+            yield PortfolioStock(**stock).model_dump_json() + "\n"
+
+    return StreamingResponse(fresh_context(lines()), media_type="application/x-ndjson")
+
+def track_position(position: Dict):
+    """Apply a symbol's updated position to the valuation"""
+    symbol = position['_id']
+    if position['lots'] > 0:
+        portfolio_valuation.set_position(symbol, position['shares'], position['cost'])
+    else:
+        portfolio_valuation.remove_position(symbol)
+
+async def price_positions(symbols):
+    """Live price or last close for each held symbol"""
+    for symbol, quote in (await get_quotes(symbols, change=False)).items():
+        if quote['current_price'] is not None:
+            portfolio_valuation.set_price(symbol, quote['current_price'])
+
+async def sync_positions(version: str) -> Set[str]:
+    """Load positions from Mongo as of portfolio `version`; returns the held symbols"""
+    global valuation_version
+    positions = await portfolio_store.load_positions()
+    portfolio_valuation.load(positions)
+    valuation_version = version
+    return set(positions)
+
+async def refresh_valuation(reprice: bool):
+    """Reload positions when lots changed (or on a re-price) and price them.
+
+    `reprice` prices every held symbol; otherwise only those without a price
+    yet. Fresh live prices come from the hub, the rest from stored closes.
+    """
+    version = await portfolio_store.version()
+    if reprice or version != valuation_version:
+        await sync_positions(version)
+    symbols = [
+        symbol for symbol in portfolio_valuation.positions
+        if reprice or portfolio_valuation.price(symbol) is None
+    ]
+    if symbols:
+        await price_positions(symbols)
+
+async def run_valuation():
+    """Apply live prices as they arrive and resync periodically.
+
+    Live prices only flow for symbols a connected client subscribed to; the
+    valuation watches them without opening upstream subscriptions of its own.
+    Positions are checked every VALUATION_REFRESH_SECONDS, while re-pricing
+    every holding from closes follows the prefetch open/closed intervals.
+    """
+    async def apply_live_prices():
+        while True:
+            for update in await valuation_prices.next_updates():
+                portfolio_valuation.set_price(update['symbol'], update['price'])
+
+    price_hub.watch(valuation_prices)
+    consumer = asyncio.create_task(apply_live_prices())
+    loop = asyncio.get_running_loop()
+    next_reprice = loop.time()
+    try:
+        while True:
+            reprice = loop.time() >= next_reprice
+            if reprice:
+                next_reprice = loop.time() + market_interval(PREFETCH_OPEN_INTERVAL, PREFETCH_CLOSED_INTERVAL)
+            try:
+                # Re-pricing every holding must not spend the budget users are waiting on
+                with background_priority():
+                    await refresh_valuation(reprice)
+            except Exception as e:
+                logger.error(f"Portfolio valuation refresh error: {e}")
+            valuation_ready.set()
+            await asyncio.sleep(VALUATION_REFRESH_SECONDS)
+    finally:
+        consumer.cancel()
+        price_hub.unwatch(valuation_prices)
+
 @api_router.delete("/portfolio/{stock_id}")
 async def remove_from_portfolio(stock_id: str):
     """Remove stock from portfolio"""
-    result = await db.portfolio.delete_one({"id": stock_id})
-    if result.deleted_count == 0:
+    position = await portfolio_store.delete(stock_id)
+    if position is None:
         raise HTTPException(status_code=404, detail="Stock not found in portfolio")
+    track_position(position)
     return {"message": "Stock removed from portfolio"}
 
+SUMMARY_FIELDS = {'_id': 0, 'id': 1, 'symbol': 1, 'name': 1, 'shares': 1, 'purchase_price': 1}
+
 @api_router.get("/portfolio/summary")
-async def get_portfolio_summary():
-    """Get portfolio summary with current values"""
-    stocks = await db.portfolio.find({}, {"_id": 0}).to_list(1000)
-    
-    total_invested = 0
-    total_current_value = 0
+async def get_portfolio_summary(request: Request):
+    """Get portfolio summary with current values (304 while lots and prices are unchanged)"""
+    # Totals and prices are maintained by the valuation; only per-lot rows are built here
+    await valuation_ready.wait()
+    version = await portfolio_store.version()
+    if version != valuation_version:
+        # Lots changed (possibly in another worker) since the positions were
+        # loaded: reload them so the totals match the rows read below
+        await upstream_calls.do(('positions', version), sync_positions, version)
+    etag = make_etag(version, portfolio_valuation.prices, portfolio_valuation.totals())
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return not_modified(etag)
     portfolio_details = []
     
-    for stock in stocks:
+    async for stock in portfolio_store.iter_lots(SUMMARY_FIELDS):
         symbol = stock['symbol']
         shares = stock['shares']
         purchase_price = stock['purchase_price']
         
-        # Get current price
-        try:
-            aggs = list(polygon_client.get_aggs(
-                ticker=symbol,
-                multiplier=1,
-                timespan="day",
-                from_=(datetime.now() - timedelta(days=2)).strftime('%Y-%m-%d'),
-                to=datetime.now().strftime('%Y-%m-%d')
-            ))
-            current_price = aggs[-1].close if aggs else purchase_price
-        except:
+        current_price = portfolio_valuation.price(symbol)
+        if current_price is None:
             current_price = purchase_price
         
         invested = shares * purchase_price
@@ -532,9 +1253,6 @@ async def get_portfolio_summary():
         profit_loss = current_value - invested
         profit_loss_percent = (profit_loss / invested) * 100 if invested > 0 else 0
         
-        total_invested += invested
-        total_current_value += current_value
-        
         portfolio_details.append({
             'id': stock['id'],
             'symbol': symbol,
@@ -548,13 +1266,107 @@ async def get_portfolio_summary():
             'profit_loss_percent': round(profit_loss_percent, 2)
         })
     
-    return {
-        'total_invested': round(total_invested, 2),
-        'total_current_value': round(total_current_value, 2),
-        'total_profit_loss': round(total_current_value - total_invested, 2),
-        'total_profit_loss_percent': round(((total_current_value - total_invested) / total_invested * 100) if total_invested > 0 else 0, 2),
+    return json_response({
+        **portfolio_valuation.totals(),
         'stocks': portfolio_details
-    }
+    }, etag)
+
+# Live prices
+async def send_initial_prices(subscriber: PriceSubscriber, symbols: List[str]):
+    """Give new subscribers the last close for symbols the feed has not priced yet"""
+    missing = [symbol for symbol in symbols if price_hub.last_price(symbol) is None]
+    if not missing:
+        return
+    for symbol, quote in (await get_quotes(missing, change=False)).items():
+        price = quote['current_price']
+        if price is not None and symbol in subscriber.symbols and price_hub.last_price(symbol) is None:
+            subscriber.push({'symbol': symbol, 'price': price, 'timestamp': None})
+
+@api_router.websocket("/ws/prices")
+async def prices_websocket(websocket: WebSocket):
+    """Push price updates for the symbols the client subscribes to.
+
+    Client messages: {"action": "subscribe" | "unsubscribe", "symbols": [...]}.
+    Server messages: {"symbol", "price", "timestamp"}; a slow client only gets
+    the newest price per symbol.
+    """
+    await websocket.accept()
+    subscriber = PriceSubscriber()
+
+    async def send_updates():
+        while True:
+            for update in await subscriber.next_updates():
+                await websocket.send_json(update)
+
+    sender = asyncio.create_task(send_updates())
+    # Referenced until done, and cancelled with the connection
+    initial_prices: Set[asyncio.Task] = set()
+    try:
+        while True:
+            message = await websocket.receive_json()
+            symbols = [str(symbol).upper() for symbol in message.get('symbols', [])]
+            if message.get('action') == 'subscribe':
+                price_hub.subscribe(subscriber, symbols)
+                task = asyncio.create_task(send_initial_prices(subscriber, symbols))
+                initial_prices.add(task)
+                task.add_done_callback(initial_prices.discard)
+            elif message.get('action') == 'unsubscribe':
+                price_hub.unsubscribe(subscriber, symbols)
+            else:
+                await websocket.send_json({'error': f"Unknown action: {message.get('action')}"})
+    except (WebSocketDisconnect, json.JSONDecodeError, AttributeError):
+        pass
+    finally:
+        sender.cancel()
+        for task in initial_prices:
+            task.cancel()
+        price_hub.drop(subscriber)
+
+loop_lag_monitor: Optional[asyncio.Task] = None
+valuation_task: Optional[asyncio.Task] = None
+prefetch_task: Optional[asyncio.Task] = None
+ticker_index_task: Optional[asyncio.Task] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global loop_lag_monitor, valuation_task, prefetch_task, ticker_index_task
+    open_clients()
+    loop_lag_monitor = asyncio.create_task(metrics.monitor_event_loop_lag())
+    try:
+        # Open the first pooled connection now rather than on the first request
+        await mongo_client.admin.command('ping')
+    except Exception as e:
+        logger.error(f"MongoDB not reachable at startup: {e}")
+    await leases.ensure_indexes()
+    await analysis_cache.ensure_indexes()
+    await details_cache.ensure_indexes()
+    await portfolio_store.ensure_indexes()
+    migrated = await portfolio_store.migrate_dates()
+    if migrated:
+        logger.info(f"Converted {migrated} portfolio dates from ISO strings to BSON dates")
+    numbered = await portfolio_store.migrate_seq()
+    if numbered:
+        logger.info(f"Numbered {numbered} portfolio lots for paging")
+    # Positions are shared by every worker: one of them repairs them per deployment
+    if await leases.acquire('portfolio_rebuild', 600):
+        await portfolio_store.rebuild_positions()
+    tickers = await ticker_directory.load()
+    logger.info(f"Ticker index loaded: {tickers} tickers")
+    valuation_task = asyncio.create_task(run_valuation())
+    prefetch_task = asyncio.create_task(prefetch_scheduler.run())
+    ticker_index_task = asyncio.create_task(ticker_directory.run())
+
+    yield
+
+    for task in (loop_lag_monitor, valuation_task, prefetch_task, ticker_index_task, *backtest_tasks):
+        if task is not None:
+            task.cancel()
+    await close_clients()
+    if screener_pool is not None:
+        screener_pool.shutdown(wait=False, cancel_futures=True)
+
+# Responses are encoded with orjson (routes returning json_response skip FastAPI's encoder too)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -567,6 +1379,41 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+@app.middleware("http")
+async def record_timings(request, call_next):
+    """Per-route latency histogram and a Server-Timing header with per-stage durations.
+
+    Also opens the request deadline that bounds every upstream call it makes
+    (streamed bodies run outside it, see fresh_context).
+    """
+    timings = metrics.start_request_timings()
+    start = time.perf_counter()
+    with deadline_scope(REQUEST_DEADLINE):
+        response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    route = request.scope.get('route')
+    metrics.HTTP_REQUEST_SECONDS.observe(
+        elapsed,
+        method=request.method,
+        route=route.path if route is not None else 'unmatched',
+        status=response.status_code,
+    )
+    response.headers['Server-Timing'] = metrics.server_timing({**timings, 'total': elapsed})
+    return response
+
+async def prefetch_symbols() -> List[str]:
+    return [*(await portfolio_store.load_positions()), *PREFETCH_WATCHLIST]
+
+async def warm_symbol(symbol: str):
+    """Bars (and with them the last close) and fundamentals an analysis would need"""
+    await asyncio.gather(fetch_daily_bars(symbol, ANALYSIS_HISTORY_DAYS), scrape_finviz_data(symbol))
+
+prefetch_scheduler = PrefetchScheduler(
+    prefetch_symbols,
+    warm_symbol,
+    concurrency=PREFETCH_CONCURRENCY,
+    open_interval=PREFETCH_OPEN_INTERVAL,
+    closed_interval=PREFETCH_CLOSED_INTERVAL,
+    # With several workers, each period is warmed by whichever claims it first
+    claim=lambda period: leases.acquire('prefetch', period * 0.9),
+)
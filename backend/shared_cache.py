@@ -0,0 +1,166 @@
+"""Two-tier cache shared by every worker process.
+
+L1 is a bounded in-process LRU; L2 is a MongoDB collection whose TTL index
+drops expired entries, so a value loaded by one uvicorn worker is served to
+all the others. ``get_or_load`` also takes a short lease per key: when several
+workers miss at once, one calls upstream and the rest wait for its result in
+L2 instead of repeating the call. A waiter takes the lease over as soon as the
+holder gives it up without a value, and never waits past the request deadline.
+
+``Leases`` is also used on its own: ``load_once`` gives the same one-loader
+guarantee to stores with their own layout (FINVIZ fundamentals, bar files),
+and periodic jobs (prefetching, the ticker snapshot) take a lease so they run
+in one worker per period.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from metrics import CACHE_LOOKUPS
+from upstream import UpstreamUnavailable, remaining_time
+
+logger = logging.getLogger(__name__)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class Leases:
+    """Named, expiring locks in a MongoDB collection"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([('expires_at', ASCENDING)], expireAfterSeconds=0)
+
+    async def acquire(self, name: str, seconds: float) -> bool:
+        """Take the lease unless someone holds an unexpired one"""
+        now = _utcnow()
+        lease = {'owner': self.owner, 'expires_at': now + timedelta(seconds=seconds)}
+        try:
+            await self.collection.insert_one({'_id': name, **lease})
+            return True
+        except DuplicateKeyError:
+            # The TTL monitor runs once a minute; take over an expired lease ourselves
+            taken = await self.collection.find_one_and_update(
+                {'_id': name, 'expires_at': {'$lte': now}}, {'$set': lease},
+            )
+            return taken is not None
+
+    async def held(self, name: str) -> bool:
+        doc = await self.collection.find_one({'_id': name, 'expires_at': {'$gt': _utcnow()}}, {'_id': 1})
+        return doc is not None
+
+    async def release(self, name: str):
+        await self.collection.delete_one({'_id': name, 'owner': self.owner})
+
+    async def load_once(self, name: str, seconds: float, lookup: Callable[[], Awaitable[Any]],
+                        load: Callable[[], Awaitable[Any]], poll_interval: float = 0.05,
+                        max_poll_interval: float = 1.0) -> Any:
+        """`load()` under lease `name`, unless `lookup()` finds what another worker loaded.
+
+        Workers that miss the lease poll `lookup()` until it returns a value,
+        take the lease over as soon as the holder gives it up without one,
+        and never wait past the request deadline.
+        """
+        if not await self.acquire(name, seconds):
+            interval = poll_interval
+            while True:
+                remaining = remaining_time()
+                if remaining is not None and remaining <= 0:
+                    raise UpstreamUnavailable(f"request deadline exceeded waiting for {name}")
+                await asyncio.sleep(interval if remaining is None else min(interval, remaining))
+                value = await lookup()
+                if value is not None:
+                    return value
+                if not await self.held(name) and await self.acquire(name, seconds):
+                    logger.info(f"Lease {name} given up without a value, loading it here")
+                    break
+                # Back off: a long load should not cost a read every few milliseconds
+                interval = min(interval * 2, max_poll_interval)
+
+        try:
+            # The previous holder may have finished between our miss and its release
+            value = await lookup()
+            return value if value is not None else await load()
+        finally:
+            await self.release(name)
+
+
+class SharedCache:
+    def __init__(self, collection, leases: Leases, name: str, max_entries: int = 1024,
+                 lease_seconds: float = 30, poll_interval: float = 0.05, max_poll_interval: float = 1.0):
+        self.collection = collection
+        self.leases = leases
+        self.name = name
+        self.max_entries = max_entries
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._memory: "OrderedDict[str, Tuple[datetime, Any]]" = OrderedDict()
+
+    async def ensure_indexes(self):
+        # Mongo drops expired documents on its own
+        await self.collection.create_index([('expires_at', ASCENDING)], expireAfterSeconds=0)
+
+    async def get(self, key: str) -> Optional[Any]:
+        now = _utcnow()
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._memory.move_to_end(key)
+                CACHE_LOOKUPS.inc(cache=self.name, result='memory')
+                return entry[1]
+            del self._memory[key]
+
+        value = await self._get_shared(key, now)
+        CACHE_LOOKUPS.inc(cache=self.name, result='miss' if value is None else 'mongo')
+        return value
+
+    async def _get_shared(self, key: str, now: datetime) -> Optional[Any]:
+        doc = await self.collection.find_one({'_id': key, 'expires_at': {'$gt': now}})
+        if doc is None or doc.get('value') is None:
+            return None
+        self._remember(key, doc['expires_at'], doc['value'])
+        return doc['value']
+
+    async def set(self, key: str, value: Any, ttl: float):
+        expires_at = _utcnow() + timedelta(seconds=ttl)
+        self._remember(key, expires_at, value)
+        await self.collection.replace_one({'_id': key}, {'value': value, 'expires_at': expires_at}, upsert=True)
+
+    async def get_or_load(self, key: str, load: Callable[[], Awaitable[Any]], ttl: float) -> Any:
+        """Cached value, or `load()` run by a single worker and shared with the rest"""
+        value = await self.get(key)
+        if value is not None:
+            return value
+        return await self.fill(key, load, ttl)
+
+    async def fill(self, key: str, load: Callable[[], Awaitable[Any]], ttl: float) -> Any:
+        """Store and return `load()` after a miss, unless another worker is already loading `key`"""
+        async def load_and_store():
+            value = await load()
+            if value is not None:
+                await self.set(key, value, ttl)
+            return value
+
+        return await self.leases.load_once(
+            f"{self.name}:{key}", self.lease_seconds, lambda: self._get_shared(key, _utcnow()),
+            load_and_store, self.poll_interval, self.max_poll_interval,
+        )
+
+    def _remember(self, key: str, expires_at: datetime, value: Any):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
@@ -0,0 +1,169 @@
+"""Per-symbol technical summary and the potential score heuristic.
+
+Pure functions over plain lists/arrays so they can run in worker processes
+(see the screener and the backtester) as well as inline in a request.
+"""
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+import candles
+import indicators
+
+
+def summarize(opens: Sequence[float], highs: Sequence[float], lows: Sequence[float],
+              closes: Sequence[float], history: int = 30) -> Dict:
+    """Latest indicator values and candlestick patterns for one symbol's bars.
+
+    `candlestick_events` maps each pattern to the bars where it fired within
+    the last `history` bars, as indices into that window.
+    """
+    return summarize_many([(opens, highs, lows, closes)], history)[0]
+
+
+def stack_bars(bars: Sequence[Tuple[Sequence[float], ...]]) -> Tuple[np.ndarray, ...]:
+    """(opens, highs, lows, closes) matrices, one row per symbol, left-padded with NaN"""
+    lengths = [len(closes) for _, _, _, closes in bars]
+    width = max(lengths, default=0)
+
+    def stack(field: int) -> np.ndarray:
+        matrix = np.full((len(bars), width), np.nan)
+        for row, (symbol_bars, length) in enumerate(zip(bars, lengths)):
+            if length:
+                matrix[row, width - length:] = symbol_bars[field]
+        return matrix
+
+    return tuple(stack(field) for field in range(4))
+
+
+def summarize_many(bars: Sequence[Tuple[Sequence[float], ...]], history: int = 30) -> List[Dict]:
+    """`summarize` for many symbols in one vectorized pass.
+
+    `bars` holds one (opens, highs, lows, closes) tuple per symbol; histories
+    of different length are left-padded with NaN into a single matrix.
+    """
+    lengths = [len(closes) for _, _, _, closes in bars]
+    width = max(lengths, default=0)
+    o, h, l, c = stack_bars(bars)
+    series = indicators.compute_indicators(c, high=h, low=l)
+    masks = candles.scan(o, h, l, c)
+
+    # Latest value of every indicator for all symbols at once
+    latest_columns = {
+        name: [None if value != value else round(value, 2) for value in values[:, -1].tolist()]
+        for name, values in series.items()
+    }
+
+    # Pattern hits inside each symbol's last `history` bars, as window indices
+    window = min(history, width)
+    events = [{} for _ in bars]
+    for name in candles.PATTERNS:
+        rows, columns = np.nonzero(masks[name][:, width - window:])
+        for row, column in zip(rows.tolist(), columns.tolist()):
+            events[row].setdefault(name, []).append(column - max(window - lengths[row], 0))
+
+    summaries = []
+    for row, length in enumerate(lengths):
+        if length < 3:
+            pattern = "Insufficient data"
+        else:
+            pattern = ", ".join(name for name in candles.PATTERNS if masks[name][row, -1]) or "Patrón Neutral"
+        summaries.append({
+            'technicals': {name: column[row] for name, column in latest_columns.items()},
+            'candlestick_pattern': pattern,
+            'candlestick_events': events[row],
+            'current_price': float(c[row, -1]) if length else None,
+        })
+    return summaries
+
+
+def fundamental_points(analysis_data: Dict) -> int:
+    """Beta, dividend and P/E part of the potential score"""
+    points = 0
+
+    # Beta check (lower is better for stability)
+    if analysis_data.get('beta'):
+        if analysis_data['beta'] < 1:
+            points += 10
+        elif analysis_data['beta'] > 1.5:
+            points -= 10
+
+    # Dividend yield (higher is better)
+    if analysis_data.get('dividend_yield'):
+        if analysis_data['dividend_yield'] > 3:
+            points += 15
+        elif analysis_data['dividend_yield'] > 1:
+            points += 8
+
+    # P/E ratio (reasonable range)
+    if analysis_data.get('pe_ratio'):
+        if 15 <= analysis_data['pe_ratio'] <= 25:
+            points += 10
+        elif analysis_data['pe_ratio'] > 40:
+            points -= 10
+
+    return points
+
+
+def potential_score(analysis_data: Dict) -> float:
+    """Heuristic 0-100 score from fundamentals, trend, candles and RSI"""
+    potential_score = 50 + fundamental_points(analysis_data)  # Base score
+
+    # EMA trend
+    ema_20, ema_50 = analysis_data.get('ema_20'), analysis_data.get('ema_50')
+    if ema_20 and ema_50 and ema_20 > ema_50:
+        potential_score += 15
+    elif ema_20 and ema_50 and ema_20 < ema_50:
+        potential_score -= 10
+
+    # Candlestick pattern
+    candlestick_pattern = analysis_data.get('candlestick_pattern') or ''
+    if "Alcista" in candlestick_pattern:
+        potential_score += 10
+    elif "Bajista" in candlestick_pattern:
+        potential_score -= 10
+
+    # RSI (overbought/oversold)
+    if analysis_data.get('rsi'):
+        if 30 <= analysis_data['rsi'] <= 70:
+            potential_score += 5
+        elif analysis_data['rsi'] > 70:
+            potential_score -= 10
+        elif analysis_data['rsi'] < 30:
+            potential_score += 10  # Oversold can be buying opportunity
+
+    return max(0, min(100, potential_score))
+
+
+def potential_score_series(opens, highs, lows, closes, fundamentals=0) -> np.ndarray:
+    """`potential_score` as of every bar, for one symbol or a (symbols, bars) matrix.
+
+    Uses the same rules on the indicator values each bar would have shown.
+    Fundamentals only exist as a current snapshot, so they enter as constant
+    points per row (`fundamentals`, see `fundamental_points`). NaN until the
+    EMA50 is warmed up.
+    """
+    o, h, l, c = (np.asarray(values, dtype=np.float64) for values in (opens, highs, lows, closes))
+    squeeze = c.ndim == 1
+    if squeeze:
+        o, h, l, c = (values[np.newaxis, :] for values in (o, h, l, c))
+    base = 50 + np.asarray(fundamentals, dtype=np.float64).reshape(-1, 1)
+
+    # Rounded like the values the live score sees
+    ema_20 = np.round(indicators.ema(c, 20), 2)
+    ema_50 = np.round(indicators.ema(c, 50), 2)
+    rsi = np.round(indicators.rsi(c), 2)
+    masks = candles.scan(o, h, l, c)
+    bullish = np.logical_or.reduce([masks[name] for name in candles.PATTERNS if "Alcista" in name])
+    bearish = np.logical_or.reduce([masks[name] for name in candles.PATTERNS if "Bajista" in name])
+
+    with np.errstate(invalid='ignore'):
+        trend = (ema_20 != 0) & (ema_50 != 0)
+        score = base + np.select([trend & (ema_20 > ema_50), trend & (ema_20 < ema_50)], [15, -10], 0)
+        score += np.select([bullish, bearish], [10, -10], 0)
+        score += np.select(
+            [(rsi >= 30) & (rsi <= 70), rsi > 70, (rsi < 30) & (rsi != 0)], [5, -10, 10], 0,
+        )
+        score = np.clip(score, 0, 100)
+    score[np.isnan(ema_50)] = np.nan
+    return score[0] if squeeze else score
@@ -0,0 +1,198 @@
+"""Local ticker directory for search-as-you-type.
+
+A snapshot of every listed ticker (symbol and company name) is pulled from
+Polygon every ``refresh_seconds``, kept in MongoDB so a restart does not need
+Polygon, and loaded into a ``TickerIndex``:
+
+- tickers and name words in sorted arrays, so a prefix is two bisections;
+- a trigram -> entries posting list per name, so misspellings still match.
+
+Results are ranked: exact ticker, ticker prefix, name prefix, word prefix,
+then trigram similarity.
+
+With several worker processes, ``claim`` picks the one that pulls each
+snapshot; the others load it from MongoDB.
+"""
+import asyncio
+import logging
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from pymongo import UpdateOne
+
+from rate_limit import background_priority
+
+logger = logging.getLogger(__name__)
+
+# Trigram similarity (shared / all distinct trigrams) below which a name is no match
+MIN_SIMILARITY = 0.3
+# Entries scored per prefix query (one letter matches thousands of tickers)
+MAX_PREFIX_CANDIDATES = 500
+
+
+def normalize(text: str) -> str:
+    """Lowercase ASCII words: 'Nestlé S.A.' -> 'nestle s a'"""
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode()
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', text.lower()).split())
+
+
+def trigrams(text: str) -> set:
+    """Trigrams of each word padded like pg_trgm ('  w', ' wo', ..., 'rd ')"""
+    grams = set()
+    for word in text.split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TickerIndex:
+    def __init__(self, entries: Sequence[Dict]):
+        self.tickers = [entry['ticker'] for entry in entries]
+        self.names = [entry.get('name') or '' for entry in entries]
+        normalized = [normalize(name) for name in self.names]
+
+        order = sorted(range(len(self.tickers)), key=self.tickers.__getitem__)
+        self._ticker_keys = [self.tickers[i].lower() for i in order]
+        self._ticker_ids = array('i', order)
+
+        self._names = normalized
+        self._name_words = [tuple(name.split()) for name in normalized]
+        words = sorted(
+            (word, i) for i, name in enumerate(normalized) for word in set(name.split())
+        )
+        self._word_keys = [word for word, _ in words]
+        self._word_ids = array('i', (i for _, i in words))
+
+        postings = defaultdict(list)
+        counts = np.zeros(len(self.tickers), dtype=np.int32)
+        for i, name in enumerate(normalized):
+            grams = trigrams(f'{self.tickers[i].lower()} {name}')
+            counts[i] = len(grams)
+            for gram in grams:
+                postings[gram].append(i)
+        self._postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self._trigram_counts = counts
+
+    def __len__(self) -> int:
+        return len(self.tickers)
+
+    @staticmethod
+    def _key_range(keys: List[str], key: str, prefix: bool = True) -> range:
+        """Positions of `keys` starting with (or equal to) `key`"""
+        start = bisect_left(keys, key)
+        end = bisect_left(keys, key + '\uffff', lo=start) if prefix else bisect_right(keys, key, lo=start)
+        return range(start, end)
+
+    def search(self, query: str, limit: int = 10) -> List[Dict]:
+        """Best `limit` entries for a ticker or company-name query"""
+        text = normalize(query)
+        if not text:
+            return []
+        scores: Dict[int, float] = {}
+
+        def score(i: int, value: float):
+            if value > scores.get(i, 0.0):
+                scores[i] = value
+
+        ticker_query = text.replace(' ', '')
+        for position in self._key_range(self._ticker_keys, ticker_query)[:MAX_PREFIX_CANDIDATES]:
+            i = self._ticker_ids[position]
+            score(i, 4.0 if self._ticker_keys[position] == ticker_query else 3.0)
+
+        # Earlier words must be whole name words, the last one may be partial;
+        # walk the rarest of them
+        words = text.split()
+        ranges = [self._key_range(self._word_keys, word, prefix=False) for word in words[:-1]]
+        ranges.append(self._key_range(self._word_keys, words[-1]))
+        for position in min(ranges, key=len)[:MAX_PREFIX_CANDIDATES]:
+            i = self._word_ids[position]
+            name_words = self._name_words[i]
+            if self._names[i].startswith(text):
+                score(i, 2.5)
+            elif all(word in name_words for word in words[:-1]) and any(
+                    word.startswith(words[-1]) for word in name_words):
+                score(i, 2.0)
+
+        if len(scores) < limit and len(ticker_query) >= 3:
+            grams = [self._postings[gram] for gram in trigrams(text) if gram in self._postings]
+            if grams:
+                shared = np.bincount(np.concatenate(grams), minlength=len(self.tickers))
+                similarity = shared / (len(trigrams(text)) + self._trigram_counts - shared)
+                for i in np.flatnonzero(similarity >= MIN_SIMILARITY):
+                    score(int(i), float(similarity[i]))
+
+        ranked = sorted(scores, key=lambda i: (-scores[i], len(self.tickers[i]), self.tickers[i]))
+        return [{'symbol': self.tickers[i], 'name': self.names[i]} for i in ranked[:limit]]
+
+
+class TickerDirectory:
+    """The current TickerIndex, persisted in MongoDB and refreshed from a snapshot"""
+
+    def __init__(self, collection, fetch_snapshot: Callable[[], Awaitable[List[Dict]]],
+                 refresh_seconds: float = 24 * 3600, batch_size: int = 1000,
+                 claim: Optional[Callable[[], Awaitable[bool]]] = None):
+        self.collection = collection
+        self.claim = claim
+        self.batch_size = batch_size
+        self.fetch_snapshot = fetch_snapshot
+        self.refresh_interval = timedelta(seconds=refresh_seconds)
+        self.index = TickerIndex([])
+        self.snapshot_at: Optional[datetime] = None
+
+    async def load(self) -> int:
+        """Build the index from the stored snapshot"""
+        docs = await self.collection.find({}, {'name': 1, 'snapshot_at': 1}).to_list(None)
+        if docs:
+            entries = [{'ticker': doc['_id'], 'name': doc.get('name', '')} for doc in docs]
+            self.index = await asyncio.to_thread(TickerIndex, entries)
+            self.snapshot_at = max(doc['snapshot_at'] for doc in docs).replace(tzinfo=timezone.utc)
+        return len(self.index)
+
+    async def refresh(self) -> int:
+        """Pull a new snapshot, store it and swap the index"""
+        entries = await self.fetch_snapshot()
+        if not entries:
+            # An upstream problem, not a delisting of everything: keep the current index
+            raise ValueError("Empty ticker snapshot")
+        snapshot_at = datetime.now(timezone.utc)
+        for start in range(0, len(entries), self.batch_size):
+            await self.collection.bulk_write([
+                UpdateOne(
+                    {'_id': entry['ticker']},
+                    {'$set': {'name': entry.get('name', ''), 'snapshot_at': snapshot_at}},
+                    upsert=True,
+                )
+                for entry in entries[start:start + self.batch_size]
+            ], ordered=False)
+        await self.collection.delete_many({'snapshot_at': {'$lt': snapshot_at}})
+        self.index = await asyncio.to_thread(TickerIndex, entries)
+        self.snapshot_at = snapshot_at
+        return len(self.index)
+
+    def next_delay(self) -> float:
+        if self.snapshot_at is None:
+            return 0.0
+        due = self.snapshot_at + self.refresh_interval
+        return max((due - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+    async def run(self, retry_seconds: float = 300):
+        while True:
+            await asyncio.sleep(self.next_delay())
+            try:
+                if self.claim is not None and not await self.claim():
+                    # Another worker is pulling it: pick its snapshot up from Mongo
+                    await asyncio.sleep(retry_seconds)
+                    await self.load()
+                    continue
+                with background_priority():
+                    count = await self.refresh()
+                logger.info(f"Ticker index refreshed: {count} tickers")
+            except Exception as e:
+                logger.error(f"Ticker index refresh error: {e}")
+                await asyncio.sleep(retry_seconds)
@@ -0,0 +1,282 @@
+"""Resilient calls to external services.
+
+Each ``Upstream`` wraps one service (Polygon, FINVIZ, OpenAI) with:
+
+- deadline propagation: a request-wide deadline (``deadline_scope``) caps every
+  attempt's timeout, and no retry starts once it has passed;
+- jittered exponential retries for transient failures only;
+- an adaptive (AIMD) concurrency limit that shrinks when the service times
+  out or overloads and grows back slowly while calls are fast;
+- a circuit breaker that fails fast after repeated transient failures and
+  lets a single probe through once its cool-down is over;
+- optionally, the last good value per key, served when the service is down.
+"""
+import asyncio
+import contextvars
+import logging
+import random
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable, Optional
+
+import httpx
+import openai
+import urllib3
+from polygon.exceptions import BadResponse
+
+from metrics import REGISTRY, track_upstream
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_OPEN = REGISTRY.gauge('upstream_circuit_open', '1 while the upstream circuit breaker is open', ('upstream',))
+CONCURRENCY_LIMIT = REGISTRY.gauge(
+    'upstream_concurrency_limit', 'Current adaptive concurrency limit per upstream', ('upstream',))
+RETRIES = REGISTRY.counter('upstream_retries_total', 'Retried upstream attempts', ('upstream',))
+STALE_SERVED = REGISTRY.counter(
+    'upstream_stale_served_total', 'Last good values served because an upstream failed', ('upstream',))
+
+_deadline: ContextVar[Optional[float]] = ContextVar('upstream_deadline', default=None)
+
+
+class UpstreamUnavailable(Exception):
+    """The circuit is open, the deadline passed or retries ran out on transient errors"""
+
+
+@contextmanager
+def deadline_scope(seconds: float):
+    """Calls made in this context (and tasks it spawns) must finish within `seconds`"""
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+_END = object()
+
+
+async def fresh_context(stream: AsyncIterator) -> AsyncIterator:
+    """Iterate `stream` in a new, empty context.
+
+    A streamed response body keeps running after its handler returned, so it
+    must not inherit the request deadline; bound its own steps instead.
+    """
+    context = contextvars.Context()
+    iterator = stream.__aiter__()
+
+    async def next_item():
+        try:
+            return await iterator.__anext__()
+        except StopAsyncIteration:
+            return _END
+
+    try:
+        while True:
+            step = asyncio.create_task(next_item(), context=context)
+            try:
+                item = await step
+            except asyncio.CancelledError:
+                # The client went away: stop the body where it is
+                step.cancel()
+                await asyncio.gather(step, return_exceptions=True)
+                raise
+            if item is _END:
+                return
+            yield item
+    finally:
+        aclose = getattr(iterator, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Failures worth retrying and counting against the upstream's health"""
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    if isinstance(exc, httpx.TransportError):
+        return True
+    if isinstance(exc, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    if isinstance(exc, urllib3.exceptions.HTTPError):
+        return True
+    if isinstance(exc, BadResponse):
+        # Polygon only exposes the body; rate limiting is the transient case
+        return 'exceeded the maximum requests' in str(exc)
+    return False
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self._probing or time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+        self._probing = True  # half-open: one call decides
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def abandon(self):
+        """A call that was let through ended without an outcome: the next one may probe"""
+        self._probing = False
+
+
+class AdaptiveLimit:
+    """Additive-increase / multiplicative-decrease limit on calls in flight"""
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = 64, latency_target: float = 2.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, overloaded: bool, latency: Optional[float]):
+        """Free a slot; a None latency (no answer to judge) leaves the limit as it is"""
+        async with self._condition:
+            self.in_flight -= 1
+            if overloaded:
+                self.limit = max(self.minimum, self.limit * 0.7)
+            elif latency is not None and latency <= self.latency_target:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class Upstream:
+    def __init__(self, name: str, timeout: float, retries: int = 2, backoff: float = 0.2,
+                 concurrency: int = 16, max_concurrency: int = 64, latency_target: Optional[float] = None,
+                 failure_threshold: int = 5, reset_timeout: float = 30, stale_entries: int = 1024):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = AdaptiveLimit(
+            concurrency, maximum=max_concurrency,
+            latency_target=latency_target if latency_target is not None else timeout / 2,
+        )
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.stale_entries = stale_entries
+        self._last_good: "OrderedDict[Hashable, Any]" = OrderedDict()
+        CONCURRENCY_LIMIT.set(concurrency, upstream=name)
+        CIRCUIT_OPEN.set(0, upstream=name)
+
+    async def call(self, attempt: Callable[[float], Awaitable[Any]], operation: str = 'call',
+                   stale_key: Optional[Hashable] = None,
+                   before_attempt: Optional[Callable[[], Awaitable[Any]]] = None) -> Any:
+        """Run `attempt(timeout)` with retries, limits and the breaker.
+
+        `attempt` must finish within the timeout it is given. `before_attempt`
+        (a local rate limit, say) is awaited before every attempt, outside its
+        timeout and concurrency slot, so waiting on it never counts against
+        the upstream. With a `stale_key`, the last good value for that key is
+        returned instead of raising when the upstream is unavailable.
+        """
+        try:
+            result = await self._call(attempt, operation, before_attempt)
+        except UpstreamUnavailable:
+            if stale_key is not None and stale_key in self._last_good:
+                STALE_SERVED.inc(upstream=self.name)
+                logger.warning(f"{self.name} unavailable, serving last good {operation} for {stale_key}")
+                return self._last_good[stale_key]
+            raise
+        if stale_key is not None:
+            self._last_good[stale_key] = result
+            self._last_good.move_to_end(stale_key)
+            while len(self._last_good) > self.stale_entries:
+                self._last_good.popitem(last=False)
+        return result
+
+    async def _call(self, attempt: Callable[[float], Awaitable[Any]], operation: str,
+                    before_attempt: Optional[Callable[[], Awaitable[Any]]]) -> Any:
+        for attempt_number in range(self.retries + 1):
+            if before_attempt is not None:
+                try:
+                    await asyncio.wait_for(before_attempt(), remaining_time())
+                except asyncio.TimeoutError:
+                    raise UpstreamUnavailable(f"{self.name}: request deadline exceeded before {operation}")
+            remaining = remaining_time()
+            if remaining is not None and remaining <= 0:
+                raise UpstreamUnavailable(f"{self.name}: request deadline exceeded")
+            timeout = self.timeout if remaining is None else min(self.timeout, remaining)
+            if not self.breaker.allow():
+                raise UpstreamUnavailable(f"{self.name} circuit open")
+
+            judged = False
+            try:
+                try:
+                    await asyncio.wait_for(self.limiter.acquire(), timeout)
+                except asyncio.TimeoutError:
+                    raise UpstreamUnavailable(f"{self.name}: no capacity before deadline")
+                start = time.monotonic()
+                transient, latency = False, None
+                try:
+                    with track_upstream(self.name, operation):
+                        result = await asyncio.wait_for(attempt(timeout), timeout)
+                    latency = time.monotonic() - start
+                except Exception as e:
+                    latency = time.monotonic() - start
+                    transient = is_transient(e)
+                    judged = True
+                    if not transient:
+                        # The service answered (bad symbol, bad request...): healthy, not retried
+                        self.breaker.record_success()
+                        raise
+                    self.breaker.record_failure()
+                    error = e
+                else:
+                    judged = True
+                    self.breaker.record_success()
+                    return result
+                finally:
+                    # Cancelled calls free their slot without moving the limit
+                    await self.limiter.release(transient, latency)
+            finally:
+                if not judged:
+                    # No capacity or cancelled: a half-open probe must not stay taken
+                    self.breaker.abandon()
+                CONCURRENCY_LIMIT.set(int(self.limiter.limit), upstream=self.name)
+                CIRCUIT_OPEN.set(1 if self.breaker.is_open else 0, upstream=self.name)
+
+            if attempt_number < self.retries:
+                RETRIES.inc(upstream=self.name)
+                # Full jitter keeps retries from synchronizing across requests
+                await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt_number))
+
+        raise UpstreamUnavailable(f"{self.name} {operation} failed: {error!r}") from error
@@ -0,0 +1,64 @@
+"""Materialized portfolio valuation.
+
+Holds one position (total shares, cost basis) per symbol and the last known
+price of each, and keeps portfolio totals current as either changes: adding a
+lot or receiving a price touches one symbol, never the whole portfolio. A
+symbol without a price is valued at cost, as the summary always did.
+"""
+from typing import Dict, Optional, Tuple
+
+
+class PortfolioValuation:
+    def __init__(self):
+        self.positions: Dict[str, Tuple[float, float]] = {}
+        self.prices: Dict[str, float] = {}
+        self.total_cost = 0.0
+        self.total_value = 0.0
+
+    def _value(self, symbol: str) -> float:
+        shares, cost = self.positions.get(symbol, (0.0, 0.0))
+        price = self.prices.get(symbol)
+        return cost if price is None else shares * price
+
+    def _replace(self, symbol: str, position: Optional[Tuple[float, float]]):
+        old_cost, old_value = self.positions.get(symbol, (0.0, 0.0))[1], self._value(symbol)
+        if position is None:
+            self.positions.pop(symbol, None)
+            self.prices.pop(symbol, None)
+        else:
+            self.positions[symbol] = position
+        new_cost = position[1] if position is not None else 0.0
+        self.total_cost += new_cost - old_cost
+        self.total_value += self._value(symbol) - old_value
+
+    def set_position(self, symbol: str, shares: float, cost: float):
+        self._replace(symbol, (shares, cost))
+
+    def remove_position(self, symbol: str):
+        self._replace(symbol, None)
+
+    def set_price(self, symbol: str, price: float):
+        if symbol not in self.positions:
+            return
+        old_value = self._value(symbol)
+        self.prices[symbol] = price
+        self.total_value += self._value(symbol) - old_value
+
+    def price(self, symbol: str) -> Optional[float]:
+        return self.prices.get(symbol)
+
+    def load(self, positions: Dict[str, Tuple[float, float]]):
+        """Replace every position and recompute totals exactly (clears accumulated float drift)"""
+        self.positions = dict(positions)
+        self.prices = {symbol: price for symbol, price in self.prices.items() if symbol in self.positions}
+        self.total_cost = sum(cost for _, cost in self.positions.values())
+        self.total_value = sum(self._value(symbol) for symbol in self.positions)
+
+    def totals(self) -> Dict:
+        profit_loss = self.total_value - self.total_cost
+        return {
+            'total_invested': round(self.total_cost, 2),
+            'total_current_value': round(self.total_value, 2),
+            'total_profit_loss': round(profit_loss, 2),
+            'total_profit_loss_percent': round((profit_loss / self.total_cost * 100) if self.total_cost > 0 else 0, 2),
+        }
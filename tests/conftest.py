@@ -0,0 +1,75 @@
+"""Test and benchmark harness: the backend runs against local fakes only.
+
+Upstream URLs are pointed at ``tests.fakes`` before ``server`` is imported, and
+MongoDB is replaced by mongomock unless BENCH_MONGO_URI names a real (local)
+server to benchmark against. mongomock scans every document on each query and
+runs synchronously on the event loop, so bar-store heavy numbers (cold
+analyses, portfolio summary) are only comparable between runs of the same
+backend; use a local mongod for absolute figures.
+
+Install the test dependencies with ``pip install -r backend/requirements-dev.txt``
+and run ``python -m pytest tests`` from the repository root.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from . import fakes, loadgen
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+UPSTREAM_SOCKET = fakes.reserve_socket()
+UPSTREAM_URL = fakes.base_url(UPSTREAM_SOCKET)
+
+os.environ.update({
+    'POLYGON_API_KEY': 'bench',
+    'POLYGON_BASE_URL': UPSTREAM_URL,
+    'OPENAI_API_KEY': 'bench',
+    'OPENAI_BASE_URL': f'{UPSTREAM_URL}/v1',
+    'FINVIZ_URL': f'{UPSTREAM_URL}/quote.ashx?t={{symbol}}',
+    'PRICE_FEED': 'off',
+    'BAR_DATA_DIR': tempfile.mkdtemp(prefix='bench-bars-'),
+})
+
+BENCH_MONGO_URI = os.getenv("BENCH_MONGO_URI")
+if BENCH_MONGO_URI:
+    os.environ['MONGO_URI'] = BENCH_MONGO_URI
+    os.environ['DB_NAME'] = os.getenv("BENCH_DB_NAME", "stock_analyzer_bench")
+else:
+    import motor.motor_asyncio
+    from mongomock_motor import AsyncMongoMockClient
+
+    motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: latency/throughput measurement against local fakes")
+
+
+@pytest.fixture(scope="session")
+def upstream():
+    server = fakes.ServerThread(fakes.fake_upstream, UPSTREAM_SOCKET).start()
+    yield UPSTREAM_URL
+    server.stop()
+
+
+@pytest.fixture(scope="session")
+def api_url(upstream):
+    """Base URL of the real backend app served by uvicorn"""
+    import server as backend
+
+    sock = fakes.reserve_socket()
+    app_server = fakes.ServerThread(backend.app, sock).start()
+    yield fakes.base_url(sock)
+    app_server.stop()
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not (loadgen.RESULTS or loadgen.MICRO_RESULTS):
+        return
+    terminalreporter.write_sep("=", "benchmark results")
+    for line in loadgen.report_lines():
+        terminalreporter.write_line(line)
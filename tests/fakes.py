@@ -0,0 +1,197 @@
+"""Local stand-ins for Polygon, FINVIZ and OpenAI.
+
+One FastAPI app answers the three upstream APIs with deterministic data after
+a configurable delay, so the backend can be benchmarked without network
+access. Delays (seconds) come from BENCH_POLYGON_DELAY, BENCH_FINVIZ_DELAY
+and BENCH_OPENAI_DELAY; the ticker list has BENCH_TICKERS entries.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, StreamingResponse
+
+FIXTURES = Path(__file__).parent / "fixtures"
+FINVIZ_QUOTE_HTML = (FIXTURES / "finviz_quote.html").read_bytes()
+
+POLYGON_DELAY = float(os.getenv("BENCH_POLYGON_DELAY", "0.02"))
+FINVIZ_DELAY = float(os.getenv("BENCH_FINVIZ_DELAY", "0.05"))
+OPENAI_DELAY = float(os.getenv("BENCH_OPENAI_DELAY", "0.2"))
+TICKER_COUNT = int(os.getenv("BENCH_TICKERS", "2000"))
+
+AI_ANSWER = """RECOMENDACIÓN: MANTENER
+
+ANÁLISIS:
+Fundamentales sólidos y tendencia alcista moderada; la valoración exigente
+limita el potencial a corto plazo."""
+
+fake_upstream = FastAPI()
+
+
+def ticker_universe(count: int):
+    """A few real listings plus `count` synthetic BNxxx tickers with plausible names"""
+    rng = random.Random(count)
+    first = ['Apex', 'Blue', 'Cedar', 'Delta', 'Eagle', 'First', 'Global', 'Harbor', 'Iron', 'Summit']
+    second = ['Energy', 'Bancorp', 'Therapeutics', 'Industries', 'Semiconductor', 'Realty', 'Foods', 'Systems']
+    suffix = ['Inc.', 'Corp.', 'Holdings', 'Group', 'Ltd.', 'Co.']
+    tickers = [
+        ('AAPL', 'Apple Inc.'),
+        ('MSFT', 'Microsoft Corporation'),
+        ('NVDA', 'NVIDIA Corporation'),
+        ('AMZN', 'Amazon.com, Inc.'),
+        ('GOOGL', 'Alphabet Inc. Class A'),
+    ]
+    tickers += [
+        (f"BN{index:03d}", f"{rng.choice(first)} {rng.choice(second)} {rng.choice(suffix)}")
+        for index in range(count)
+    ]
+    return sorted(tickers)
+
+
+TICKERS = ticker_universe(TICKER_COUNT)
+
+
+def daily_bars(symbol: str, start: datetime, end: datetime):
+    """Deterministic random-walk weekday bars for `symbol` in [start, end]"""
+    rng = random.Random(symbol)
+    epoch = datetime(2020, 1, 1)
+    price = 50 + rng.random() * 200
+    day = epoch
+    bars = []
+    while day <= end:
+        if day.weekday() < 5:
+            open_ = price
+            close = max(1.0, open_ * (1 + rng.gauss(0, 0.015)))
+            high = max(open_, close) * (1 + rng.random() * 0.01)
+            low = min(open_, close) * (1 - rng.random() * 0.01)
+            if day >= start:
+                bars.append({
+                    'o': round(open_, 2), 'h': round(high, 2), 'l': round(low, 2), 'c': round(close, 2),
+                    'v': rng.randint(1_000_000, 50_000_000), 'vw': round((high + low + close) / 3, 2),
+                    't': int(day.replace(tzinfo=timezone.utc).timestamp() * 1000), 'n': rng.randint(10_000, 500_000),
+                })
+            price = close
+        day += timedelta(days=1)
+    return bars
+
+
+@fake_upstream.get("/v2/aggs/ticker/{ticker}/range/{multiplier}/{timespan}/{from_}/{to}")
+async def polygon_aggs(ticker: str, multiplier: int, timespan: str, from_: str, to: str, limit: int = 5000):
+    await asyncio.sleep(POLYGON_DELAY)
+    # Like Polygon, silently truncated at `limit`; NODATA* tickers have no bars
+    bars = daily_bars(ticker, datetime.strptime(from_, '%Y-%m-%d'), datetime.strptime(to, '%Y-%m-%d'))[:limit]
+    if ticker.startswith('NODATA'):
+        bars = []
+    return {'ticker': ticker, 'status': 'OK', 'resultsCount': len(bars), 'results': bars}
+
+
+@fake_upstream.get("/v3/reference/tickers")
+async def polygon_tickers(request: Request, limit: int = 100, cursor: int = 0):
+    await asyncio.sleep(POLYGON_DELAY)
+    page = TICKERS[cursor:cursor + limit]
+    body = {
+        'status': 'OK',
+        'count': len(page),
+        'results': [
+            {'ticker': ticker, 'name': name, 'market': 'stocks', 'active': True} for ticker, name in page
+        ],
+    }
+    if cursor + limit < len(TICKERS):
+        body['next_url'] = str(request.url.replace_query_params(cursor=cursor + limit, limit=limit))
+    return body
+
+
+@fake_upstream.get("/v3/reference/tickers/{ticker}")
+async def polygon_ticker_details(ticker: str):
+    await asyncio.sleep(POLYGON_DELAY)
+    return {'status': 'OK', 'results': {'ticker': ticker, 'name': f'{ticker} Inc.', 'market': 'stocks', 'active': True}}
+
+
+@fake_upstream.get("/quote.ashx")
+async def finviz_quote(t: str):
+    await asyncio.sleep(FINVIZ_DELAY)
+    return Response(FINVIZ_QUOTE_HTML, media_type="text/html")
+
+
+@fake_upstream.post("/v1/chat/completions")
+async def openai_chat(request: Request):
+    body = await request.json()
+    model = body.get('model', 'gpt-4o-mini')
+    if body.get('stream'):
+        return StreamingResponse(openai_chunks(model), media_type="text/event-stream")
+    await asyncio.sleep(OPENAI_DELAY)
+    return {
+        'id': 'chatcmpl-bench',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': AI_ANSWER},
+            'finish_reason': 'stop',
+        }],
+        'usage': {'prompt_tokens': 400, 'completion_tokens': 60, 'total_tokens': 460},
+    }
+
+
+async def openai_chunks(model: str):
+    """AI_ANSWER as chat.completion.chunk server-sent events, a few words at a time"""
+    def chunk(delta: dict, finish_reason=None) -> str:
+        payload = {
+            'id': 'chatcmpl-bench', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+            'model': model, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+        }
+        return f"data: {json.dumps(payload)}\n\n"
+
+    pieces = re.findall(r'\S+\s*', AI_ANSWER)
+    yield chunk({'role': 'assistant', 'content': ''})
+    for start in range(0, len(pieces), 4):
+        # The whole answer still takes about BENCH_OPENAI_DELAY
+        await asyncio.sleep(OPENAI_DELAY * 4 / len(pieces))
+        yield chunk({'content': ''.join(pieces[start:start + 4])})
+    yield chunk({}, 'stop')
+    yield "data: [DONE]\n\n"
+
+
+def reserve_socket() -> socket.socket:
+    """A listening socket on a free local port, bound before anything reads its address"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    return sock
+
+
+def base_url(sock: socket.socket) -> str:
+    host, port = sock.getsockname()
+    return f"http://{host}:{port}"
+
+
+class ServerThread:
+    """Run an ASGI app under uvicorn on its own thread and event loop"""
+
+    def __init__(self, app, sock: socket.socket):
+        self.sock = sock
+        self.server = uvicorn.Server(uvicorn.Config(app, log_level="warning", lifespan="on"))
+        self.thread = threading.Thread(target=self.server.run, kwargs={'sockets': [sock]}, daemon=True)
+
+    def start(self) -> "ServerThread":
+        self.thread.start()
+        deadline = time.monotonic() + 10
+        while not self.server.started:
+            if time.monotonic() > deadline or not self.thread.is_alive():
+                raise RuntimeError("server did not start")
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
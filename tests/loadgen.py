@@ -0,0 +1,101 @@
+"""Closed-loop load generator and timing helpers for the benchmark suite."""
+import asyncio
+import os
+import statistics
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "16"))
+REQUESTS = int(os.getenv("BENCH_REQUESTS", "100"))
+# Optional latency budget; unset means report only
+MAX_P95_MS = float(os.getenv("BENCH_MAX_P95_MS", "0")) or None
+
+
+@dataclass
+class Result:
+    name: str
+    concurrency: int
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    elapsed: float = 0.0
+
+    def percentile(self, p: float) -> float:
+        """Nearest-rank percentile in milliseconds"""
+        ordered = sorted(self.latencies)
+        if not ordered:
+            return 0.0
+        rank = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered) + 0.5) - 1))
+        return ordered[rank] * 1000
+
+    @property
+    def rps(self) -> float:
+        return len(self.latencies) / self.elapsed if self.elapsed else 0.0
+
+    def line(self) -> str:
+        return (f"{self.name:<32} c={self.concurrency:<4} n={len(self.latencies):<6} err={self.errors:<4} "
+                f"p50={self.percentile(50):8.1f}ms p95={self.percentile(95):8.1f}ms "
+                f"p99={self.percentile(99):8.1f}ms {self.rps:9.1f} req/s")
+
+
+RESULTS: List[Result] = []
+# (name, median ms, budget ms)
+MICRO_RESULTS: List[Tuple[str, float, float]] = []
+
+
+def report_lines() -> List[str]:
+    lines = [result.line() for result in RESULTS]
+    lines += [f"{name:<32} median={median:8.3f}ms budget={budget:8.3f}ms" for name, median, budget in MICRO_RESULTS]
+    return lines
+
+
+async def run_load(base_url: str, name: str, path_for: Callable[[int], str],
+                   requests: int = REQUESTS, concurrency: int = CONCURRENCY,
+                   headers: Optional[Dict[str, str]] = None, status: int = 200) -> Result:
+    """Issue `requests` GETs from `concurrency` workers, each waiting for its previous answer.
+
+    A response counts as an error unless it has `status`.
+    """
+    result = Result(name, concurrency)
+    counter = iter(range(requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        async def worker():
+            for index in counter:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(path_for(index), headers=headers)
+                    ok = response.status_code == status
+                except httpx.HTTPError:
+                    ok = False
+                result.latencies.append(time.perf_counter() - start)
+                if not ok:
+                    result.errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        result.elapsed = time.perf_counter() - start
+
+    RESULTS.append(result)
+    return result
+
+
+def check(result: Result, max_p95_ms: Optional[float] = MAX_P95_MS):
+    assert result.errors == 0, f"{result.name}: {result.errors} failed requests"
+    if max_p95_ms is not None:
+        assert result.percentile(95) <= max_p95_ms, result.line()
+
+
+def measure(fn: Callable, *args, repeat: int = 200, warmup: int = 5) -> float:
+    """Median wall time of fn(*args) in milliseconds"""
+    for _ in range(warmup):
+        fn(*args)
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
@@ -0,0 +1,27 @@
+"""Keys of cached LLM analyses stay put while quotes drift."""
+from analysis_cache import bucket, bucket_relative
+
+
+def test_buckets():
+    assert bucket(57.4, 5) == 55 and bucket(57.6, 5) == 60
+    assert bucket_relative(187.43, 0.01) == bucket_relative(187.9, 0.01)
+    assert bucket_relative(187.43, 0.01) != bucket_relative(192.0, 0.01)
+    assert abs(bucket_relative(187.43, 0.01) / 187.43 - 1) < 0.01
+    for value in (None, 'N/A', 0, -3.0, float('nan')):
+        assert bucket_relative(value, 0.01) is value
+
+
+def test_prompt_key_ignores_tick_noise():
+    import server
+
+    data = {'pe_ratio': 31.2, 'rsi': 61.3, 'ema_20': 185.12, 'ema_50': 180.4, 'current_price': 187.43,
+            'target_price': 210.0, 'candlestick_pattern': "Patrón Neutral"}
+    ticked = {**data, 'rsi': 61.9, 'ema_20': 185.2, 'ema_50': 180.41, 'current_price': 187.6}
+    moved = {**data, 'current_price': 195.0}
+
+    def key(analysis_data):
+        return server.ai_cache_key(server.build_ai_messages('AAPL', analysis_data))
+
+    assert key(data) == key(ticked)
+    assert key(data) != key(moved)
+    assert key(data) != key({**data, 'pe_ratio': 29.0})
@@ -0,0 +1,155 @@
+"""Behavior of the API routes against the local fakes."""
+import json
+import time
+
+import httpx
+
+
+def get(api_url: str, path: str, **params) -> dict:
+    response = httpx.get(api_url + path, params=params, timeout=60)
+    response.raise_for_status()
+    return response.json()
+
+
+def test_candlestick_events_index_historical_prices(api_url):
+    for history in (5, 40):
+        analysis = get(api_url, "/api/stocks/BN001/analysis", history=history)
+        prices = analysis['historical_prices']
+        assert len(prices) == history
+        indices = [index for hits in analysis['candlestick_events'].values() for index in hits]
+        assert indices and all(0 <= index < len(prices) for index in indices)
+
+
+def stream_events(api_url: str, symbol: str) -> list:
+    """(event, data) pairs of the analysis stream, in order"""
+    with httpx.stream("GET", f"{api_url}/api/stocks/{symbol}/analysis/stream", timeout=60) as response:
+        response.raise_for_status()
+        text = response.read().decode()
+    events = []
+    for block in text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def test_analysis_stream_sends_market_then_tokens_then_done(api_url):
+    events = stream_events(api_url, "BN150")
+    names = [name for name, _ in events]
+    assert names[0] == "market" and names[-1] == "done"
+    assert events[0][1]['symbol'] == "BN150" and len(events[0][1]['historical_prices']) > 0
+    tokens = [data['text'] for name, data in events if name == "token"]
+    assert len(tokens) > 1
+    # Tokens come before the final answer, which is what they spell out
+    assert names.index("token") < names.index("recommendation") < names.index("done")
+    done = events[-1][1]
+    assert done['recommendation'] == "MANTENER"
+    assert done['ai_analysis'] in "".join(tokens)
+
+    # The answer is cached now: no tokens, same result
+    replay = stream_events(api_url, "BN150")
+    assert [name for name, _ in replay] == ["market", "recommendation", "done"]
+    assert replay[-1][1] == done
+
+
+def test_empty_ai_stream_is_not_cached(api_url, monkeypatch):
+    import server
+
+    async def silent(messages):
+        return
+        yield
+
+    monkeypatch.setattr(server, 'llm_chat_stream', silent)
+    done = stream_events(api_url, "BN151")[-1][1]
+    assert done['ai_analysis'] == "Análisis IA no disponible temporalmente"
+
+    monkeypatch.undo()
+    events = stream_events(api_url, "BN151")
+    assert any(name == "token" for name, _ in events)
+    assert events[-1][1]['ai_analysis'].startswith("Fundamentales")
+
+
+def test_websocket_sends_last_close_for_new_subscriptions(api_url):
+    from websockets.sync.client import connect
+
+    close = get(api_url, "/api/stocks/BN002/history", days=10)['bars']['close'][-1]
+    with connect(api_url.replace("http", "ws") + "/api/ws/prices") as websocket:
+        websocket.send(json.dumps({'action': 'subscribe', 'symbols': ["bn002"]}))
+        update = json.loads(websocket.recv(timeout=30))
+        assert update['symbol'] == "BN002" and update['price'] == close
+        websocket.send(json.dumps({'action': 'nonsense'}))
+        assert 'error' in json.loads(websocket.recv(timeout=30))
+
+
+def test_websocket_streams_replayed_ticks_until_clients_leave(api_url, tmp_path, monkeypatch):
+    import server
+    from price_hub import ReplayPriceFeed
+    from websockets.sync.client import connect
+
+    class TrackedReplay(ReplayPriceFeed):
+        running = False
+
+        async def run(self, publish):
+            self.running = True
+            try:
+                await super().run(publish)
+            finally:
+                self.running = False
+
+    ticks = tmp_path / "ticks.ndjson"
+    ticks.write_text("\n".join(json.dumps(tick) for tick in [
+        {'symbol': "BN400", 'price': 11.0, 'timestamp': 1},
+        {'symbol': "BN401", 'price': 99.0, 'timestamp': 2},
+        {'symbol': "BN400", 'price': 12.0, 'timestamp': 3},
+    ]))
+    feed = TrackedReplay.from_file(str(ticks), interval=0.02)
+    monkeypatch.setattr(server.price_hub, 'feed', feed)
+    monkeypatch.setattr(server.price_hub, 'idle_timeout', 0.1)
+
+    with connect(api_url.replace("http", "ws") + "/api/ws/prices") as websocket:
+        websocket.send(json.dumps({'action': 'subscribe', 'symbols': ["BN400"]}))
+        replayed = set()
+        while replayed != {1, 3}:
+            update = json.loads(websocket.recv(timeout=30))
+            assert update['symbol'] == "BN400"
+            if update['timestamp'] is not None:
+                replayed.add(update['timestamp'])
+                assert update['price'] == {1: 11.0, 3: 12.0}[update['timestamp']]
+        assert feed.running
+
+    # Nobody is subscribed any more: the feed is closed after the idle timeout
+    deadline = time.monotonic() + 10
+    while feed.running and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not feed.running and not feed.symbols
+    assert "BN401" not in server.price_hub.prices
+
+
+def screen(api_url: str, symbols: list, **criteria) -> list:
+    response = httpx.post(f"{api_url}/api/screener", json={'symbols': symbols, 'criteria': criteria}, timeout=60)
+    response.raise_for_status()
+    assert response.headers['content-type'].startswith("application/x-ndjson")
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_screener_streams_one_line_per_symbol(api_url):
+    symbols = [f"BN{index:03d}" for index in range(200, 212)]
+    rows = screen(api_url, symbols + ["bn200", "NODATA1"], max_pe=40)
+    by_symbol = {row['symbol']: row for row in rows}
+    assert len(rows) == len(by_symbol) == len(symbols) + 1
+    assert by_symbol["NODATA1"] == {'symbol': "NODATA1", 'error': "No data available for this symbol"}
+    for symbol in symbols:
+        row = by_symbol[symbol]
+        assert row['pe_ratio'] == 34.12 and 0 <= row['potential_score'] <= 100
+        assert row['ema_20'] is not None and 'ai_analysis' not in row
+
+    # Filtered out rows are not sent at all
+    assert screen(api_url, symbols, max_pe=30) == []
+    up = {row['symbol'] for row in screen(api_url, symbols, ema_trend="up")}
+    assert up == {symbol for symbol in symbols if by_symbol[symbol]['ema_20'] > by_symbol[symbol]['ema_50']}
+
+
+def test_search_quotes_last_close_and_daily_change(api_url):
+    closes = get(api_url, "/api/stocks/BN300/history", days=10)['bars']['close']
+    hit = next(hit for hit in get(api_url, "/api/stocks/search", query="BN300") if hit['symbol'] == "BN300")
+    assert hit['current_price'] == closes[-1]
+    assert hit['change_percent'] == round((closes[-1] - closes[-2]) / closes[-2] * 100, 2)
@@ -0,0 +1,93 @@
+"""Behavior of the memory-mapped bar files: in-place appends, rewrites, open-file bound."""
+import os
+
+import numpy as np
+
+from bar_files import MIN_CAPACITY, BarColumns, BarFiles
+
+DAY_MS = 86_400_000
+
+
+def bars(first_day: int, count: int, close: float = 100.0) -> BarColumns:
+    timestamps = (np.arange(first_day, first_day + count, dtype='<i8')) * DAY_MS
+    prices = np.full(count, close) + np.arange(count)
+    return BarColumns(timestamps, prices, prices + 1, prices - 1, prices, np.full(count, 1e6))
+
+
+def inode(files: BarFiles, symbol: str) -> int:
+    return os.stat(files.path(symbol, 'day')).st_ino
+
+
+def test_appends_in_place_past_published_rows(tmp_path):
+    files = BarFiles(tmp_path)
+    files.write('AAPL', 'day', bars(0, 10))
+    first = inode(files, 'AAPL')
+    before = files.read('AAPL')
+    # The last stored bar again, unchanged, plus two new ones
+    files.write('AAPL', 'day', bars(9, 3, close=109.0))
+    stored = files.read('AAPL')
+    assert inode(files, 'AAPL') == first
+    assert len(stored) == 12 and stored.close[-1] == 111.0
+    # A view handed out earlier does not grow or change
+    assert len(before) == 10 and before.close[-1] == 109.0
+
+
+def test_changed_bar_is_rewritten_without_touching_views(tmp_path):
+    files = BarFiles(tmp_path)
+    files.write('AAPL', 'day', bars(0, 10))
+    first = inode(files, 'AAPL')
+    before = files.read('AAPL')
+    # Today's partial bar updated, plus a new one
+    files.write('AAPL', 'day', bars(9, 2, close=200.0))
+    stored = files.read('AAPL')
+    assert inode(files, 'AAPL') != first
+    assert len(stored) == 11 and stored.close[9] == 200.0 and stored.close[8] == 108.0
+    assert len(before) == 10 and before.close[-1] == 109.0
+
+
+def test_older_history_is_merged_by_rewrite(tmp_path):
+    files = BarFiles(tmp_path)
+    files.write('AAPL', 'day', bars(10, 5))
+    first = inode(files, 'AAPL')
+    files.write('AAPL', 'day', bars(0, 10, close=50.0))
+    stored = files.read('AAPL')
+    assert inode(files, 'AAPL') != first
+    assert stored.timestamp.tolist() == [day * DAY_MS for day in range(15)]
+    # Stored bars newer than the fetched window stay as they were
+    assert stored.close[10] == 100.0
+
+
+def test_outgrowing_capacity_rewrites(tmp_path):
+    files = BarFiles(tmp_path)
+    files.write('AAPL', 'day', bars(0, MIN_CAPACITY))  # room for 2 * MIN_CAPACITY rows
+    first = inode(files, 'AAPL')
+    files.write('AAPL', 'day', bars(MIN_CAPACITY, MIN_CAPACITY - 1))
+    assert inode(files, 'AAPL') == first
+    files.write('AAPL', 'day', bars(2 * MIN_CAPACITY - 1, 5))
+    assert inode(files, 'AAPL') != first
+    stored = files.read('AAPL')
+    assert len(stored) == 2 * MIN_CAPACITY + 4
+    assert np.array_equal(stored.timestamp, np.arange(len(stored)) * DAY_MS)
+
+
+def test_views_survive_file_replacement(tmp_path):
+    files = BarFiles(tmp_path)
+    files.write('AAPL', 'day', bars(10, 5))
+    before = files.read('AAPL')
+    files.write('AAPL', 'day', bars(0, 10))
+    assert before.timestamp[0] == 10 * DAY_MS and len(before) == 5
+    assert len(files.read('AAPL', since_ms=12 * DAY_MS)) == 3
+
+
+def test_open_maps_are_bounded(tmp_path):
+    writer = BarFiles(tmp_path)
+    symbols = [f"S{index:03d}" for index in range(60)]
+    for symbol in symbols:
+        writer.write(symbol, 'day', bars(0, 3))
+    del writer
+
+    files = BarFiles(tmp_path, max_open=8)
+    open_before = len(os.listdir('/proc/self/fd'))
+    for symbol in symbols:
+        assert len(files.read(symbol)) == 3
+    assert len(os.listdir('/proc/self/fd')) - open_before <= 8
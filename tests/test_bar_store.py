@@ -0,0 +1,120 @@
+"""Behavior of the bar store's incremental sync (on mongomock)."""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from mongomock_motor import AsyncMongoMockClient
+from polygon.rest.models import Agg
+
+from bar_files import BarFiles
+from bar_store import BarStore
+from shared_cache import Leases
+
+
+class FakePolygon:
+    """Daily bars with a constant close per day, scaled by `factor` (a split re-adjusts it)"""
+
+    def __init__(self, delay: float = 0):
+        self.factor = 1.0
+        self.delay = delay
+        self.requests = []
+
+    async def fetch(self, symbol, timespan, start, end):
+        self.requests.append((start, end))
+        await asyncio.sleep(self.delay)
+        days = (end - start).days + 1
+        aggs = []
+        for offset in range(days):
+            day = (start + timedelta(days=offset)).replace(tzinfo=timezone.utc)
+            price = (100 + day.toordinal() % 50) * self.factor
+            aggs.append(Agg(open=price, high=price + 1, low=price - 1, close=price, volume=1e6,
+                            timestamp=int(day.timestamp() * 1000)))
+        return aggs
+
+
+def store(tmp_path, polygon: FakePolygon) -> BarStore:
+    db = AsyncMongoMockClient()['bar_store_test']
+    return BarStore(BarFiles(tmp_path), db.bar_syncs, polygon.fetch, refresh_seconds=0)
+
+
+async def age_sync(bars: BarStore, symbol: str, days: int):
+    """Pretend the last sync was `days` ago and stored nothing newer"""
+    past = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)
+    last = past.replace(hour=0, minute=0, second=0, microsecond=0)
+    await bars.syncs.update_one({'_id': f'{symbol}:day'}, {'$set': {'synced_at': past, 'last': last}})
+
+
+def test_tail_pull_starts_one_closed_bar_back(tmp_path):
+    async def run():
+        polygon = FakePolygon()
+        bars = store(tmp_path, polygon)
+        first = await bars.get_bars('AAPL', 30)
+        await age_sync(bars, 'AAPL', 3)
+        polygon.requests.clear()
+
+        again = await bars.get_bars('AAPL', 30)
+        # One small request: the bar before the last synced day onwards
+        assert len(polygon.requests) == 1
+        start, end = polygon.requests[0]
+        assert (end - start).days == 4
+        assert again.close.tolist() == first.close.tolist()
+
+    asyncio.run(run())
+
+
+def test_readjusted_history_is_pulled_again(tmp_path):
+    async def run():
+        polygon = FakePolygon()
+        bars = store(tmp_path, polygon)
+        await bars.get_bars('AAPL', 30)
+        await age_sync(bars, 'AAPL', 3)
+
+        polygon.factor = 0.5  # a 2:1 split re-adjusts every earlier bar
+        polygon.requests.clear()
+        split = await bars.get_bars('AAPL', 30)
+        assert len(polygon.requests) == 2
+        expected = await polygon.fetch('AAPL', 'day', *polygon.requests[-1])
+        assert split.close.tolist() == [agg.close for agg in expected][-len(split):]
+
+    asyncio.run(run())
+
+
+def test_lost_file_resets_the_synced_window(tmp_path):
+    async def run():
+        polygon = FakePolygon()
+        bars = store(tmp_path, polygon)
+        assert len(await bars.get_bars('AAPL', 300)) == 301
+        # Data directory wiped, sync document kept
+        bars.files.path('AAPL', 'day').unlink()
+        assert len(await bars.get_bars('AAPL', 7)) == 8
+        assert len(await bars.get_bars('AAPL', 300)) == 301
+
+    asyncio.run(run())
+
+
+def test_one_worker_fills_a_cold_miss(tmp_path):
+    async def run():
+        polygon = FakePolygon(delay=0.2)
+        db = AsyncMongoMockClient()['bar_store_test']
+        # Worker processes share the data directory and the database, not the lease owner
+        workers = [BarStore(BarFiles(tmp_path), db.bar_syncs, polygon.fetch, leases=Leases(db.leases))
+                   for _ in range(2)]
+        results = await asyncio.gather(*(bars.get_bars('AAPL', 30) for bars in workers))
+        assert len(polygon.requests) == 1
+        assert results[0].close.tolist() == results[1].close.tolist() and len(results[0]) == 31
+        assert not await workers[0].leases.held('bars:AAPL:day')
+
+    asyncio.run(run())
+
+
+def test_tail_is_only_stale_around_the_session(tmp_path):
+    bars = BarStore(BarFiles(tmp_path), None, FakePolygon().fetch, refresh_seconds=60)
+    # Times are naive UTC; 14:00 UTC is 10:00 in New York (EDT)
+    wednesday = datetime(2025, 6, 4, 14, 0)
+    assert not bars.is_stale(wednesday, wednesday + timedelta(seconds=30))
+    assert bars.is_stale(wednesday, wednesday + timedelta(seconds=60))
+    # Synced after Friday's close: nothing new until Monday's open
+    friday_evening = datetime(2025, 6, 6, 22, 0)
+    assert not bars.is_stale(friday_evening, datetime(2025, 6, 9, 13, 0))
+    assert bars.is_stale(friday_evening, datetime(2025, 6, 9, 13, 31))
+    # Synced in session, asked after the close: one more pull for the final bar
+    assert bars.is_stale(datetime(2025, 6, 6, 19, 59), datetime(2025, 6, 6, 21, 0))
@@ -0,0 +1,114 @@
+"""Latency and throughput of the hot API routes against local fakes.
+
+Tune with BENCH_CONCURRENCY, BENCH_REQUESTS, BENCH_SYMBOLS and the fake
+upstream delays (see tests/fakes.py); set BENCH_MAX_P95_MS to fail on
+regressions. Results are printed in the pytest summary.
+"""
+import asyncio
+import os
+
+import httpx
+import pytest
+
+from .loadgen import CONCURRENCY, check, run_load
+
+SYMBOLS = [f"BN{index:03d}" for index in range(int(os.getenv("BENCH_SYMBOLS", "8")))]
+PORTFOLIO_LOTS = int(os.getenv("BENCH_PORTFOLIO_LOTS", "50"))
+
+pytestmark = pytest.mark.benchmark
+
+
+def symbol_at(index: int) -> str:
+    return SYMBOLS[index % len(SYMBOLS)]
+
+
+def test_analysis_cold(api_url):
+    # First request per symbol: every upstream and the LLM are on the path
+    result = asyncio.run(run_load(
+        api_url, "analysis (cold)", lambda i: f"/api/stocks/{symbol_at(i)}/analysis", requests=len(SYMBOLS),
+    ))
+    check(result)
+
+
+def test_analysis_warm(api_url):
+    result = asyncio.run(run_load(api_url, "analysis (warm)", lambda i: f"/api/stocks/{symbol_at(i)}/analysis"))
+    check(result)
+
+
+def test_analysis_not_modified(api_url):
+    # A dashboard re-polling an unchanged analysis revalidates with its ETag
+    path = f"/api/stocks/{symbol_at(0)}/analysis"
+    first = httpx.get(api_url + path, timeout=60)
+    first.raise_for_status()
+    etag = first.headers['ETag']
+    result = asyncio.run(run_load(
+        api_url, "analysis (304)", lambda i: path, headers={'If-None-Match': etag}, status=304,
+    ))
+    check(result)
+
+
+def test_history_since(api_url):
+    path = f"/api/stocks/{symbol_at(0)}/history"
+    full = httpx.get(api_url + path, timeout=60)
+    full.raise_for_status()
+    timestamps = full.json()['bars']['timestamp']
+    # Only the newest bar comes back, to be replaced
+    delta = httpx.get(api_url + path, params={'since': timestamps[-1]}, timeout=60).json()['bars']
+    assert delta['timestamp'] == timestamps[-1:]
+    result = asyncio.run(run_load(
+        api_url, "history (since)", lambda i: f"/api/stocks/{symbol_at(i)}/history?since={timestamps[-1]}",
+    ))
+    check(result)
+
+
+def test_search(api_url):
+    result = asyncio.run(run_load(api_url, "search", lambda i: f"/api/stocks/search?query={symbol_at(i)}"))
+    check(result)
+
+
+NAME_QUERIES = ["apple", "harbor ener", "Microsft", "summit bancorp", "nvid"]
+
+
+def test_search_by_name(api_url):
+    async def wait_for_index():
+        # The ticker snapshot is pulled in the background after startup
+        async with httpx.AsyncClient(base_url=api_url) as client:
+            for _ in range(100):
+                response = await client.get("/api/stocks/search", params={'query': "apple"})
+                if response.status_code == 200 and response.json():
+                    return response.json()
+                await asyncio.sleep(0.1)
+        pytest.fail("ticker index was not built")
+
+    assert asyncio.run(wait_for_index())[0]['symbol'] == "AAPL"
+    result = asyncio.run(run_load(
+        api_url, "search (name, fuzzy)", lambda i: f"/api/stocks/search?query={NAME_QUERIES[i % len(NAME_QUERIES)]}",
+    ))
+    check(result)
+
+
+def test_portfolio_summary(api_url):
+    async def seed():
+        async with httpx.AsyncClient(base_url=api_url) as client:
+            for index in range(PORTFOLIO_LOTS):
+                response = await client.post("/api/portfolio", json={
+                    'symbol': symbol_at(index),
+                    'name': f"{symbol_at(index)} Inc.",
+                    'shares': 10 + index,
+                    'purchase_price': 100.0,
+                    'purchase_date': "2025-01-02T00:00:00Z",
+                })
+                response.raise_for_status()
+
+    asyncio.run(seed())
+    summary = httpx.get(api_url + "/api/portfolio/summary", timeout=60)
+    assert summary.status_code == 200 and len(summary.json()['stocks']) == PORTFOLIO_LOTS
+    revalidated = httpx.get(
+        api_url + "/api/portfolio/summary", headers={'If-None-Match': summary.headers['ETag']}, timeout=60,
+    )
+    assert revalidated.status_code == 304
+    result = asyncio.run(run_load(
+        api_url, f"portfolio summary ({PORTFOLIO_LOTS} lots)", lambda i: "/api/portfolio/summary",
+        concurrency=max(1, CONCURRENCY // 4),
+    ))
+    check(result)
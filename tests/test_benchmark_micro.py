@@ -0,0 +1,113 @@
+"""Micro-benchmarks for the CPU-bound helpers on the analysis path.
+
+Budgets are ~20x the medians measured on a laptop, loose enough for noisy CI
+but tight enough to catch a return to per-bar Python loops or full-page HTML
+parsing. Scale them with BENCH_BUDGET_SCALE on slow machines.
+"""
+import os
+from datetime import datetime
+
+import pytest
+
+from .fakes import FINVIZ_QUOTE_HTML, daily_bars, ticker_universe
+from .loadgen import MICRO_RESULTS, measure
+
+BUDGET_SCALE = float(os.getenv("BENCH_BUDGET_SCALE", "1"))
+
+pytestmark = pytest.mark.benchmark
+
+# About 300 sessions, the history an analysis works on
+BARS = daily_bars("BENCH", datetime(2024, 1, 1), datetime(2025, 3, 1))
+CLOSES = [bar['c'] for bar in BARS]
+# Roughly the size of the US stock listing
+TICKERS = ticker_universe(12000)
+
+
+def assert_within(name: str, median_ms: float, budget_ms: float):
+    budget_ms *= BUDGET_SCALE
+    MICRO_RESULTS.append((name, median_ms, budget_ms))
+    assert median_ms <= budget_ms, f"{name}: median {median_ms:.3f}ms over budget {budget_ms:.3f}ms"
+
+
+@pytest.mark.parametrize("period", [20, 50])
+def test_ema(period):
+    import indicators
+
+    assert_within(f"indicators.ema({period})", measure(indicators.ema, CLOSES, period), 2.0)
+
+
+def test_candlestick_scan():
+    import candles
+
+    opens, highs, lows, closes = ([bar[key] for bar in BARS] for key in 'ohlc')
+    assert_within("candles.scan", measure(candles.scan, opens, highs, lows, closes), 5.0)
+
+
+def test_technicals_summary():
+    import technicals
+
+    opens, highs, lows, closes = ([bar[key] for bar in BARS] for key in 'ohlc')
+    assert_within("technicals.summarize", measure(technicals.summarize, opens, highs, lows, closes), 20.0)
+
+
+def test_finviz_parser():
+    import fundamentals
+
+    parsed = fundamentals.parse_fundamentals(FINVIZ_QUOTE_HTML)
+    assert parsed['pe_ratio'] == 34.12 and parsed['market_cap'] == '3.34T'
+    assert_within("parse_fundamentals", measure(fundamentals.parse_fundamentals, FINVIZ_QUOTE_HTML), 10.0)
+
+
+def test_finviz_parser_against_soup():
+    import fundamentals
+
+    fast = measure(fundamentals.parse_snapshot, FINVIZ_QUOTE_HTML)
+    soup = measure(fundamentals.parse_snapshot_soup, FINVIZ_QUOTE_HTML, repeat=10, warmup=1)
+    assert fundamentals.parse_snapshot(FINVIZ_QUOTE_HTML) == fundamentals.parse_snapshot_soup(FINVIZ_QUOTE_HTML)
+    # The reference parser is the budget: the fast path must stay well clear of it
+    assert_within("parse_snapshot (vs soup / 10)", fast, soup / 10)
+
+
+@pytest.fixture(scope="module")
+def tickers():
+    import ticker_index
+
+    index = ticker_index.TickerIndex([{'ticker': ticker, 'name': name} for ticker, name in TICKERS])
+    assert index.search("Microsft")[0]['symbol'] == "MSFT"
+    return index
+
+
+@pytest.mark.parametrize("query", ["BN12", "harbor ener", "Microsft"])
+def test_ticker_search(tickers, query):
+    assert_within(f"ticker search ({query})", measure(tickers.search, query), 2.0)
+
+
+def test_bar_file_read(tmp_path):
+    import numpy as np
+
+    from bar_files import BarColumns, BarFiles
+
+    files = BarFiles(tmp_path)
+    bars = daily_bars("BENCH", datetime(2015, 1, 1), datetime(2025, 3, 1))
+    files.write("BENCH", "day", BarColumns(*(
+        np.array([bar[key] for bar in bars]) for key in ('t', 'o', 'h', 'l', 'c', 'v')
+    )))
+    assert files.read("BENCH").close.tolist() == [bar['c'] for bar in bars]
+    assert_within("BarFiles.read", measure(files.read, "BENCH", "day", bars[-300]['t']), 0.2)
+
+
+def test_backtest_batch():
+    import numpy as np
+
+    import backtest
+
+    batch = [
+        tuple(np.array([bar[key] for bar in daily_bars(f"BT{row}", datetime(2020, 1, 1), datetime(2025, 3, 1))])
+              for key in 'ohlc')
+        for row in range(64)
+    ]
+    assert_within(
+        "backtest.evaluate_batch (64 sym)",
+        measure(backtest.evaluate_batch, batch, [0] * len(batch), [5, 20, 60], [0, 40, 50, 60, 70, 80, 101], repeat=5),
+        1000.0,
+    )
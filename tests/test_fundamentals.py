@@ -0,0 +1,66 @@
+"""The fast FINVIZ snapshot parser agrees with the BeautifulSoup reference; the store's misses."""
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from fundamentals import FundamentalsStore, parse_fundamentals, parse_snapshot, parse_snapshot_soup
+from shared_cache import Leases
+
+from .fakes import FINVIZ_QUOTE_HTML
+
+VARIANTS = {
+    'fixture': FINVIZ_QUOTE_HTML,
+    # Tooltip markup in an attribute: '>' inside quotes does not end the tag
+    'markup in attribute': FINVIZ_QUOTE_HTML.replace(
+        b'data-boxover-html="P/E"', b'data-boxover-html="<b>P/E</b> ratio"',
+    ),
+    'single quotes': FINVIZ_QUOTE_HTML.replace(
+        b'data-boxover-html="EPS (ttm)"', b"data-boxover-html='<i>EPS</i> > 0'",
+    ),
+    'entities and spacing': FINVIZ_QUOTE_HTML.replace(
+        b'<div class="snapshot-td-label">P/E</div>', b'<div class="snapshot-td-label">\n P&#47;E </div>',
+    ),
+}
+
+
+@pytest.mark.parametrize("html", VARIANTS.values(), ids=VARIANTS.keys())
+def test_matches_soup(html):
+    assert parse_snapshot(html) == parse_snapshot_soup(html)
+    assert parse_fundamentals(html)['pe_ratio'] == 34.12
+
+
+def test_missing_labels_fall_back_to_soup():
+    # A closing tag inside an attribute cuts the scanned block short
+    html = FINVIZ_QUOTE_HTML.replace(b'data-boxover-html="Index"', b'data-boxover-html="</table>"')
+    assert parse_snapshot(html) == parse_snapshot_soup(html)
+    assert parse_fundamentals(html)['market_cap'] == '3.34T'
+
+
+class SlowFinviz:
+    """Serves the quote fixture after a delay, counting downloads"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def get(self, url, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(0.2)
+        return self
+
+    def raise_for_status(self):
+        pass
+
+    content = FINVIZ_QUOTE_HTML
+
+
+def test_one_worker_downloads_a_cold_miss():
+    async def run():
+        finviz = SlowFinviz()
+        db = AsyncMongoMockClient()['fundamentals_test']
+        workers = [FundamentalsStore(db.fundamentals, finviz, leases=Leases(db.leases)) for _ in range(2)]
+        results = await asyncio.gather(*(store.get('AAPL') for store in workers))
+        assert finviz.calls == 1
+        assert results[0] == results[1] and results[0]['pe_ratio'] == 34.12
+
+    asyncio.run(run())
@@ -0,0 +1,23 @@
+"""Session-aware refresh intervals."""
+from datetime import datetime, timezone
+
+from market_hours import market_interval, market_ttl
+
+
+def utc(*args) -> datetime:
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_market_interval_follows_the_session():
+    # Wednesday 10:00 New York (EDT)
+    assert market_interval(300, 3600, utc(2025, 6, 4, 14, 0)) == 300
+    # Closed: the closed interval, but never past the next open
+    assert market_interval(300, 3600, utc(2025, 6, 4, 22, 0)) == 3600
+    assert market_interval(300, 3600, utc(2025, 6, 5, 13, 20)) == 600
+    assert market_interval(300, 3600, utc(2025, 6, 5, 13, 30)) == 300
+
+
+def test_market_ttl_lasts_until_the_open():
+    friday_evening = utc(2025, 6, 6, 22, 0)
+    assert market_ttl(60, friday_evening) == (utc(2025, 6, 9, 13, 30) - friday_evening).total_seconds()
+    assert market_ttl(60, utc(2025, 6, 4, 14, 0)) == 60
@@ -0,0 +1,127 @@
+"""Behavior of portfolio positions and the materialized valuation (on mongomock)."""
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+from mongomock_motor import AsyncMongoMockClient
+
+from portfolio import PortfolioStore
+from valuation import PortfolioValuation
+
+
+def store() -> PortfolioStore:
+    db = AsyncMongoMockClient()['portfolio_test']
+    return PortfolioStore(db.portfolio, db.portfolio_positions, db.counters, batch_size=2)
+
+
+def lot(lot_id: str, symbol: str, shares: float, price: float) -> dict:
+    return {'id': lot_id, 'symbol': symbol, 'name': symbol, 'shares': shares, 'purchase_price': price,
+            'purchase_date': datetime(2025, 1, 2, tzinfo=timezone.utc)}
+
+
+def test_rebuild_replaces_positions_in_place():
+    async def run():
+        portfolio = store()
+        for item in (lot('a', 'AAPL', 2, 100), lot('b', 'AAPL', 1, 130), lot('c', 'MSFT', 3, 50)):
+            await portfolio.insert(item)
+        # Drift and a leftover position for a symbol without lots
+        await portfolio.positions.update_one({'_id': 'AAPL'}, {'$inc': {'shares': 5}})
+        await portfolio.positions.insert_one({'_id': 'GONE', 'shares': 1, 'cost': 1, 'lots': 1})
+
+        # Workers starting together must not trip over each other
+        await asyncio.gather(portfolio.rebuild_positions(), portfolio.rebuild_positions())
+        assert await portfolio.load_positions() == {'AAPL': (3, 330), 'MSFT': (3, 150)}
+
+    asyncio.run(run())
+
+
+def test_version_follows_lot_changes():
+    async def run():
+        portfolio = store()
+        empty = await portfolio.version()
+        await portfolio.insert(lot('a', 'AAPL', 1, 100))
+        one = await portfolio.version()
+        await portfolio.insert(lot('b', 'AAPL', 1, 100))
+        two = await portfolio.version()
+        await portfolio.delete('b')
+        assert len({empty, one, two}) == 3
+        assert await portfolio.version() == one
+
+    asyncio.run(run())
+
+
+async def all_pages(portfolio: PortfolioStore, limit: int) -> list:
+    """Lot ids page by page, following the cursors"""
+    ids, cursor = [], None
+    while True:
+        lots, cursor = await portfolio.page(limit, cursor)
+        ids.append([item['id'] for item in lots])
+        if cursor is None:
+            return ids
+
+
+def test_pages_follow_insertion_order_across_workers():
+    async def run():
+        portfolio = store()
+        # Another process's ObjectId can sort after ours although it was inserted first
+        await portfolio.insert(dict(lot('a', 'AAPL', 1, 100), _id=ObjectId.from_datetime(datetime(2030, 1, 1))))
+        for lot_id in 'bcd':
+            await portfolio.insert(lot(lot_id, 'MSFT', 1, 50))
+        assert await all_pages(portfolio, 2) == [['a', 'b'], ['c', 'd']]
+
+        # A lot added after a page was read shows up on the next one
+        first, cursor = await portfolio.page(3)
+        await portfolio.insert(lot('e', 'NVDA', 1, 10))
+        rest, end = await portfolio.page(3, cursor)
+        assert [item['id'] for item in first + rest] == list('abcde') and end is None
+        assert all('seq' not in item and '_id' not in item for item in first + rest)
+        assert [item['id'] async for item in portfolio.iter_lots()] == list('abcde')
+
+        with pytest.raises(ValueError):
+            await portfolio.page(2, 'not-a-cursor')
+
+    asyncio.run(run())
+
+
+def test_migrations_convert_dates_and_number_lots():
+    async def run():
+        portfolio = store()
+        # Lots saved by the old code: ISO-string dates and no sequence number
+        for lot_id in 'abc':
+            await portfolio.collection.insert_one({
+                **lot(lot_id, 'AAPL', 1, 100),
+                'purchase_date': '2025-01-02T00:00:00+00:00', 'timestamp': '2025-01-03T12:30:00',
+            })
+        await portfolio.collection.insert_one(lot('d', 'AAPL', 1, 100))
+
+        assert await portfolio.migrate_dates() == 3
+        assert await portfolio.migrate_dates() == 0
+        assert await portfolio.migrate_seq() == 4
+        assert await portfolio.migrate_seq() == 0
+
+        await portfolio.insert(lot('e', 'AAPL', 1, 100))
+        lots, _ = await portfolio.page(10)
+        assert [item['id'] for item in lots] == list('abcde')
+        assert lots[0]['purchase_date'] == datetime(2025, 1, 2, tzinfo=timezone.utc)
+        assert lots[0]['timestamp'] == datetime(2025, 1, 3, 12, 30, tzinfo=timezone.utc)
+
+    asyncio.run(run())
+
+
+def test_valuation_totals_track_positions_and_prices():
+    valuation = PortfolioValuation()
+    valuation.set_position('AAPL', 3, 330)
+    valuation.set_position('MSFT', 3, 150)
+    # Unpriced symbols count at cost
+    assert valuation.totals()['total_current_value'] == 480
+    valuation.set_price('AAPL', 120)
+    valuation.set_price('NVDA', 999)  # not held: ignored
+    assert valuation.totals()['total_current_value'] == 510
+    valuation.remove_position('MSFT')
+    assert valuation.totals() == {
+        'total_invested': 330, 'total_current_value': 360,
+        'total_profit_loss': 30, 'total_profit_loss_percent': 9.09,
+    }
+    valuation.load({'AAPL': (3, 330)})
+    assert valuation.totals()['total_current_value'] == 360
@@ -0,0 +1,72 @@
+"""Behavior of the shared live price hub."""
+import asyncio
+
+from price_hub import PriceHub, PriceSubscriber
+
+
+class RecordingFeed:
+    """Counts connections and what is subscribed upstream"""
+
+    def __init__(self):
+        self.symbols = set()
+        self.connections = 0
+        self.open = False
+
+    def subscribe(self, symbol):
+        self.symbols.add(symbol)
+
+    def unsubscribe(self, symbol):
+        self.symbols.discard(symbol)
+
+    async def run(self, publish):
+        self.connections += 1
+        self.open = True
+        await asyncio.Event().wait()
+
+    async def close(self):
+        self.open = False
+
+
+def test_watchers_see_client_prices_without_subscribing():
+    async def run():
+        feed = RecordingFeed()
+        hub = PriceHub(feed)
+        watcher, client = PriceSubscriber(), PriceSubscriber()
+        hub.watch(watcher)
+        await asyncio.sleep(0.01)
+        assert feed.connections == 0 and not feed.symbols
+
+        hub.subscribe(client, ['AAPL'])
+        await asyncio.sleep(0.01)
+        assert feed.connections == 1 and feed.symbols == {'AAPL'}
+        hub.publish('AAPL', 190.5, 1)
+        assert [update['price'] for update in await watcher.next_updates()] == [190.5]
+        await hub.close()
+
+    asyncio.run(run())
+
+
+def test_feed_closes_when_idle():
+    async def run():
+        feed = RecordingFeed()
+        hub = PriceHub(feed, idle_timeout=0.05)
+        client = PriceSubscriber()
+        hub.subscribe(client, ['AAPL'])
+        await asyncio.sleep(0.01)
+
+        # A quick resubscribe keeps the connection
+        hub.drop(client)
+        hub.subscribe(client, ['MSFT'])
+        await asyncio.sleep(0.1)
+        assert feed.open and feed.connections == 1 and feed.symbols == {'MSFT'}
+
+        hub.drop(client)
+        await asyncio.sleep(0.1)
+        assert not feed.open and not feed.symbols
+
+        hub.subscribe(client, ['NVDA'])
+        await asyncio.sleep(0.01)
+        assert feed.open and feed.connections == 2
+        await hub.close()
+
+    asyncio.run(run())
@@ -0,0 +1,81 @@
+"""Behavior of the cross-worker cache and its leases (on mongomock)."""
+import asyncio
+import time
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from shared_cache import Leases, SharedCache
+from upstream import UpstreamUnavailable, deadline_scope
+
+
+def workers(count: int = 2, **kwargs):
+    """Caches as separate worker processes would build them over one database"""
+    db = AsyncMongoMockClient()['shared_cache_test']
+    return [SharedCache(db.cache, Leases(db.leases), 'test', **kwargs) for _ in range(count)]
+
+
+def test_one_load_across_workers():
+    async def run():
+        calls = 0
+
+        async def load():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.2)
+            return 'value'
+
+        caches = workers(lease_seconds=5)
+        results = await asyncio.gather(*(cache.get_or_load('key', load, 60) for cache in caches))
+        assert results == ['value', 'value'] and calls == 1
+        assert not await caches[0].leases.held('test:key')
+
+    asyncio.run(run())
+
+
+def test_waiter_takes_over_when_holder_fails():
+    async def run():
+        holder, waiter = workers(lease_seconds=30)
+
+        async def fail():
+            await asyncio.sleep(0.1)
+            raise RuntimeError("upstream down")
+
+        async def load():
+            return 'value'
+
+        start = time.monotonic()
+        results = await asyncio.gather(
+            holder.fill('key', fail, 60), waiter.fill('key', load, 60), return_exceptions=True,
+        )
+        assert isinstance(results[0], RuntimeError) and results[1] == 'value'
+        # Far sooner than the 30s lease
+        assert time.monotonic() - start < 2
+
+    asyncio.run(run())
+
+
+def test_waiter_stops_at_request_deadline():
+    async def run():
+        holder, waiter = workers(lease_seconds=30)
+        assert await holder.leases.acquire('test:key', 30)
+        start = time.monotonic()
+        with deadline_scope(0.3):
+            with pytest.raises(UpstreamUnavailable):
+                await waiter.fill('key', lambda: asyncio.sleep(0), 60)
+        assert time.monotonic() - start < 1
+
+    asyncio.run(run())
+
+
+def test_lease_excludes_other_owners_until_expiry():
+    async def run():
+        first, second = (cache.leases for cache in workers())
+        assert await first.acquire('job', 0.1)
+        assert not await second.acquire('job', 0.1)
+        await asyncio.sleep(0.15)
+        assert await second.acquire('job', 10)
+        await first.release('job')  # not its lease any more
+        assert await second.held('job')
+
+    asyncio.run(run())
@@ -0,0 +1,58 @@
+"""Behavior of request coalescing."""
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    async def run():
+        calls = 0
+
+        async def work(value):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return value
+
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do('key', work, 'a') for _ in range(5)), flight.do('other', work, 'b'))
+        assert results == ['a'] * 5 + ['b'] and calls == 2
+        # Nothing is cached once the call finished
+        assert len(flight) == 0
+        await flight.do('key', work, 'a')
+        assert calls == 3
+
+    asyncio.run(run())
+
+
+def test_callers_share_the_exception():
+    async def run():
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        flight = SingleFlight()
+        results = await asyncio.gather(flight.do('key', fail), flight.do('key', fail), return_exceptions=True)
+        assert [type(result) for result in results] == [ValueError, ValueError]
+
+    asyncio.run(run())
+
+
+def test_cancelled_caller_leaves_the_work_running():
+    async def run():
+        async def work():
+            await asyncio.sleep(0.05)
+            return 'done'
+
+        flight = SingleFlight()
+        first = asyncio.create_task(flight.do('key', work))
+        second = asyncio.create_task(flight.do('key', work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert await second == 'done'
+
+    asyncio.run(run())
@@ -0,0 +1,132 @@
+"""Behavior of the resilient upstream layer (breaker, limiter, deadlines)."""
+import asyncio
+
+import pytest
+
+from upstream import Upstream, UpstreamUnavailable, deadline_scope, fresh_context, remaining_time
+
+
+def half_open(**kwargs) -> Upstream:
+    """An upstream whose breaker is open and due for its probe"""
+    upstream = Upstream('test', timeout=1, retries=0, failure_threshold=1, reset_timeout=0.01, **kwargs)
+    upstream.breaker.record_failure()
+    assert upstream.breaker.is_open
+    return upstream
+
+
+async def ok(timeout):
+    return 'ok'
+
+
+async def recovers(upstream: Upstream):
+    await asyncio.sleep(0.02)
+    assert await upstream.call(ok) == 'ok'
+    assert not upstream.breaker.is_open
+
+
+def test_breaker_opens_fails_fast_and_serves_stale():
+    async def run():
+        upstream = Upstream('test', timeout=1, retries=0, failure_threshold=2, reset_timeout=60)
+        assert await upstream.call(ok, stale_key='quote') == 'ok'
+        calls = 0
+
+        async def down(timeout):
+            nonlocal calls
+            calls += 1
+            raise ConnectionError("refused")
+
+        for _ in range(2):
+            with pytest.raises(UpstreamUnavailable, match="failed"):
+                await upstream.call(down)
+        assert upstream.breaker.is_open
+        # Open: rejected without touching the upstream, or the last good value
+        with pytest.raises(UpstreamUnavailable, match="circuit open"):
+            await upstream.call(down)
+        assert await upstream.call(down, stale_key='quote') == 'ok'
+        assert calls == 2
+
+    asyncio.run(run())
+
+
+def test_client_errors_do_not_trip_the_breaker():
+    async def run():
+        upstream = Upstream('test', timeout=1, retries=2, failure_threshold=1)
+        calls = 0
+
+        async def bad_request(timeout):
+            nonlocal calls
+            calls += 1
+            raise ValueError("unknown symbol")
+
+        with pytest.raises(ValueError):
+            await upstream.call(bad_request)
+        assert calls == 1 and not upstream.breaker.is_open
+
+    asyncio.run(run())
+
+
+def test_probe_survives_deadline():
+    async def run():
+        upstream = half_open()
+        await asyncio.sleep(0.02)
+        with deadline_scope(0):
+            with pytest.raises(UpstreamUnavailable, match="deadline"):
+                await upstream.call(ok)
+        await recovers(upstream)
+
+    asyncio.run(run())
+
+
+def test_probe_survives_no_capacity():
+    async def run():
+        upstream = half_open(concurrency=1)
+        await upstream.limiter.acquire()  # every slot busy
+        await asyncio.sleep(0.02)
+        with deadline_scope(0.05):
+            with pytest.raises(UpstreamUnavailable, match="no capacity"):
+                await upstream.call(ok)
+        await upstream.limiter.release(False, None)
+        await recovers(upstream)
+
+    asyncio.run(run())
+
+
+def test_probe_survives_cancellation():
+    async def run():
+        upstream = half_open()
+        await asyncio.sleep(0.02)
+        probe = asyncio.create_task(upstream.call(lambda timeout: asyncio.sleep(10)))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert upstream.limiter.in_flight == 0
+        await recovers(upstream)
+
+    asyncio.run(run())
+
+
+def test_before_attempt_wait_is_not_upstream_time():
+    async def run():
+        upstream = Upstream('test', timeout=0.05, retries=0, failure_threshold=1, concurrency=4)
+
+        async def slow_budget():
+            await asyncio.sleep(0.1)  # longer than the upstream timeout
+
+        assert await upstream.call(ok, before_attempt=slow_budget) == 'ok'
+        assert not upstream.breaker.is_open
+        assert upstream.limiter.limit >= 4
+
+    asyncio.run(run())
+
+
+def test_fresh_context_drops_request_deadline():
+    async def body():
+        for _ in range(2):
+            yield remaining_time()
+
+    async def run():
+        with deadline_scope(30):
+            return [item async for item in fresh_context(body())]
+
+    assert asyncio.run(run()) == [None, None]